@@ -6,6 +6,7 @@ Grafo LangGraph con routing por perfil (alumnos / profesores).
 from __future__ import annotations
 
 import asyncio
+import time
 import uuid
 from typing import Annotated, Literal
 from typing_extensions import TypedDict
@@ -16,13 +17,21 @@ from langgraph.checkpoint.memory import MemorySaver
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import AIMessage, SystemMessage, HumanMessage, ToolMessage
 from langchain_core.runnables import RunnableConfig
+from langchain_core.callbacks.manager import adispatch_custom_event
 import os
 
+from .PlanificadorLLM import planificador_llm, rpm_proveedor
+from .RouterLLM import RouterChatLLM, _clasificar_error, parsear_spec
+from .ConstructorContexto import construir_contexto
+from . import CacheTools, LatenciaTools
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Checkpointer persistente (SQLite) con fallback a MemorySaver
 # ─────────────────────────────────────────────────────────────────────────────
 _checkpointer = None
 _checkpointer_conn = None  # conexión aiosqlite de larga vida (no cerrar entre requests)
+# Varios grafos se compilan a la vez (warmup): sin cerrojo cada uno abriría su propia conexión
+_checkpointer_lock = asyncio.Lock()
 
 
 def _ruta_checkpoints_db() -> str:
@@ -48,29 +57,57 @@ async def _get_checkpointer():
     context manager que cerraría la conexión al salir del 'async with',
     incompatible con un grafo estático compilado una sola vez.
 
+    CHECKPOINT_MODO=diferido usa CheckpointerDiferido: estado caliente en
+    memoria y escrituras agrupadas en SQLite cada CHECKPOINT_FLUSH_SEGUNDOS.
+
     Fallback a MemorySaver si langgraph-checkpoint-sqlite/aiosqlite no están.
     """
     global _checkpointer, _checkpointer_conn
     if _checkpointer is not None:
         return _checkpointer
-    try:
-        import aiosqlite
-        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
-
-        ruta = _ruta_checkpoints_db()
-        _checkpointer_conn = await aiosqlite.connect(ruta)
-        saver = AsyncSqliteSaver(_checkpointer_conn)
-        await saver.setup()
-        _checkpointer = saver
-        print(f"✅ [MEMORIA] AsyncSqliteSaver persistente en {ruta}")
-    except Exception as e:
-        _checkpointer = MemorySaver()
-        print(f"ℹ️  [MEMORIA] Fallback a MemorySaver (sin persistencia entre reinicios). Motivo: {e}")
-    return _checkpointer
+    async with _checkpointer_lock:
+        if _checkpointer is not None:
+            return _checkpointer
+        try:
+            import aiosqlite
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+            ruta = _ruta_checkpoints_db()
+            _checkpointer_conn = await aiosqlite.connect(ruta)
+            # auto_vacuum=INCREMENTAL: CheckpointService devuelve las páginas libres
+            # por tandas sin un VACUUM completo. Las bases anteriores se convierten
+            # una sola vez aquí, antes de que el saver atienda peticiones.
+            async with _checkpointer_conn.execute("PRAGMA auto_vacuum") as cur:
+                modo_vacuum = (await cur.fetchone())[0]
+            if modo_vacuum != 2:
+                await _checkpointer_conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                await _checkpointer_conn.execute("VACUUM")
+            if os.getenv("CHECKPOINT_MODO", "directo").strip().lower() == "diferido":
+                from .CheckpointerDiferido import CheckpointerDiferido
+                saver = CheckpointerDiferido(_checkpointer_conn)
+            else:
+                saver = AsyncSqliteSaver(_checkpointer_conn)
+            await saver.setup()
+            _checkpointer = saver
+            print(f"✅ [MEMORIA] {type(saver).__name__} persistente en {ruta}")
+        except Exception as e:
+            _checkpointer = MemorySaver()
+            print(f"ℹ️  [MEMORIA] Fallback a MemorySaver (sin persistencia entre reinicios). Motivo: {e}")
+        return _checkpointer
+
+
+async def cerrar_checkpointer() -> None:
+    """Vuelca las escrituras pendientes (modo diferido) y cierra la conexión SQLite."""
+    global _checkpointer, _checkpointer_conn
+    if _checkpointer is not None and hasattr(_checkpointer, "cerrar"):
+        await _checkpointer.cerrar()
+    if _checkpointer_conn is not None:
+        await _checkpointer_conn.close()
+    _checkpointer, _checkpointer_conn = None, None
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Helper: retry con backoff para rate-limit 429 de Gemini (free tier: 5 rpm)
+# Helper: invocación planificada con reintento ante 429 de Gemini (free tier: 5 rpm)
 # ─────────────────────────────────────────────────────────────────────────────
 
 async def _llm_invoke_con_retry(
@@ -78,30 +115,37 @@ async def _llm_invoke_con_retry(
     mensajes,
     config: RunnableConfig | None = None,
     max_intentos: int = 4,
-    espera_base: float = 20.0,
 ):
     """
-    Llama a llm.ainvoke(mensajes) con reintentos automáticos ante 429 RESOURCE_EXHAUSTED.
+    Llama a llm.ainvoke(mensajes) pasando por el planificador global de LLM.
+
+    La prioridad ('stream' | 'chat' | 'warmup') y la clave de reparto justo se
+    leen de config["configurable"] (prioridad_llm / usuario_id o thread_id).
 
-    Distingue dos tipos de límite:
-    - PerMinute → reintenta con backoff exponencial (espera_base * 2^i)
-    - PerDay    → falla inmediatamente con mensaje claro (reintentar en segundos no sirve)
+    Distingue dos tipos de límite (clasificados como en el router):
+    - por minuto → pausa el cupo de ese proveedor y vuelve a encolarse (sin sleeps ciegos)
+    - diaria     → falla inmediatamente con mensaje claro (reintentar en segundos no sirve)
     """
     import re as _re
+    configurable = (config or {}).get("configurable", {})
+    prioridad = configurable.get("prioridad_llm", "chat")
+    clave = configurable.get("usuario_id") or configurable.get("thread_id") or "default"
+    proveedores = getattr(llm, "nombres", None) or _PROVEEDORES_LLM.get(id(llm))
+
     for intento in range(1, max_intentos + 1):
         try:
-            if config is not None:
-                return await llm.ainvoke(mensajes, config=config)
-            return await llm.ainvoke(mensajes)
+            async with planificador_llm.turno(prioridad, clave=clave, proveedores=proveedores):
+                if config is not None:
+                    return await llm.ainvoke(mensajes, config=config)
+                return await llm.ainvoke(mensajes)
         except Exception as e:
             err = str(e)
-            es_rate_limit = "429" in err or "RESOURCE_EXHAUSTED" in err
-
-            if not es_rate_limit:
+            fallo = _clasificar_error(e)
+            if fallo is None or fallo[0] not in ("cuota diaria", "cuota por minuto"):
                 raise  # error diferente al rate-limit
 
             # ¿Es cuota diaria? No tiene sentido reintentar.
-            if "PerDay" in err or "per_day" in err.lower():
+            if fallo[0] == "cuota diaria":
                 m = _re.search(r"model['\"]?\s*[:\s]+['\"]?([a-z0-9._-]+)", err)
                 modelo = m.group(1) if m else "desconocido"
                 raise RuntimeError(
@@ -110,32 +154,37 @@ async def _llm_invoke_con_retry(
                     "Considera activar facturación en https://ai.dev/rate-limit"
                 ) from e
 
-            # Cuota por minuto → reintentar con backoff
+            # Cuota por minuto: turno() ya pausó ese cupo → volver a esperar turno
             if intento < max_intentos:
-                wait = espera_base * (2 ** (intento - 1))
-                print(f"   ⏳ [LLM Rate-limit/min] Intento {intento}/{max_intentos}. Esperando {wait:.0f}s...")
-                await asyncio.sleep(wait)
+                print(f"   ⏳ [LLM Rate-limit/min] Intento {intento}/{max_intentos}. Reencolando...")
             else:
                 raise  # agotados los reintentos
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Factory de LLM por proveedor (gemini | ollama)
+# Factory de LLM por proveedor (gemini | ollama | openai) y router multi-proveedor
 # ─────────────────────────────────────────────────────────────────────────────
 
-def _crear_chat_llm(temperature: float, streaming: bool):
-    """Crea un chat-LLM según LLM_PROVIDER.
+def _crear_llm_proveedor(
+    proveedor: str,
+    modelo: str | None,
+    base_url: str | None,
+    temperature: float,
+    streaming: bool,
+    max_retries: int = 3,
+):
+    """Crea el chat-LLM de UN proveedor concreto.
 
-    - gemini (default): ChatGoogleGenerativeAI (sujeto a rate-limit free tier).
+    - gemini: ChatGoogleGenerativeAI (sujeto a rate-limit free tier).
     - ollama: ChatOllama contra un servidor autohospedado (sin rate-limit).
       El modelo DEBE soportar tool-calling (p.ej. llama3.1, qwen2.5, mistral-nemo),
       porque el grafo usa bind_tools para todas las herramientas.
+    - openai: cualquier servidor compatible con la API de OpenAI (vLLM,
+      llama.cpp server, LM Studio, scratch/servidor_llm_local.py...).
     """
-    provider = os.getenv("LLM_PROVIDER", "gemini").strip().lower()
-
-    if provider == "ollama":
+    if proveedor == "ollama":
         from langchain_ollama import ChatOllama
-        base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-        model = os.getenv("OLLAMA_CHAT_MODEL", "qwen2.5:7b")
+        base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        model = modelo or os.getenv("OLLAMA_CHAT_MODEL", "qwen2.5:7b")
         print(f"   🤖 LLM: Ollama · modelo={model} · {base_url}")
         return ChatOllama(
             model=model,
@@ -144,19 +193,109 @@ def _crear_chat_llm(temperature: float, streaming: bool):
             # ChatOllama gestiona el streaming internamente al usar astream_events.
         )
 
+    if proveedor == "openai":
+        # Import perezoso: solo se necesita langchain-openai si se usa este backend.
+        from langchain_openai import ChatOpenAI
+        base_url = base_url or os.getenv("OPENAI_BASE_URL", "http://localhost:8080/v1")
+        model = modelo or os.getenv("OPENAI_CHAT_MODEL", "local")
+        print(f"   🤖 LLM: OpenAI-compatible · modelo={model} · {base_url}")
+        return ChatOpenAI(
+            model=model,
+            base_url=base_url,
+            api_key=os.getenv("OPENAI_API_KEY", "sin-clave"),
+            temperature=temperature,
+            streaming=streaming,
+            max_retries=max_retries,
+        )
+
     # --- Default: Gemini ---
     if not os.getenv("GOOGLE_API_KEY"):
         raise ValueError("⚠️ GOOGLE_API_KEY no está configurada en las variables de entorno")
-    model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    model = modelo or os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
     print(f"   🤖 LLM: Gemini · modelo={model}")
     return ChatGoogleGenerativeAI(
         model=model,
         temperature=temperature,
-        max_retries=3,
+        max_retries=max_retries,
         streaming=streaming,
     )
 
 
+# Clientes LLM compartidos por TODOS los grafos (perfil × voz): se crean una vez
+# por (especificación, temperatura, streaming) y se enlazan a tools una vez.
+_LLM_CACHE: dict[tuple, object] = {}
+_LLM_TOOLS_CACHE: dict[tuple, object] = {}
+# id(llm) → cupos del planificador de los LLM de un solo proveedor (el router expone .nombres)
+_PROVEEDORES_LLM: dict[int, tuple[str, ...]] = {}
+
+
+def _crear_chat_llm(temperature: float, streaming: bool, specs: str | None = None):
+    """Crea un chat-LLM según 'specs', LLM_ROUTER (multi-proveedor) o LLM_PROVIDER.
+
+    'specs' permite elegir modelo por nodo (ver LLM_MODELO_*): una sola
+    especificación 'proveedor:modelo[@url]' crea ese modelo directamente; varias
+    separadas por comas crean un router. Las instancias se cachean y se
+    comparten entre grafos.
+
+    Con varias especificaciones se devuelve un RouterChatLLM que conmuta de
+    proveedor ante 429/5xx; los reintentos internos de cada proveedor se
+    reducen a 1 para que la conmutación sea inmediata.
+    """
+    clave = (specs, temperature, streaming)
+    if clave in _LLM_CACHE:
+        return _LLM_CACHE[clave]
+
+    if specs and "," not in specs:
+        datos = parsear_spec(specs)
+        llm = _crear_llm_proveedor(
+            datos["proveedor"], datos["modelo"], datos["base_url"],
+            temperature=temperature, streaming=streaming,
+        )
+        planificador_llm.configurar_cupo(datos["nombre"], rpm_proveedor(datos["proveedor"]))
+        _PROVEEDORES_LLM[id(llm)] = (datos["nombre"],)
+    elif specs or os.getenv("LLM_ROUTER", "").strip():
+        def _fabrica(proveedor, modelo, base_url, **kw):
+            return _crear_llm_proveedor(proveedor, modelo, base_url, max_retries=1, **kw)
+        llm = RouterChatLLM.desde_specs(
+            specs or os.getenv("LLM_ROUTER", "").strip(), _fabrica,
+            temperature=temperature, streaming=streaming,
+        )
+    else:
+        provider = os.getenv("LLM_PROVIDER", "gemini").strip().lower()
+        llm = _crear_llm_proveedor(provider, None, None, temperature=temperature, streaming=streaming)
+        planificador_llm.configurar_cupo(provider, rpm_proveedor(provider))
+        _PROVEEDORES_LLM[id(llm)] = (provider,)
+
+    _LLM_CACHE[clave] = llm
+    return llm
+
+
+def _llm_con_tools(llm, tools: list):
+    """bind_tools compartido: el mismo LLM con el mismo juego de tools se enlaza una vez."""
+    if llm is None or not tools:
+        return llm
+    clave = (id(llm), tuple(t.name for t in tools))
+    if clave not in _LLM_TOOLS_CACHE:
+        _LLM_TOOLS_CACHE[clave] = llm.bind_tools(tools)
+        if id(llm) in _PROVEEDORES_LLM:
+            _PROVEEDORES_LLM[id(_LLM_TOOLS_CACHE[clave])] = _PROVEEDORES_LLM[id(llm)]
+    return _LLM_TOOLS_CACHE[clave]
+
+
+def _spec_modelo(variable: str) -> str | None:
+    """Lee una especificación de modelo por nodo (LLM_MODELO_*); None si no está definida."""
+    return os.getenv(variable, "").strip() or None
+
+
+# Política de modelo rápido: turnos de saludo, o preguntas cortas
+_RAPIDO_MAX_CHARS    = int(os.getenv("LLM_RAPIDO_MAX_CHARS", "60"))
+_RAPIDO_MAX_CONTEXTO = int(os.getenv("LLM_RAPIDO_MAX_CONTEXTO", "3000"))
+# Preguntas cortas SIN contexto al modelo rápido: es él quien decide qué tools
+# llamar, y una pregunta corta puede ser difícil ("¿qué dice el art. 14 del ROC
+# sobre guardias?"), así que es opcional
+_RAPIDO_TURNO_CORTO  = os.getenv("LLM_RAPIDO_TURNO_CORTO", "false").strip().lower() in ("1", "true", "yes")
+
+
 from app.tools import obtener_tools_publicas, obtener_tools_profesorado, obtener_tools_legislacion
 from .prompts.prompt_manager import (
     PROMPTS, BEHAVIOR_PUBLIC, BEHAVIOR_TEACHER, BEHAVIOR_LEGISLATION, REGLAS_VOZ
@@ -172,11 +311,85 @@ class Estado(TypedDict):
     tipo_consulta: Literal["publica", "profesorado", "legislacion"] | None
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+# Caché de grafos compilados (compartidos entre agentes y modos)
+# ─────────────────────────────────────────────────────────────────────────────
+
+_GRAFOS: dict[tuple[str, bool], object] = {}
+_GRAFOS_LOCKS: dict[tuple[str, bool], asyncio.Lock] = {}
+_TAREAS_PREFETCH: set[asyncio.Task] = set()  # referencias fuertes a prefetch en curso
+
+
+async def obtener_grafo_ies(perfil: str, es_voz: bool = False):
+    """
+    Devuelve el grafo compilado para (perfil, es_voz), construyéndolo una sola
+    vez. Los modos 'texto' e 'hibrido' comparten el mismo grafo (es_voz=False).
+    """
+    clave = (perfil, es_voz)
+    if clave in _GRAFOS:
+        return _GRAFOS[clave]
+    lock = _GRAFOS_LOCKS.setdefault(clave, asyncio.Lock())
+    async with lock:
+        if clave not in _GRAFOS:
+            print(f"🧩 [GRAFO] Compilando grafo perfil={perfil} voz={es_voz}...")
+            _GRAFOS[clave] = await configurar_grafo_ies(perfil, es_voz=es_voz)
+    return _GRAFOS[clave]
+
+
+# Ruta rápida RAG de profesorado (RAG_RUTA_RAPIDA=true)
+MARCADOR_INSUFICIENTE = "[[INSUFICIENTE]]"
+_METRICAS_RUTA_RAPIDA = {"consultas": 0, "sin_confianza": 0, "directas": 0, "insuficientes": 0}
+
+
+def stats_ruta_rapida() -> dict:
+    m = _METRICAS_RUTA_RAPIDA
+    return {
+        **m,
+        "activa": os.getenv("RAG_RUTA_RAPIDA", "false").strip().lower() in ("1", "true", "yes"),
+        "llamadas_llm_ahorradas": m["directas"],
+    }
+
+
+# Auto-aprendizaje diferido: turno_id → resultados web pendientes de indexar.
+# Se indexan al completarse el turno; si el cliente se desconecta, se descartan.
+_AUTOLEARN_PENDIENTE: dict[str, list[tuple[str, str, str]]] = {}
+_TAREAS_AUTOLEARN: set[asyncio.Task] = set()
+
+
+async def _autolearn(content: str, query: str, nombre: str) -> None:
+    try:
+        from data.data import auto_indexar_resultado_web
+        n_chunks = auto_indexar_resultado_web(content, query, nombre)
+        if n_chunks:
+            print(f"   🧠 [AUTO-LEARN] {n_chunks} nuevos fragmentos indexados.")
+            CacheTools.invalidar_tools_rag("conocimiento")
+    except Exception as ae:
+        print(f"   ⚠️ [AUTO-LEARN] {ae}")
+
+
+def _lanzar_autolearn(args: tuple[str, str, str]) -> None:
+    tarea = asyncio.create_task(_autolearn(*args))
+    _TAREAS_AUTOLEARN.add(tarea)
+    tarea.add_done_callback(_TAREAS_AUTOLEARN.discard)
+
+
+def confirmar_autolearn(turno_id: str) -> None:
+    """El turno terminó: indexa en background los resultados web que dejó pendientes."""
+    for args in _AUTOLEARN_PENDIENTE.pop(turno_id, []):
+        _lanzar_autolearn(args)
+
+
+def descartar_autolearn(turno_id: str) -> None:
+    """El turno se canceló: no se indexa nada de lo que encontró."""
+    _AUTOLEARN_PENDIENTE.pop(turno_id, None)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Construcción del grafo
 # ─────────────────────────────────────────────────────────────────────────────
 
 async def configurar_grafo_ies(perfil: str, es_voz: bool = False):
+    """Construye y compila el grafo. Usar obtener_grafo_ies() para la versión cacheada."""
 
     # ── 1. Tools por fuente ──────────────────────────────────────────────────
     tools_pub   = await obtener_tools_publicas()
@@ -200,12 +413,39 @@ async def configurar_grafo_ies(perfil: str, es_voz: bool = False):
     #   gemini-3-flash-preview  →  20 req/día  (evitar)
     #   gemini-2.0-flash-lite   →  200 req/día
     #   gemini-1.5-flash        →  1500 req/día ← recomendado para desarrollo
-    _base_llm  = _crear_chat_llm(temperature=0.4, streaming=True)
+    #
+    # Selección por nodo (opcional, 'proveedor:modelo' o lista para router):
+    #   LLM_MODELO_RAPIDO         → modelo pequeño para saludos / turnos cortos
+    #   LLM_MODELO_CLASIFICADOR   → por defecto el rápido (si existe)
+    #   LLM_MODELO_PUBLICO / _PROFESORADO / _LEGISLACION → cada rama
+    #   LLM_MODELO_SINTESIS       → respuesta final tras ejecutar tools
+    _base_llm    = _crear_chat_llm(temperature=0.4, streaming=True)
+    _spec_rapido = _spec_modelo("LLM_MODELO_RAPIDO")
+    _llm_rapido  = _crear_chat_llm(0.4, True, _spec_rapido) if _spec_rapido else None
+    _spec_sint   = _spec_modelo("LLM_MODELO_SINTESIS")
+    _llm_sint    = _crear_chat_llm(0.4, True, _spec_sint) if _spec_sint else None
+
+    def _llm_rama(variable: str):
+        spec = _spec_modelo(variable)
+        return _crear_chat_llm(0.4, True, spec) if spec else _base_llm
+
     # Clasificador determinista: temperatura 0 para enrutar de forma estable.
-    llm_clasif = _crear_chat_llm(temperature=0.0, streaming=False)                  # sin tools
-    llm_pub    = _base_llm.bind_tools(tools_pub)   if tools_pub   else _base_llm
-    llm_prof   = _base_llm.bind_tools(tools_prof)  if tools_prof  else _base_llm
-    llm_legis  = _base_llm.bind_tools(tools_legis) if tools_legis else _base_llm
+    llm_clasif = _crear_chat_llm(                                                    # sin tools
+        temperature=0.0, streaming=False,
+        specs=_spec_modelo("LLM_MODELO_CLASIFICADOR") or _spec_rapido,
+    )
+    _LLMS_RAMA = {}
+    for _rama, _variable, _tools in (
+        ("publica",     "LLM_MODELO_PUBLICO",      tools_pub),
+        ("profesorado", "LLM_MODELO_PROFESORADO",  tools_prof),
+        ("legislacion", "LLM_MODELO_LEGISLACION",  tools_legis),
+    ):
+        _principal = _llm_con_tools(_llm_rama(_variable), _tools)
+        _LLMS_RAMA[_rama] = {
+            "principal": _principal,
+            "sintesis":  _llm_con_tools(_llm_sint, _tools) if _llm_sint is not None else _principal,
+            "rapido":    _llm_con_tools(_llm_rapido, _tools),
+        }
 
     # ─────────────────────────────────────────────────────────────────────────
     # Nodos
@@ -254,22 +494,59 @@ async def configurar_grafo_ies(perfil: str, es_voz: bool = False):
                 return _extract_text(m.content)
         return None
 
-    # ── Helper: reconstruir contexto de ToolMessages ─────────────────────────
-    def _build_tool_context(estado: Estado) -> str:
-        """Extrae los ToolMessages del turno actual y los formatea como contexto."""
-        contexto = ""
-        for msg in reversed(estado["messages"]):
-            if isinstance(msg, ToolMessage):
-                contexto = f"\n\nCONTEXTO DE TOOL ({msg.name}):\n{msg.content}" + contexto
-            elif getattr(msg, "tool_calls", None):
-                break  # Detenerse en el AI message que inició las llamadas
-        if contexto:
-            contexto = f"\n\n=== INFORMACIÓN RECUPERADA (USA ESTO PARA RESPONDER) ==={contexto}\n\nINSTRUCCIÓN: Responde a la pregunta del usuario utilizando ÚNICAMENTE la información anterior. Si la información no es suficiente, indícalo."
-        return contexto
+    # ── Helper: elegir modelo para el nodo chatbot ───────────────────────────
+    def _elegir_llm(rama: str, estado: Estado, tool_context: str):
+        """
+        Devuelve el LLM (ya con tools) para esta llamada de la rama:
+        - rápido: saludos, o preguntas cortas cuyo contexto ya está recuperado y
+          es pequeño (y, con LLM_RAPIDO_TURNO_CORTO=true, preguntas cortas sin
+          contexto fuera de legislación);
+        - síntesis: respuesta final tras ejecutar tools;
+        - principal: el resto (preguntas difíciles no cambian de modelo).
+        """
+        llms  = _LLMS_RAMA[rama]
+        texto = _ultimo_mensaje_usuario(estado) or ""
+        if llms["rapido"] is not None:
+            motivo = None
+            if _es_saludo(texto):
+                motivo = "saludo"
+            elif len(texto) <= _RAPIDO_MAX_CHARS:
+                if tool_context and len(tool_context) <= _RAPIDO_MAX_CONTEXTO:
+                    motivo = "contexto breve"
+                elif not tool_context and _RAPIDO_TURNO_CORTO and rama != "legislacion":
+                    motivo = "turno corto"
+            if motivo:
+                print(f"   ⚡ [MODELO] {rama} → rápido ({motivo})")
+                return llms["rapido"]
+        return llms["sintesis"] if tool_context else llms["principal"]
+
+    # ── Prefetch especulativo (en paralelo con el clasificador) ─────────────
+    _PREFETCH_ACTIVO = os.getenv("PREFETCH_ESPECULATIVO", "false").strip().lower() in ("1", "true", "yes")
+    _PREFETCH_PERFILES = (
+        ["profesores", "centro", "legislacion"] if perfil == "profesores" else ["centro", "alumnos"]
+    )
+
+    def _lanzar_prefetch(estado: Estado) -> None:
+        """Embebe la pregunta y consulta las colecciones probables sin esperar."""
+        if not _PREFETCH_ACTIVO:
+            return
+        texto = _ultimo_mensaje_usuario(estado)
+        if not texto or _es_saludo(texto) or len(texto) < 8:
+            return
+        from data.data import prefetch_colecciones
+
+        async def _prefetch():
+            try:
+                await asyncio.to_thread(prefetch_colecciones, texto, _PREFETCH_PERFILES)
+            except Exception as e:
+                print(f"   ⚠️ [PREFETCH] {e}")
+        _TAREAS_PREFETCH.add(tarea := asyncio.create_task(_prefetch()))
+        tarea.add_done_callback(_TAREAS_PREFETCH.discard)
 
     # ── Clasificador ─────────────────────────────────────────────────────────
     async def clasificar(estado: Estado, config: RunnableConfig) -> dict:
         """Decide si la consulta es pública o interna de profesorado."""
+        _lanzar_prefetch(estado)
         if perfil != "profesores" or not tools_prof:
             return {"tipo_consulta": "publica"}
 
@@ -328,23 +605,15 @@ REGLAS DE ORO:
 
     # ── Chatbot público ───────────────────────────────────────────────────────
     async def chatbot_publico(estado: Estado, config: RunnableConfig) -> dict:
-        # Poda de historial inteligente: no cortamos en medio de una cadena Tool -> AI
-        mensajes = estado["messages"]
-        if len(mensajes) > 12:
-            # Buscamos el HumanMessage más antiguo dentro de los últimos 12 para no romper la cadena
-            for i in range(len(mensajes) - 12, len(mensajes)):
-                if isinstance(mensajes[i], HumanMessage):
-                    mensajes = mensajes[i:]
-                    break
-            else:
-                mensajes = mensajes[-10:]
+        # Historial podado por nº de mensajes y tokens (sin romper cadenas Tool -> AI)
+        # y salida de tools recortada por relevancia dentro del presupuesto
+        mensajes, tool_context = construir_contexto("chatbot_publico", PROMPT_PUB, estado["messages"])
 
-        tool_context = _build_tool_context(estado)
-        system = SystemMessage(content=PROMPT_PUB + tool_context)
-        
         # Google requiere que el primer mensaje tras el System sea un HumanMessage
         # o que la secuencia sea coherente.
-        respuesta = await _llm_invoke_con_retry(llm_pub, [system] + mensajes, config=config)
+        respuesta = await _llm_invoke_con_retry(
+            _elegir_llm("publica", estado, tool_context), mensajes, config=config
+        )
 
         # ── GUARDRAIL: forzar búsqueda si el LLM no llamó herramientas y no hay contexto ──
         has_context = any(isinstance(m, ToolMessage) for m in mensajes[-3:])
@@ -368,18 +637,10 @@ REGLAS DE ORO:
 
     # ── Chatbot legislación ───────────────────────────────────────────────────
     async def chatbot_legislacion(estado: Estado, config: RunnableConfig) -> dict:
-        mensajes = estado["messages"]
-        if len(mensajes) > 12:
-            for i in range(len(mensajes) - 12, len(mensajes)):
-                if isinstance(mensajes[i], HumanMessage):
-                    mensajes = mensajes[i:]
-                    break
-            else:
-                mensajes = mensajes[-10:]
-
-        tool_context = _build_tool_context(estado)
-        system = SystemMessage(content=PROMPT_LEGIS + tool_context)
-        respuesta = await _llm_invoke_con_retry(llm_legis, [system] + mensajes, config=config)
+        mensajes, tool_context = construir_contexto("chatbot_legislacion", PROMPT_LEGIS, estado["messages"])
+        respuesta = await _llm_invoke_con_retry(
+            _elegir_llm("legislacion", estado, tool_context), mensajes, config=config
+        )
 
         # Guardrail: si no llamó herramientas y no hay contexto, forzar búsqueda legislativa
         has_context = any(isinstance(m, ToolMessage) for m in mensajes[-3:])
@@ -401,21 +662,84 @@ REGLAS DE ORO:
 
         return {"messages": [respuesta]}
 
+    # ── Ruta rápida RAG (profesorado) ─────────────────────────────────────────
+    # Si la guía del profesorado tiene un fragmento muy cercano a la pregunta, se
+    # inyecta directamente y se hace UNA sola generación en vez de
+    # chatbot (decide tool) → tools → chatbot. El resultado se guarda como un par
+    # AIMessage(tool_call)/ToolMessage sintético, así las fuentes, la poda y el
+    # guardrail funcionan igual que con la tool real.
+    _RUTA_RAPIDA = os.getenv("RAG_RUTA_RAPIDA", "false").strip().lower() in ("1", "true", "yes")
+    _RUTA_RAPIDA_UMBRAL = float(os.getenv("RAG_RUTA_RAPIDA_UMBRAL", "0.5"))
+    _PROMPT_RUTA_RAPIDA = (
+        f"\n\nSi la INFORMACIÓN RECUPERADA no permite responder con seguridad, responde "
+        f"exactamente {MARCADOR_INSUFICIENTE} y nada más."
+    )
+
+    async def _ruta_rapida_profesorado(estado: Estado, config: RunnableConfig) -> list | None:
+        """Devuelve los mensajes del turno si la ruta rápida resuelve la pregunta, o None."""
+        if "guia_profesorado" not in map_prof or not isinstance(estado["messages"][-1], HumanMessage):
+            return None
+        pregunta = _ultimo_mensaje_usuario(estado)
+        if not pregunta or _es_saludo(pregunta):
+            return None
+
+        from app.tools.guia_profesorado_tool import buscar_guia_profesorado
+        _METRICAS_RUTA_RAPIDA["consultas"] += 1
+        contexto, distancia = await asyncio.to_thread(buscar_guia_profesorado, pregunta)
+        if distancia is None or distancia > _RUTA_RAPIDA_UMBRAL:
+            _METRICAS_RUTA_RAPIDA["sin_confianza"] += 1
+            return None
+
+        print(f"⚡ [RUTA RÁPIDA] Guía del profesorado (dist={distancia:.3f}) → una sola generación")
+        id_llamada = f"rapida_{uuid.uuid4().hex[:8]}"
+        llamada = AIMessage(
+            content="",
+            additional_kwargs={"ruta_rapida": True},
+            tool_calls=[{"id": id_llamada, "name": "guia_profesorado", "args": {"search": pregunta}}],
+        )
+        resultado = ToolMessage(content=contexto, tool_call_id=id_llamada, name="guia_profesorado")
+        # El stream no ve on_tool_end de esta "tool": le pasamos las fuentes por evento propio
+        await adispatch_custom_event(
+            "ruta_rapida", {"nombre": "guia_profesorado", "output": contexto}, config=config
+        )
+
+        sinteticos = [llamada, resultado]
+        mensajes, tool_context = construir_contexto(
+            "chatbot_profesorado", PROMPT_PROF + _PROMPT_RUTA_RAPIDA, estado["messages"] + sinteticos
+        )
+        config_rapida = {**config, "tags": [*(config.get("tags") or []), "ruta_rapida"]}
+        respuesta = await _llm_invoke_con_retry(
+            _elegir_llm("profesorado", estado, tool_context), mensajes, config=config_rapida
+        )
+        if MARCADOR_INSUFICIENTE in _extract_text(respuesta.content):
+            _METRICAS_RUTA_RAPIDA["insuficientes"] += 1
+            print("↩️  [RUTA RÁPIDA] El modelo indica información insuficiente → bucle de tools")
+            mensajes, tool_context = construir_contexto(
+                "chatbot_profesorado", PROMPT_PROF, estado["messages"] + sinteticos
+            )
+            respuesta = await _llm_invoke_con_retry(
+                _elegir_llm("profesorado", estado, tool_context), mensajes, config=config
+            )
+        elif not getattr(respuesta, "tool_calls", None):
+            _METRICAS_RUTA_RAPIDA["directas"] += 1
+        return sinteticos + [respuesta]
+
     # ── Chatbot profesorado ───────────────────────────────────────────────────
     async def chatbot_profesorado(estado: Estado, config: RunnableConfig) -> dict:
-        # Poda de historial inteligente
-        mensajes = estado["messages"]
-        if len(mensajes) > 12:
-            for i in range(len(mensajes) - 12, len(mensajes)):
-                if isinstance(mensajes[i], HumanMessage):
-                    mensajes = mensajes[i:]
-                    break
-            else:
-                mensajes = mensajes[-10:]
-
-        tool_context = _build_tool_context(estado)
-        system = SystemMessage(content=PROMPT_PROF + tool_context)
-        respuesta = await _llm_invoke_con_retry(llm_prof, [system] + mensajes, config=config)
+        if _RUTA_RAPIDA:
+            try:
+                turno = await _ruta_rapida_profesorado(estado, config)
+            except Exception as e:
+                print(f"⚠️ [RUTA RÁPIDA] {e} → flujo normal")
+                turno = None
+            if turno is not None:
+                return {"messages": turno}
+
+        # Poda de historial inteligente + contexto de tools con presupuesto de tokens
+        mensajes, tool_context = construir_contexto("chatbot_profesorado", PROMPT_PROF, estado["messages"])
+        respuesta = await _llm_invoke_con_retry(
+            _elegir_llm("profesorado", estado, tool_context), mensajes, config=config
+        )
 
         # ── GUARDRAIL: forzar búsqueda si el LLM no llamó herramientas y no hay contexto ──
         has_context = any(isinstance(m, ToolMessage) for m in mensajes[-3:])
@@ -437,17 +761,17 @@ REGLAS DE ORO:
 
         return {"messages": [respuesta]}
 
-    # ── Ejecutor de tools (paralelo + timeout + auto-aprendizaje) ────────────
-    _TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT_SECONDS", "15"))
+    # ── Ejecutor de tools (paralelo + timeout adaptativo + auto-aprendizaje) ─
     # Auto-indexado de búsquedas web en ChromaDB. Desactivable por env para evitar
     # contaminar el RAG y reducir escrituras concurrentes a HNSW/SQLite.
     _AUTOLEARN_ACTIVO = os.getenv("AUTOLEARN_ACTIVO", "false").lower() in ("1", "true", "yes")
     # Tools cuyo output se auto-indexa en ChromaDB para aprendizaje continuo
     _TOOLS_AUTOLEARN = {"busqueda_legislacion_educativa", "busqueda_web_general"}
 
-    async def ejecutar_tools(estado: Estado) -> dict:
+    async def ejecutar_tools(estado: Estado, config: RunnableConfig) -> dict:
         ultimo  = estado["messages"][-1]
         tipo    = estado.get("tipo_consulta", "publica")
+        turno_id = (config or {}).get("configurable", {}).get("turno_id")
         if tipo == "profesorado":
             mapa = map_prof
         elif tipo == "legislacion":
@@ -463,31 +787,31 @@ REGLAS DE ORO:
                     f"en la rama '{tipo}'. Usa solo las herramientas permitidas."
                 )
                 return ToolMessage(content=obs, tool_call_id=call["id"], name=nombre)
+            cacheado = CacheTools.obtener(nombre, call["args"])
+            if cacheado is not None:
+                return ToolMessage(content=cacheado, tool_call_id=call["id"], name=nombre)
+            timeout = LatenciaTools.timeout_para(nombre)
             try:
                 print(f"\n🛠️  [TOOL: {nombre}] args={call['args']}")
-                obs = await asyncio.wait_for(
-                    mapa[nombre].ainvoke(call["args"]),
-                    timeout=_TOOL_TIMEOUT,
+                t0 = time.perf_counter()
+                obs = await LatenciaTools.ejecutar(
+                    nombre, lambda: mapa[nombre].ainvoke(call["args"]), timeout
                 )
                 print(f"   ✅ [TOOL {nombre}] OK — {len(str(obs))} chars")
+                CacheTools.guardar(nombre, call["args"], str(obs), (time.perf_counter() - t0) * 1000)
 
-                # Auto-aprendizaje: indexar resultados de búsquedas web en background
+                # Auto-aprendizaje: indexar resultados de búsquedas web al acabar el turno
                 obs_str = str(obs)
                 if _AUTOLEARN_ACTIVO and nombre in _TOOLS_AUTOLEARN and len(obs_str) > 500:
                     query = call["args"].get("query", call["args"].get("search", ""))
-                    async def _autolearn(content=obs_str, q=query, n=nombre):
-                        try:
-                            from data.data import auto_indexar_resultado_web
-                            n_chunks = auto_indexar_resultado_web(content, q, n)
-                            if n_chunks:
-                                print(f"   🧠 [AUTO-LEARN] {n_chunks} nuevos fragmentos indexados.")
-                        except Exception as ae:
-                            print(f"   ⚠️ [AUTO-LEARN] {ae}")
-                    asyncio.create_task(_autolearn())
+                    if turno_id:
+                        _AUTOLEARN_PENDIENTE.setdefault(turno_id, []).append((obs_str, query, nombre))
+                    else:
+                        _lanzar_autolearn((obs_str, query, nombre))
 
             except asyncio.TimeoutError:
-                print(f"   ⏱️  [TOOL {nombre}] Timeout tras {_TOOL_TIMEOUT}s")
-                obs = f"⚠️ La herramienta '{nombre}' tardó demasiado (>{_TOOL_TIMEOUT}s). Intenta reformular la pregunta."
+                print(f"   ⏱️  [TOOL {nombre}] Timeout tras {timeout:.1f}s")
+                obs = f"⚠️ La herramienta '{nombre}' tardó demasiado (>{timeout:.0f}s). Intenta reformular la pregunta."
             except Exception as e:
                 print(f"   ❌ [TOOL {nombre}] Error: {e}")
                 obs = f"Error en herramienta '{nombre}': {e}"
@@ -577,16 +901,27 @@ REGLAS DE ORO:
     # recursion_limit reducido: 15 ciclos son más que suficientes
     # y protegen contra bucles infinitos de tool-calling
 
-    # ── Imagen del grafo ─────────────────────────────────────────────────────
-    _guardar_imagen_grafo(grafo)
-
+    # La imagen del grafo ya NO se genera aquí (render Mermaid en cada arranque);
+    # usar guardar_imagen_grafo() desde /api/admin/grafo/imagen o generar_grafo.py.
     return grafo
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Utilidad: guardar imagen del grafo
+# Utilidad: guardar imagen del grafo (acción explícita de admin/CLI)
 # ─────────────────────────────────────────────────────────────────────────────
 
+async def guardar_imagen_grafo(
+    perfil: str = "profesores",
+    es_voz: bool = False,
+    ruta: str = "grafo_ies_jandula.png",
+) -> str:
+    """Renderiza el grafo cacheado de (perfil, es_voz) a PNG. Devuelve la ruta."""
+    grafo = await obtener_grafo_ies(perfil, es_voz=es_voz)
+    # draw_mermaid_png hace una petición HTTP bloqueante → fuera del event loop
+    await asyncio.to_thread(_guardar_imagen_grafo, grafo, ruta)
+    return ruta
+
+
 def _guardar_imagen_grafo(grafo, ruta: str = "grafo_ies_jandula.png") -> None:
     """
     Guarda una imagen PNG del grafo en el directorio raíz del proyecto.
@@ -1,8 +1,14 @@
 import asyncio
 import re
+import uuid
+from contextlib import aclosing
 from langchain_core.messages import ToolMessage
-from .AgentConfig import configurar_grafo_ies
-from .abilities.Audio import MotorVoz
+from .AgentConfig import (
+    MARCADOR_INSUFICIENTE, confirmar_autolearn, descartar_autolearn, obtener_grafo_ies,
+)
+from .MemoriaResumen import programar_compactacion, turno_activo
+from .abilities.Audio import cabecera_wav_stream, frases_de_tokens
+from .abilities.PoolVoz import pool_voz
 
 # Nodos que generan la respuesta final (no el clasificador ni las tools)
 _NODOS_RESPUESTA = {"chatbot_publico", "chatbot_profesorado", "chatbot_legislacion"}
@@ -40,21 +46,34 @@ class AgenteJandula:
         self.perfil = perfil
         self.modo = modo
         self.grafo = None
-        self.motor_voz = None
 
     async def encender(self):
-        self.grafo = await configurar_grafo_ies(self.perfil, es_voz=(self.modo == "voz"))
-        if self.modo in ["voz", "hibrido"]:
-            self.motor_voz = MotorVoz()
+        self.grafo = await obtener_grafo_ies(self.perfil, es_voz=(self.modo == "voz"))
 
-    async def responder(self, entrada, thread_id="default") -> dict:
-        """Devuelve dict con 'respuesta' (str) y 'fuentes' (list[str])."""
+    async def responder(self, entrada, thread_id="default", prioridad_llm: str = "chat") -> dict:
+        """
+        Devuelve dict con 'respuesta' (str) y 'fuentes' (list[str]).
+        'entrada' puede ser el texto o, en modo voz/híbrido, los bytes del audio a transcribir.
+        La respuesta hablada se genera aparte con hablar() (así puede salir de caché).
+        """
         texto_usuario = entrada
-        if self.modo in ["voz", "hibrido"]:
-            texto_usuario = self.motor_voz.escuchar(entrada)
-
-        config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 8}
-        resultado = await self.grafo.ainvoke({"messages": [("user", texto_usuario)]}, config)
+        if isinstance(entrada, bytes):
+            texto_usuario = await pool_voz.transcribir(entrada)
+
+        turno_id = uuid.uuid4().hex
+        config = {
+            "configurable": {"thread_id": thread_id, "prioridad_llm": prioridad_llm, "turno_id": turno_id},
+            "recursion_limit": 8,
+        }
+        with turno_activo(thread_id):
+            try:
+                resultado = await self.grafo.ainvoke({"messages": [("user", texto_usuario)]}, config)
+            except BaseException:
+                descartar_autolearn(turno_id)
+                raise
+        confirmar_autolearn(turno_id)
+        # Resumen de turnos antiguos en segundo plano (no retrasa la respuesta)
+        programar_compactacion(self.grafo, thread_id)
 
         # Extraer texto de forma segura (soporta str y list/multimodal)
         raw_content = resultado["messages"][-1].content
@@ -68,9 +87,6 @@ class AgenteJandula:
 
         fuentes = _extraer_fuentes(resultado["messages"])
 
-        if self.modo == "voz":
-            return self.motor_voz.hablar(respuesta_texto)
-
         if self.modo == "hibrido":
             return {"transcripcion": texto_usuario, "respuesta": respuesta_texto}
 
@@ -84,63 +100,161 @@ class AgenteJandula:
           {"tipo": "token",       "texto": "..."}                → fragmento de texto
           {"tipo": "error",       "mensaje": "..."}              → error recuperable
           {"tipo": "fin",         "fuentes": [...]}              → respuesta completada
+
+        Si se cancela (cliente desconectado) la cancelación llega al run de
+        astream_events: se detienen las tools y las llamadas LLM en curso y no
+        se indexa nada por auto-aprendizaje.
+        """
+        turno_id = uuid.uuid4().hex
+        config = {
+            "configurable": {"thread_id": thread_id, "prioridad_llm": "stream", "turno_id": turno_id},
+            "recursion_limit": 8,
+        }
+        completado = False
+        try:
+            with turno_activo(thread_id):
+                async with aclosing(self._eventos_stream(entrada, config)) as eventos:
+                    async for evento in eventos:
+                        completado = completado or evento["tipo"] == "fin"
+                        yield evento
+        finally:
+            if completado:
+                confirmar_autolearn(turno_id)
+            else:
+                descartar_autolearn(turno_id)
+            # También si el cliente cierra tras el evento 'fin'
+            programar_compactacion(self.grafo, thread_id)
+
+    async def hablar(self, texto: str, formato: str = "wav") -> bytes:
+        """TTS en el pool de voz, con caché de audio en disco."""
+        return await pool_voz.hablar(texto, formato=formato)
+
+    async def transcribir(self, audio: bytes) -> str:
+        """STT en el pool de voz (Whisper es síncrono)."""
+        return await pool_voz.transcribir(audio)
+
+    async def responder_voz_stream(self, texto_usuario: str, thread_id: str = "default"):
         """
-        config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 8}
+        Generador async de bytes WAV: cabecera de longitud desconocida y el PCM
+        de cada frase en cuanto el LLM la completa y Kokoro la sintetiza. El
+        LLM sigue generando mientras se sintetiza la frase anterior.
+        """
+        cola: asyncio.Queue = asyncio.Queue()
+
+        async def _tokens():
+            async for evento in self.responder_stream(texto_usuario, thread_id=thread_id):
+                if evento["tipo"] == "token":
+                    yield evento["texto"]
+                elif evento["tipo"] == "herramienta":
+                    yield None  # lo dicho antes de una tool no es la respuesta final
+
+        async def _producir_frases():
+            try:
+                async with aclosing(frases_de_tokens(_tokens())) as frases:
+                    async for frase in frases:
+                        cola.put_nowait(frase)
+            finally:
+                cola.put_nowait(None)
+
+        async def _frases():
+            while (frase := await cola.get()) is not None:
+                yield frase
+
+        productor = asyncio.create_task(_producir_frases())
+        try:
+            yield cabecera_wav_stream()
+            async with aclosing(pool_voz.hablar_stream(_frases())) as audio:
+                async for pcm in audio:
+                    yield pcm
+            await productor
+        finally:
+            if not productor.done():
+                productor.cancel()
+
+    async def _eventos_stream(self, entrada: str, config: dict):
         fuentes: set[str] = set()
         tokens_emitidos: int = 0
         post_tool_phase: bool = False
         nodos_clasificador = {"clasificar", "clasificador", "classify"}
         _debug_eventos: dict[str, int] = {}
+        # Ruta rápida RAG: se retienen los primeros tokens hasta descartar que la
+        # respuesta sea el marcador de información insuficiente (run_id → texto)
+        retenidos: dict[str, str] = {}
+        liberados: set[str] = set()
 
         try:
-            async for event in self.grafo.astream_events(
+            async with aclosing(self.grafo.astream_events(
                 {"messages": [("user", entrada)]},
                 config=config,
                 version="v2",
-            ):
-                etype = event["event"]
-                _debug_eventos[etype] = _debug_eventos.get(etype, 0) + 1
-                metadata = event.get("metadata", {})
-                nodo = (metadata.get("langgraph_node") or metadata.get("node") or "")
-
-                if etype == "on_tool_start":
-                    # Marcar que ya pasamos por una tool; a partir de aquí los tokens son reales
-                    post_tool_phase = True
-                    yield {"tipo": "herramienta", "nombre": event.get("name", "herramienta")}
-
-                elif etype == "on_tool_end":
-                    # Extraer fuentes del output de la tool
-                    output = str(event["data"].get("output", ""))
-                    for match in re.findall(r'\[Fuente:\s*([^\]]+)\]', output):
-                        fuentes.add(match.strip())
-
-                elif etype == "on_chat_model_stream":
-                    chunk = event["data"]["chunk"]
-                    content = chunk.content
-
-                    # Normalizar content multimodal (list de dicts con "text")
-                    if isinstance(content, list):
-                        content = "".join(
-                            p.get("text", "") if isinstance(p, dict) else str(p)
-                            for p in content
-                        )
-
-                    # Descartar vacíos o no-str
-                    if not content or not isinstance(content, str):
-                        continue
-
-                    # Descartar tool_call_chunks (el LLM está construyendo una llamada, no respondiendo)
-                    if getattr(chunk, "tool_call_chunks", None):
-                        continue
-
-                    # Descartar tokens del clasificador
-                    if nodo in nodos_clasificador:
-                        continue
-
-                    # Emitir si es un nodo de respuesta, o si ya pasamos por una tool, o si el nodo es desconocido
-                    if nodo in _NODOS_RESPUESTA or post_tool_phase or not nodo:
-                        tokens_emitidos += 1
-                        yield {"tipo": "token", "texto": content}
+            )) as eventos_grafo:
+                async for event in eventos_grafo:
+                    etype = event["event"]
+                    _debug_eventos[etype] = _debug_eventos.get(etype, 0) + 1
+                    metadata = event.get("metadata", {})
+                    nodo = (metadata.get("langgraph_node") or metadata.get("node") or "")
+
+                    if etype == "on_custom_event" and event.get("name") == "ruta_rapida":
+                        post_tool_phase = True
+                        yield {"tipo": "herramienta", "nombre": event["data"].get("nombre", "herramienta")}
+                        for match in re.findall(r'\[Fuente:\s*([^\]]+)\]', event["data"].get("output", "")):
+                            fuentes.add(match.strip())
+
+                    elif etype == "on_chat_model_end" and event.get("run_id") in retenidos:
+                        pendiente = retenidos.pop(event["run_id"])
+                        if pendiente and MARCADOR_INSUFICIENTE not in pendiente:
+                            tokens_emitidos += 1
+                            yield {"tipo": "token", "texto": pendiente}
+
+                    elif etype == "on_tool_start":
+                        # Marcar que ya pasamos por una tool; a partir de aquí los tokens son reales
+                        post_tool_phase = True
+                        yield {"tipo": "herramienta", "nombre": event.get("name", "herramienta")}
+
+                    elif etype == "on_tool_end":
+                        # Extraer fuentes del output de la tool
+                        output = str(event["data"].get("output", ""))
+                        for match in re.findall(r'\[Fuente:\s*([^\]]+)\]', output):
+                            fuentes.add(match.strip())
+
+                    elif etype == "on_chat_model_stream":
+                        chunk = event["data"]["chunk"]
+                        content = chunk.content
+
+                        # Normalizar content multimodal (list de dicts con "text")
+                        if isinstance(content, list):
+                            content = "".join(
+                                p.get("text", "") if isinstance(p, dict) else str(p)
+                                for p in content
+                            )
+
+                        # Descartar vacíos o no-str
+                        if not content or not isinstance(content, str):
+                            continue
+
+                        # Descartar tool_call_chunks (el LLM está construyendo una llamada, no respondiendo)
+                        if getattr(chunk, "tool_call_chunks", None):
+                            continue
+
+                        # Descartar tokens del clasificador
+                        if nodo in nodos_clasificador:
+                            continue
+
+                        # Ruta rápida: retener mientras el texto pueda ser el marcador
+                        run_id = event.get("run_id")
+                        if "ruta_rapida" in event.get("tags", []) and run_id not in liberados:
+                            retenido = retenidos.get(run_id, "") + content
+                            if MARCADOR_INSUFICIENTE.startswith(retenido.strip()):
+                                retenidos[run_id] = retenido
+                                continue
+                            retenidos.pop(run_id, None)
+                            liberados.add(run_id)
+                            content = retenido
+
+                        # Emitir si es un nodo de respuesta, o si ya pasamos por una tool, o si el nodo es desconocido
+                        if nodo in _NODOS_RESPUESTA or post_tool_phase or not nodo:
+                            tokens_emitidos += 1
+                            yield {"tipo": "token", "texto": content}
 
         except Exception as e:
             print(f"❌ [STREAM ERROR] {e}")
@@ -171,12 +285,8 @@ class AgenteJandula:
                     # Reutilizar fuentes del estado si las hay
                     fuentes = set(_extraer_fuentes(mensajes))
 
-                    # Emitir palabra a palabra para simular streaming y forzar flush SSE
-                    palabras = texto.split(" ")
-                    for i, palabra in enumerate(palabras):
-                        fragmento = palabra if i == len(palabras) - 1 else palabra + " "
-                        yield {"tipo": "token", "texto": fragmento}
-                        await asyncio.sleep(0)  # cede el event loop → flush SSE chunk
+                    # Un solo evento: StreamService envía cada frame en cuanto está listo
+                    yield {"tipo": "token", "texto": texto}
                 else:
                     yield {"tipo": "error", "mensaje": "No se pudo generar una respuesta."}
 
@@ -0,0 +1,124 @@
+"""
+CacheTools.py — IES Jándula
+Memoización de resultados de tools entre turnos e hilos.
+
+Llamadas como busqueda_web_ies_jandula("calendario escolar 2025") o
+consultar_legislacion("permisos docentes") se repiten literalmente en muchos
+hilos. ejecutar_tools consulta aquí antes de ejecutar la tool:
+
+- Clave: (nombre de la tool, argumentos normalizados: minúsculas, sin
+  tildes ni signos, espacios colapsados).
+- TTL por tipo de tool: minutos para la web (TOOL_CACHE_TTL_WEB_MIN),
+  horas para el RAG local (TOOL_CACHE_TTL_RAG_MIN).
+- Las entradas del RAG se invalidan al indexar o borrar documentos de la
+  colección correspondiente (invalidar_tools_rag).
+- Métricas por tool: tasa de acierto y latencia ahorrada.
+
+Se guarda en el mismo almacén que la caché de respuestas (CacheService,
+namespace 'tools'), que es EN MEMORIA: se vacía al reiniciar el proceso.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import unicodedata
+
+NAMESPACE = "tools"
+_TTL_WEB_S = float(os.getenv("TOOL_CACHE_TTL_WEB_MIN", "15")) * 60
+_TTL_RAG_S = float(os.getenv("TOOL_CACHE_TTL_RAG_MIN", "360")) * 60
+_ACTIVA = os.getenv("TOOL_CACHE_ACTIVA", "true").strip().lower() in ("1", "true", "yes")
+
+# Tool RAG → perfil/colección de la que lee (para invalidar al indexar)
+TOOLS_RAG_POR_PERFIL = {
+    "profesores":   "guia_profesorado",
+    "alumnos":      "guia_alumnado",
+    "legislacion":  "consultar_legislacion",
+    "centro":       "consultar_info_centro",
+    "conocimiento": "consultar_conocimiento_aprendido",
+}
+_TOOLS_WEB = {
+    "busqueda_web_ies_jandula", "busqueda_web_general",
+    "busqueda_legislacion_educativa", "extraer_contenido_web",
+}
+
+# Salidas que no se cachean (errores, timeouts, herramienta no disponible)
+_PREFIJOS_NO_CACHEABLES = ("⚠️", "Error en herramienta", "Error ")
+
+# tool → {"llamadas", "aciertos", "ahorro_ms"}
+_METRICAS: dict[str, dict] = {}
+
+
+def _ttl(nombre: str) -> float | None:
+    if nombre in TOOLS_RAG_POR_PERFIL.values():
+        return _TTL_RAG_S
+    if nombre in _TOOLS_WEB:
+        return _TTL_WEB_S
+    return None  # tool desconocida: no se cachea
+
+
+def _normalizar(texto: str) -> str:
+    t = unicodedata.normalize("NFD", texto.lower())
+    t = "".join(c for c in t if unicodedata.category(c) != "Mn")
+    return " ".join(re.sub(r"[^\w ]+", " ", t).split())
+
+
+def _clave(nombre: str, args: dict) -> str:
+    normalizados = {k: _normalizar(v) if isinstance(v, str) else v for k, v in args.items()}
+    return f"{nombre}:{json.dumps(normalizados, ensure_ascii=False, sort_keys=True)}"
+
+
+def _metricas(nombre: str) -> dict:
+    return _METRICAS.setdefault(nombre, {"llamadas": 0, "aciertos": 0, "ahorro_ms": 0.0})
+
+
+def obtener(nombre: str, args: dict) -> str | None:
+    """Resultado cacheado de la tool o None. Cuenta la llamada en las métricas."""
+    if not _ACTIVA or _ttl(nombre) is None:
+        return None
+    from app.api.services.CacheService import cache_service
+
+    m = _metricas(nombre)
+    m["llamadas"] += 1
+    entrada = cache_service.get_ns(NAMESPACE, _clave(nombre, args))
+    if entrada is None:
+        return None
+    m["aciertos"] += 1
+    m["ahorro_ms"] += entrada["ms"]
+    print(f"   ♻️  [TOOL {nombre}] Resultado desde caché (ahorro ~{entrada['ms']:.0f} ms)")
+    return entrada["obs"]
+
+
+def guardar(nombre: str, args: dict, obs: str, ms: float) -> None:
+    ttl = _ttl(nombre)
+    if not _ACTIVA or ttl is None or not obs or obs.startswith(_PREFIJOS_NO_CACHEABLES):
+        return
+    from app.api.services.CacheService import cache_service
+    cache_service.set_ns(NAMESPACE, _clave(nombre, args), {"obs": obs, "ms": ms}, ttl)
+
+
+def invalidar_tools_rag(perfil: str) -> int:
+    """Invalida los resultados cacheados de la tool RAG que lee la colección 'perfil'."""
+    nombre = TOOLS_RAG_POR_PERFIL.get(perfil)
+    if nombre is None:
+        return 0
+    from app.api.services.CacheService import cache_service
+    return cache_service.invalidar_ns(NAMESPACE, prefijo=f"{nombre}:")
+
+
+def stats_cache_tools() -> dict:
+    return {
+        "activa": _ACTIVA,
+        "ttl_web_min": _TTL_WEB_S / 60,
+        "ttl_rag_min": _TTL_RAG_S / 60,
+        "tools": {
+            nombre: {
+                "llamadas": m["llamadas"],
+                "aciertos": m["aciertos"],
+                "tasa_acierto": round(m["aciertos"] / m["llamadas"], 3) if m["llamadas"] else 0.0,
+                "ahorro_total_ms": round(m["ahorro_ms"]),
+            }
+            for nombre, m in _METRICAS.items()
+        },
+    }
@@ -0,0 +1,219 @@
+"""
+CheckpointerDiferido.py — IES Jándula
+Checkpointer "write-behind" para la memoria conversacional (CHECKPOINT_MODO=diferido).
+
+Con AsyncSqliteSaver cada paso del grafo (entrada, clasificador, chatbot,
+tools, chatbot...) hace un INSERT + COMMIT en la única conexión aiosqlite
+antes de seguir, y todos los usuarios se serializan en ella. Este saver:
+
+- Mantiene el estado de los hilos "calientes" en memoria (InMemorySaver):
+  las lecturas y escrituras del turno no tocan SQLite.
+- Un hilo frío se carga desde SQLite la primera vez que se lee.
+- Encola las escrituras y las vuelca cada CHECKPOINT_FLUSH_SEGUNDOS en UNA
+  transacción (WAL + synchronous=NORMAL), reutilizando el SQL de
+  AsyncSqliteSaver sobre la misma conexión.
+- Vuelca lo pendiente al apagar la aplicación (cerrar()).
+
+Ventana de durabilidad: si el proceso muere de golpe se pierden como mucho
+los últimos CHECKPOINT_FLUSH_SEGUNDOS de conversación.
+
+Los hilos en memoria se limitan a CHECKPOINT_HILOS_EN_MEMORIA (LRU); solo se
+expulsan hilos sin escrituras pendientes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, defaultdict
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+FLUSH_SEGUNDOS = float(os.getenv("CHECKPOINT_FLUSH_SEGUNDOS", "2"))
+HILOS_EN_MEMORIA = int(os.getenv("CHECKPOINT_HILOS_EN_MEMORIA", "500"))
+
+
+class _ConexionSinCommit:
+    """Proxy de la conexión aiosqlite que ignora commit(): el volcado hace uno solo por lote."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def commit(self) -> None:
+        return None
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+
+def _hilo(config) -> str:
+    return str(config["configurable"]["thread_id"])
+
+
+class CheckpointerDiferido(BaseCheckpointSaver):
+    def __init__(self, conn):
+        self._disco = AsyncSqliteSaver(conn)
+        super().__init__(serde=self._disco.serde)
+        self._conn = conn
+        self._memoria = InMemorySaver(serde=self._disco.serde)
+
+        # Mismo SQL que AsyncSqliteSaver pero sin commit por sentencia
+        self._volcador = AsyncSqliteSaver(_ConexionSinCommit(conn), serde=self._disco.serde)
+        self._volcador.is_setup = True
+
+        self._pendientes: list[tuple[str, str, tuple]] = []  # (hilo, método, args)
+        self._calientes: OrderedDict[str, float] = OrderedDict()
+        self._cargando: dict[str, asyncio.Lock] = {}
+        self._tarea: asyncio.Task | None = None
+        self._metricas = {"volcados": 0, "escrituras_volcadas": 0, "ultimo_volcado_ms": 0,
+                          "errores": 0, "cargas_disco": 0, "expulsados": 0}
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """Lock de la conexión SQLite (lo comparte CheckpointService)."""
+        return self._disco.lock
+
+    async def setup(self) -> None:
+        await self._disco.setup()
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle_volcado())
+
+    # ── Lecturas ──────────────────────────────────────────────────────────────
+
+    async def _calentar(self, thread_id: str) -> None:
+        """Carga en memoria el último checkpoint (y sus writes) de un hilo frío."""
+        if thread_id in self._calientes:
+            self._calientes.move_to_end(thread_id)
+            self._calientes[thread_id] = time.monotonic()
+            return
+        lock = self._cargando.setdefault(thread_id, asyncio.Lock())
+        async with lock:
+            if thread_id not in self._calientes:
+                tupla = await self._disco.aget_tuple(
+                    {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+                )
+                if tupla is not None:
+                    self._metricas["cargas_disco"] += 1
+                    padre = tupla.parent_config or {
+                        "configurable": {"thread_id": thread_id, "checkpoint_ns": ""}
+                    }
+                    await self._memoria.aput(
+                        padre, tupla.checkpoint, tupla.metadata,
+                        tupla.checkpoint.get("channel_versions", {}),
+                    )
+                    por_tarea = defaultdict(list)
+                    for task_id, canal, valor in tupla.pending_writes or []:
+                        por_tarea[task_id].append((canal, valor))
+                    for task_id, writes in por_tarea.items():
+                        await self._memoria.aput_writes(tupla.config, writes, task_id)
+                self._calientes[thread_id] = time.monotonic()
+        self._cargando.pop(thread_id, None)
+        self._expulsar()
+
+    async def aget_tuple(self, config):
+        await self._calentar(_hilo(config))
+        tupla = await self._memoria.aget_tuple(config)
+        if tupla is None and config["configurable"].get("checkpoint_id"):
+            # Checkpoint antiguo que no se cargó en memoria
+            return await self._disco.aget_tuple(config)
+        return tupla
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        # Historial: en memoria solo está lo reciente; para hilos calientes se
+        # vuelca antes para que SQLite tenga la historia completa.
+        if config is not None and _hilo(config) in self._calientes:
+            await self.volcar()
+        async for tupla in self._disco.alist(config, filter=filter, before=before, limit=limit):
+            yield tupla
+
+    # ── Escrituras ────────────────────────────────────────────────────────────
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        thread_id = _hilo(config)
+        await self._calentar(thread_id)
+        resultado = await self._memoria.aput(config, checkpoint, metadata, new_versions)
+        self._pendientes.append((thread_id, "aput", (config, checkpoint, metadata, new_versions)))
+        return resultado
+
+    async def aput_writes(self, config, writes, task_id, task_path: str = ""):
+        thread_id = _hilo(config)
+        await self._calentar(thread_id)
+        await self._memoria.aput_writes(config, writes, task_id, task_path)
+        self._pendientes.append((thread_id, "aput_writes", (config, writes, task_id, task_path)))
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        thread_id = str(thread_id)
+        self._pendientes = [p for p in self._pendientes if p[0] != thread_id]
+        self._memoria.delete_thread(thread_id)
+        self._calientes.pop(thread_id, None)
+        await self._disco.adelete_thread(thread_id)
+
+    def get_next_version(self, current, channel):
+        return self._disco.get_next_version(current, channel)
+
+    # ── Volcado a SQLite ──────────────────────────────────────────────────────
+
+    async def volcar(self) -> int:
+        """Escribe en SQLite todo lo pendiente en una única transacción."""
+        if not self._pendientes:
+            return 0
+        lote, self._pendientes = self._pendientes, []
+        t0 = time.perf_counter()
+        async with self._disco.lock:
+            try:
+                for _, metodo, args in lote:
+                    await getattr(self._volcador, metodo)(*args)
+                await self._conn.commit()
+            except Exception:
+                await self._conn.rollback()
+                self._pendientes = lote + self._pendientes  # se reintenta en el siguiente ciclo
+                self._metricas["errores"] += 1
+                raise
+        self._metricas["volcados"] += 1
+        self._metricas["escrituras_volcadas"] += len(lote)
+        self._metricas["ultimo_volcado_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        self._expulsar()
+        return len(lote)
+
+    async def _bucle_volcado(self) -> None:
+        while True:
+            await asyncio.sleep(FLUSH_SEGUNDOS)
+            try:
+                await self.volcar()
+            except Exception as e:
+                print(f"⚠️ [MEMORIA] Error volcando checkpoints a SQLite: {e}")
+
+    def _expulsar(self) -> None:
+        """LRU: saca de memoria los hilos menos usados que ya estén en disco."""
+        if len(self._calientes) <= HILOS_EN_MEMORIA:
+            return
+        con_pendientes = {p[0] for p in self._pendientes}
+        for thread_id in list(self._calientes):
+            if len(self._calientes) <= HILOS_EN_MEMORIA:
+                break
+            if thread_id in con_pendientes or thread_id in self._cargando:
+                continue
+            self._memoria.delete_thread(thread_id)
+            del self._calientes[thread_id]
+            self._metricas["expulsados"] += 1
+
+    async def cerrar(self) -> None:
+        """Detiene el bucle y vuelca lo pendiente (llamar al apagar la app)."""
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        n = await self.volcar()
+        print(f"💾 [MEMORIA] Volcado final de checkpoints: {n} escrituras")
+
+    def stats(self) -> dict:
+        return {
+            **self._metricas,
+            "pendientes": len(self._pendientes),
+            "hilos_en_memoria": len(self._calientes),
+            "flush_segundos": FLUSH_SEGUNDOS,
+        }
@@ -0,0 +1,282 @@
+"""
+ConstructorContexto.py — IES Jándula
+Construcción del prompt de los nodos chatbot con presupuesto de tokens.
+
+Antes cada nodo podaba el historial solo por número de mensajes y añadía al
+system prompt TODO el output de las tools (hasta 10k caracteres de una web +
+6–8 fragmentos RAG), mientras esos mismos ToolMessages seguían en 'mensajes'.
+Ahora, en cada llamada:
+
+1. El historial se poda por nº de mensajes y además por tokens
+   (HISTORIAL_MAX_TOKENS), cortando siempre en un HumanMessage.
+2. La salida de las tools del turno se trocea en fragmentos, se deduplica y
+   se ordena por relevancia; se descartan primero los menos relevantes hasta
+   caber en CONTEXTO_MAX_TOKENS.
+3. Los ToolMessages cuyo contenido ya va en el system prompt se sustituyen
+   por un marcador (se mantiene el par tool_call/ToolMessage que exige la API).
+4. El resumen de turnos antiguos (MemoriaResumen) se saca del historial y se
+   añade al system prompt.
+5. Se descartan las tool_calls sin respuesta que deja un turno cancelado a
+   mitad (cliente desconectado): la API rechaza el historial si las ve.
+6. Se registra el tamaño estimado del prompt por nodo (/api/admin/stats).
+
+Los tokens se ESTIMAN (≈4 caracteres por token en español): contar con la
+API del proveedor costaría una petición extra por llamada.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import unicodedata
+
+from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+
+CONTEXTO_MAX_TOKENS = int(os.getenv("CONTEXTO_MAX_TOKENS", "4000"))
+HISTORIAL_MAX_TOKENS = int(os.getenv("HISTORIAL_MAX_TOKENS", "3000"))
+_MAX_MENSAJES = 12
+_CHARS_POR_TOKEN = 4
+_TROZO_TEXTO_PLANO = 1500  # tamaño de los trozos de páginas web completas
+
+_CABECERA = "\n\n=== INFORMACIÓN RECUPERADA (USA ESTO PARA RESPONDER) ==="
+_INSTRUCCION = (
+    "\n\nINSTRUCCIÓN: Responde a la pregunta del usuario utilizando ÚNICAMENTE la "
+    "información anterior. Si la información no es suficiente, indícalo."
+)
+_CABECERA_RESUMEN = "\n\n=== RESUMEN DE LA CONVERSACIÓN ANTERIOR ===\n"
+_MARCADOR_EN_CONTEXTO = "[Resultado incluido en INFORMACIÓN RECUPERADA del sistema]"
+_MARCADOR_TURNO_ANTERIOR = "[Resultado de herramienta de un turno anterior omitido]"
+
+# Cabecera de fragmento de las tools RAG; consultar_conocimiento_aprendido añade
+# "(Título: …)" entre la fuente y la relevancia y se conserva junto a la fuente
+_RE_FRAGMENTO_RAG = re.compile(
+    r"\n--- Fragmento \d+ (\[Fuente:[^\]]*\](?: \(Título: [^\n]*?\))?) \(Relevancia: ([0-9.]+)\) ---\n"
+)
+_STOPWORDS = {
+    "de", "la", "el", "en", "y", "a", "los", "las", "del", "que", "un", "una", "por",
+    "para", "con", "se", "es", "al", "lo", "como", "mas", "o", "su", "sus", "me", "mi",
+    "cual", "cuales", "quien", "donde", "cuando", "hay", "son", "esta",
+}
+
+# additional_kwargs que identifica el SystemMessage de resumen del hilo
+CLAVE_RESUMEN = "resumen_hilo"
+
+# nodo → métricas de tamaño de prompt
+_METRICAS: dict[str, dict] = {}
+
+
+def estimar_tokens(texto: str) -> int:
+    return (len(texto) + _CHARS_POR_TOKEN - 1) // _CHARS_POR_TOKEN
+
+
+def _texto(content) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content)
+    return str(content)
+
+
+def es_resumen(mensaje) -> bool:
+    return isinstance(mensaje, SystemMessage) and bool(mensaje.additional_kwargs.get(CLAVE_RESUMEN))
+
+
+def _normalizar(texto: str) -> str:
+    t = unicodedata.normalize("NFD", texto.lower())
+    t = "".join(c for c in t if unicodedata.category(c) != "Mn")
+    return re.sub(r"\s+", " ", t).strip()
+
+
+def _palabras_clave(texto: str) -> set[str]:
+    return {w for w in re.findall(r"\w{3,}", _normalizar(texto)) if w not in _STOPWORDS}
+
+
+def _solape(fragmento: str, claves: set[str]) -> float:
+    """Relevancia léxica (0–1): fracción de palabras clave de la pregunta presentes."""
+    if not claves:
+        return 0.5
+    return len(claves & _palabras_clave(fragmento)) / len(claves)
+
+
+def _fragmentar(nombre_tool: str, contenido: str, claves: set[str]) -> list[dict]:
+    """Trocea la salida de una tool en fragmentos con su relevancia estimada."""
+    fragmentos = []
+
+    partes = _RE_FRAGMENTO_RAG.split(contenido)
+    if len(partes) > 1:
+        # RAG: [cabecera, fuente1, relevancia1, texto1, fuente2, ...]
+        for i in range(1, len(partes) - 2, 3):
+            fuente, relevancia, texto = partes[i], float(partes[i + 1]), partes[i + 2].strip()
+            fragmentos.append({"texto": f"{fuente} {texto}", "relevancia": relevancia})
+    elif "FUENTE:" in contenido:
+        # Web (Tavily): bloques separados por '---', en orden de ranking
+        for i, bloque in enumerate(b for b in contenido.split("\n---\n") if b.strip()):
+            relevancia = 0.6 * _solape(bloque, claves) + 0.4 * max(0.0, 1 - i * 0.1)
+            fragmentos.append({"texto": bloque.strip(), "relevancia": relevancia})
+    else:
+        # Texto plano (p.ej. extraer_contenido_web): trozos de tamaño fijo
+        for i in range(0, len(contenido), _TROZO_TEXTO_PLANO):
+            trozo = contenido[i:i + _TROZO_TEXTO_PLANO].strip()
+            if trozo:
+                fragmentos.append({"texto": trozo, "relevancia": _solape(trozo, claves)})
+
+    for orden, f in enumerate(fragmentos):
+        f["tool"] = nombre_tool
+        f["orden"] = orden
+    return fragmentos
+
+
+def _tool_messages_del_turno(mensajes: list) -> list[ToolMessage]:
+    """
+    ToolMessages de la última ronda de tools del turno actual (tras el último
+    AIMessage con tool_calls). Nunca cruza el último HumanMessage: en una
+    pregunta nueva los resultados del turno anterior no son contexto.
+    """
+    resultado = []
+    for msg in reversed(mensajes):
+        if isinstance(msg, ToolMessage):
+            resultado.insert(0, msg)
+        elif isinstance(msg, HumanMessage) or getattr(msg, "tool_calls", None):
+            break
+    return resultado
+
+
+def _construir_tool_context(tool_msgs: list[ToolMessage], pregunta: str) -> tuple[str, int, int]:
+    """Devuelve (contexto, fragmentos usados, fragmentos totales) dentro del presupuesto."""
+    if not tool_msgs:
+        return "", 0, 0
+
+    claves = _palabras_clave(pregunta)
+    candidatos, vistos = [], set()
+    for idx_tool, msg in enumerate(tool_msgs):
+        for f in _fragmentar(msg.name or "herramienta", _texto(msg.content), claves):
+            huella = hashlib.sha1(_normalizar(f["texto"])[:500].encode()).hexdigest()
+            if huella in vistos:
+                continue  # mismo contenido devuelto por dos tools o dos veces
+            vistos.add(huella)
+            f["idx_tool"] = idx_tool
+            candidatos.append(f)
+
+    # Primero los más relevantes hasta agotar el presupuesto
+    usados, gastado = [], 0
+    for f in sorted(candidatos, key=lambda f: f["relevancia"], reverse=True):
+        coste = estimar_tokens(f["texto"]) + 10
+        if gastado + coste > CONTEXTO_MAX_TOKENS:
+            if not usados:
+                # Al menos un fragmento (recortado) para no quedarnos sin contexto
+                f = {**f, "texto": f["texto"][: CONTEXTO_MAX_TOKENS * _CHARS_POR_TOKEN]}
+                usados.append(f)
+                gastado = CONTEXTO_MAX_TOKENS  # presupuesto agotado: no cabe nada más
+            continue
+        usados.append(f)
+        gastado += coste
+
+    # Reordenar por tool y posición original para que el texto sea legible
+    usados.sort(key=lambda f: (f["idx_tool"], f["orden"]))
+    contexto, tool_actual = "", None
+    for f in usados:
+        if f["tool"] != tool_actual:
+            tool_actual = f["tool"]
+            contexto += f"\n\nCONTEXTO DE TOOL ({tool_actual}):"
+        contexto += f"\n{f['texto']}\n"
+    return _CABECERA + contexto + _INSTRUCCION, len(usados), len(candidatos)
+
+
+def _sin_tool_calls_huerfanas(mensajes: list) -> list:
+    """Quita los AIMessage cuyas tool_calls no tienen ToolMessage (y las respuestas parciales)."""
+    respondidas = {m.tool_call_id for m in mensajes if isinstance(m, ToolMessage)}
+    descartadas: set[str] = set()
+    for m in mensajes:
+        llamadas = getattr(m, "tool_calls", None) or []
+        if any(c["id"] not in respondidas for c in llamadas):
+            descartadas.update(c["id"] for c in llamadas)
+    if not descartadas:
+        return mensajes
+    return [
+        m for m in mensajes
+        if not (isinstance(m, ToolMessage) and m.tool_call_id in descartadas)
+        and not any(c["id"] in descartadas for c in getattr(m, "tool_calls", None) or [])
+    ]
+
+
+def _podar_por_numero(mensajes: list) -> list:
+    """Poda por nº de mensajes sin romper cadenas Tool → AI."""
+    if len(mensajes) > _MAX_MENSAJES:
+        # Buscamos el HumanMessage más antiguo dentro de los últimos 12 para no romper la cadena
+        for i in range(len(mensajes) - _MAX_MENSAJES, len(mensajes)):
+            if isinstance(mensajes[i], HumanMessage):
+                return mensajes[i:]
+        return mensajes[-10:]
+    return mensajes
+
+
+def _podar_por_tokens(mensajes: list) -> list:
+    """Descarta turnos completos antiguos hasta caber en HISTORIAL_MAX_TOKENS."""
+    inicios = [i for i, m in enumerate(mensajes) if isinstance(m, HumanMessage)]
+    for inicio in inicios[:-1]:  # el turno actual nunca se descarta
+        if sum(estimar_tokens(_texto(m.content)) for m in mensajes[inicio:]) <= HISTORIAL_MAX_TOKENS:
+            return mensajes[inicio:]
+    return mensajes[inicios[-1]:] if inicios else mensajes
+
+
+def construir_contexto(nodo: str, prompt_base: str, mensajes_estado: list) -> tuple[list, str]:
+    """
+    Prepara la llamada de un nodo chatbot.
+
+    Returns:
+        (mensajes para el LLM con el SystemMessage delante, contexto de tools del turno)
+    """
+    resumen = "\n".join(_texto(m.content) for m in mensajes_estado if es_resumen(m))
+    mensajes_estado = _sin_tool_calls_huerfanas([m for m in mensajes_estado if not es_resumen(m)])
+    if resumen:
+        prompt_base += _CABECERA_RESUMEN + resumen
+
+    pregunta = next(
+        (_texto(m.content) for m in reversed(mensajes_estado) if isinstance(m, HumanMessage)), ""
+    )
+    tool_msgs = _tool_messages_del_turno(mensajes_estado)
+    tool_context, n_usados, n_total = _construir_tool_context(tool_msgs, pregunta)
+    ids_en_contexto = {id(m) for m in tool_msgs}
+
+    mensajes = []
+    for m in _podar_por_numero(mensajes_estado):
+        if isinstance(m, ToolMessage):
+            marcador = _MARCADOR_EN_CONTEXTO if id(m) in ids_en_contexto else _MARCADOR_TURNO_ANTERIOR
+            m = m.model_copy(update={"content": marcador})
+        mensajes.append(m)
+    mensajes = _podar_por_tokens(mensajes)
+
+    system = SystemMessage(content=prompt_base + tool_context)
+    _registrar(nodo, prompt_base, tool_context, mensajes, n_usados, n_total)
+    return [system] + mensajes, tool_context
+
+
+def _registrar(nodo: str, prompt_base: str, tool_context: str, mensajes: list,
+               n_usados: int, n_total: int) -> None:
+    t_sistema = estimar_tokens(prompt_base)
+    t_contexto = estimar_tokens(tool_context)
+    t_historial = sum(estimar_tokens(_texto(m.content)) for m in mensajes)
+    total = t_sistema + t_contexto + t_historial
+
+    m = _METRICAS.setdefault(nodo, {"llamadas": 0, "tokens_total": 0, "tokens_max": 0})
+    m["llamadas"] += 1
+    m["tokens_total"] += total
+    m["tokens_max"] = max(m["tokens_max"], total)
+    m["ultimo"] = {"sistema": t_sistema, "contexto": t_contexto, "historial": t_historial}
+
+    detalle = f" · fragmentos {n_usados}/{n_total}" if n_total else ""
+    print(f"   📏 [PROMPT {nodo}] ~{total} tokens (sistema {t_sistema}, contexto {t_contexto}, "
+          f"historial {t_historial}){detalle}")
+
+
+def stats_contexto() -> dict:
+    return {
+        nodo: {
+            "llamadas": m["llamadas"],
+            "tokens_medios": round(m["tokens_total"] / m["llamadas"]) if m["llamadas"] else 0,
+            "tokens_max": m["tokens_max"],
+            "ultimo": m.get("ultimo"),
+        }
+        for nodo, m in _METRICAS.items()
+    }
@@ -0,0 +1,183 @@
+"""
+LatenciaTools.py — IES Jándula
+Latencias por tool, timeouts adaptativos y peticiones "hedged".
+
+Antes ejecutar_tools aplicaba el mismo TOOL_TIMEOUT_SECONDS=15 a todo: una
+consulta local a Chroma de 50 ms y un render de Playwright; y un Tavily
+lento se comía el presupuesto entero. Ahora:
+
+- Se guardan las últimas latencias de cada tool (histograma + p50/p95/p99).
+- Timeout adaptativo = p95 × TOOL_TIMEOUT_FACTOR, acotado entre
+  TOOL_TIMEOUT_MIN_S y TOOL_TIMEOUT_MAX_S. Hasta tener
+  TOOL_LATENCIA_MIN_MUESTRAS se usa TOOL_TIMEOUT_SECONDS (o uno mayor para
+  Playwright). Los timeouts cuentan como muestra, así que una tool que se
+  vuelve lenta amplía su propio timeout en vez de fallar siempre.
+- Hedging para las búsquedas web idempotentes: si la primera petición
+  supera su p95 se lanza una segunda idéntica y se usa la que antes
+  responda (TOOL_HEDGING=false lo desactiva).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from collections import deque
+
+_TIMEOUT_DEFECTO_S = float(os.getenv("TOOL_TIMEOUT_SECONDS", "15"))
+_TIMEOUT_FACTOR = float(os.getenv("TOOL_TIMEOUT_FACTOR", "3"))
+_TIMEOUT_MIN_S = float(os.getenv("TOOL_TIMEOUT_MIN_S", "3"))
+_TIMEOUT_MAX_S = float(os.getenv("TOOL_TIMEOUT_MAX_S", "30"))
+_MIN_MUESTRAS = int(os.getenv("TOOL_LATENCIA_MIN_MUESTRAS", "10"))
+_HEDGING = os.getenv("TOOL_HEDGING", "true").strip().lower() in ("1", "true", "yes")
+_HEDGE_MIN_S = 0.3
+_MUESTRAS_MAX = 200
+
+# extraer_contenido_web: casi siempre responde por HTTP en ~300 ms, así que su p95
+# bajaría el timeout por debajo de lo que necesita una página que escala a Chromium.
+# Suelo = intento HTTP + arranque del navegador + navegación + espera a la red
+_SUELO_EXTRAER_WEB_S = (
+    float(os.getenv("HTTP_TIMEOUT_S", "5"))
+    + 2.0
+    + float(os.getenv("NAVEGADOR_TIMEOUT_MS", "20000")) / 1000
+    + float(os.getenv("NAVEGADOR_IDLE_MS", "1500")) / 1000
+)
+
+# Timeout inicial de tools que se sabe que son lentas (render de navegador)
+_TIMEOUT_INICIAL = {"extraer_contenido_web": _SUELO_EXTRAER_WEB_S}
+# Mínimo que el timeout adaptativo nunca rebaja (ni recorta TOOL_TIMEOUT_MAX_S)
+_TIMEOUT_SUELO = {"extraer_contenido_web": _SUELO_EXTRAER_WEB_S}
+
+# Búsquedas web sin efectos secundarios: repetirlas es seguro. Tienen que ser
+# async y lanzar excepción si fallan: una tool síncrona corre en un hilo del
+# executor y cancelarla no detiene la petición perdedora, y un error devuelto
+# como texto ganaría el hedge como si fuera un éxito
+TOOLS_HEDGE = {"busqueda_web_ies_jandula", "busqueda_web_general", "busqueda_legislacion_educativa"}
+
+# Límites superiores de los cubos del histograma (ms)
+_CUBOS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000)
+
+
+class _LatenciaTool:
+    def __init__(self):
+        self.muestras: deque[float] = deque(maxlen=_MUESTRAS_MAX)
+        self.histograma = [0] * (len(_CUBOS_MS) + 1)
+        self.llamadas = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedges_ganados = 0
+
+    def registrar(self, ms: float) -> None:
+        self.llamadas += 1
+        self.muestras.append(ms)
+        cubo = next((i for i, limite in enumerate(_CUBOS_MS) if ms <= limite), len(_CUBOS_MS))
+        self.histograma[cubo] += 1
+
+    def percentil(self, p: float) -> float | None:
+        if not self.muestras:
+            return None
+        orden = sorted(self.muestras)
+        return orden[min(len(orden) - 1, int(p / 100 * len(orden)))]
+
+
+_LATENCIAS: dict[str, _LatenciaTool] = {}
+
+
+def _latencia(nombre: str) -> _LatenciaTool:
+    return _LATENCIAS.setdefault(nombre, _LatenciaTool())
+
+
+def timeout_para(nombre: str) -> float:
+    """Timeout (s) de la próxima llamada a la tool según su historial."""
+    lat = _latencia(nombre)
+    if len(lat.muestras) < _MIN_MUESTRAS:
+        return _TIMEOUT_INICIAL.get(nombre, _TIMEOUT_DEFECTO_S)
+    p95_s = lat.percentil(95) / 1000
+    adaptativo = min(max(p95_s * _TIMEOUT_FACTOR, _TIMEOUT_MIN_S), _TIMEOUT_MAX_S)
+    return max(adaptativo, _TIMEOUT_SUELO.get(nombre, 0.0))
+
+
+def _retraso_hedge(nombre: str) -> float | None:
+    lat = _latencia(nombre)
+    if not _HEDGING or nombre not in TOOLS_HEDGE or len(lat.muestras) < _MIN_MUESTRAS:
+        return None
+    return max(lat.percentil(95) / 1000, _HEDGE_MIN_S)
+
+
+async def _con_hedge(nombre: str, lanzar, timeout: float, retraso: float):
+    """Primera petición; si tarda más que 'retraso', una segunda en paralelo. Gana la primera que acabe bien."""
+    loop = asyncio.get_running_loop()
+    limite = loop.time() + timeout
+    primera = asyncio.ensure_future(lanzar())
+    tareas = [primera]
+    try:
+        hechas, _ = await asyncio.wait({primera}, timeout=retraso)
+        if hechas:
+            return primera.result()
+
+        lat = _latencia(nombre)
+        lat.hedges += 1
+        print(f"   🪁 [TOOL {nombre}] >{retraso:.1f}s (p95) → lanzando petición de respaldo")
+        segunda = asyncio.ensure_future(lanzar())
+        tareas.append(segunda)
+
+        pendientes, ultimo_error = {primera, segunda}, None
+        while pendientes:
+            restante = limite - loop.time()
+            if restante <= 0:
+                raise asyncio.TimeoutError()
+            hechas, pendientes = await asyncio.wait(
+                pendientes, timeout=restante, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not hechas:
+                raise asyncio.TimeoutError()
+            for tarea in hechas:
+                if tarea.exception() is None:
+                    if tarea is segunda:
+                        lat.hedges_ganados += 1
+                    return tarea.result()
+                ultimo_error = tarea.exception()
+        raise ultimo_error
+    finally:
+        for tarea in tareas:
+            if not tarea.done():
+                tarea.cancel()
+
+
+async def ejecutar(nombre: str, lanzar, timeout: float):
+    """
+    Ejecuta 'lanzar()' (que devuelve una corrutina nueva en cada llamada)
+    con el timeout indicado y hedging si procede, registrando la latencia.
+    """
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    lat = _latencia(nombre)
+    try:
+        retraso = _retraso_hedge(nombre)
+        if retraso is not None and retraso < timeout:
+            return await _con_hedge(nombre, lanzar, timeout, retraso)
+        return await asyncio.wait_for(lanzar(), timeout=timeout)
+    except asyncio.TimeoutError:
+        lat.timeouts += 1
+        raise
+    finally:
+        lat.registrar((loop.time() - t0) * 1000)
+
+
+def stats_latencia_tools() -> dict:
+    etiquetas = [f"<={c}ms" for c in _CUBOS_MS] + [f">{_CUBOS_MS[-1]}ms"]
+    resultado = {}
+    for nombre, lat in _LATENCIAS.items():
+        if not lat.llamadas:
+            continue
+        resultado[nombre] = {
+            "llamadas": lat.llamadas,
+            "p50_ms": round(lat.percentil(50) or 0),
+            "p95_ms": round(lat.percentil(95) or 0),
+            "p99_ms": round(lat.percentil(99) or 0),
+            "timeout_actual_s": round(timeout_para(nombre), 1),
+            "timeouts": lat.timeouts,
+            "hedges": lat.hedges,
+            "hedges_ganados": lat.hedges_ganados,
+            "histograma": dict(zip(etiquetas, lat.histograma)),
+        }
+    return resultado
@@ -0,0 +1,205 @@
+"""
+MemoriaResumen.py — IES Jándula
+Memoria de resumen continuo para hilos largos.
+
+Sin esto el estado de un hilo (y cada checkpoint de AsyncSqliteSaver) crece
+sin límite y se deserializa entero en cada turno, aunque los nodos solo
+envían al LLM los últimos ~12 mensajes. Ahora, DESPUÉS de enviar la
+respuesta y fuera del camino crítico:
+
+1. Si el hilo supera MEMORIA_MAX_MENSAJES, los turnos antiguos se resumen
+   (junto con el resumen previo, si lo hay) con el modelo rápido y prioridad
+   'warmup' del planificador.
+2. El estado se reescribe como [resumen, *últimos MEMORIA_MENSAJES_RECIENTES]
+   empezando siempre en un HumanMessage, de modo que el tamaño del estado
+   queda acotado independientemente del nº de turnos.
+3. ConstructorContexto incorpora el resumen al system prompt.
+
+No se compacta un hilo con un turno en curso. Cada turno que empieza
+mientras se compacta el hilo incrementa su generación; antes de escribir se
+comprueba que ni la generación ni el checkpoint han cambiado desde que se
+leyó el estado (generar el resumen tarda segundos y un turno entero cabe en
+ese hueco). Si cambiaron, la compactación se descarta y se repite en cuanto
+termina la que está en curso. La generación se borra al acabar la
+compactación, así que solo hay entradas para los hilos que se compactan.
+
+MEMORIA_MAX_MENSAJES=0 desactiva el mecanismo.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from collections import Counter
+from contextlib import contextmanager
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+from .AgentConfig import _crear_chat_llm, _llm_invoke_con_retry, _spec_modelo
+from .ConstructorContexto import CLAVE_RESUMEN, es_resumen
+
+MEMORIA_MAX_MENSAJES = int(os.getenv("MEMORIA_MAX_MENSAJES", "20"))
+MEMORIA_MENSAJES_RECIENTES = int(os.getenv("MEMORIA_MENSAJES_RECIENTES", "8"))
+_MAX_CHARS_POR_MENSAJE = 800
+_MAX_CHARS_RESUMEN = 2000
+
+# tipo_consulta → nodo que escribió la última respuesta (para aupdate_state)
+_NODO_POR_RAMA = {
+    "publica": "chatbot_publico",
+    "profesorado": "chatbot_profesorado",
+    "legislacion": "chatbot_legislacion",
+}
+
+_PROMPT_RESUMEN = """Eres el sistema de memoria del asistente del IES Jándula.
+Resume la conversación siguiente entre un usuario y el asistente para que el
+asistente pueda continuarla sin el historial completo.
+
+- Conserva datos concretos: nombres, cursos, fechas, plazos, normativa citada,
+  decisiones tomadas y preguntas que quedaron pendientes.
+- Integra el resumen previo (si lo hay) con los turnos nuevos; no lo repitas.
+- Escribe en español, en tercera persona, en un máximo de 10 viñetas breves.
+- No inventes nada que no aparezca en la conversación."""
+
+_TURNOS_ACTIVOS: Counter[str] = Counter()
+_GENERACION: Counter[str] = Counter()  # turnos empezados durante la compactación del hilo
+_COMPACTANDO: set[str] = set()
+_REPETIR: set[str] = set()  # hilos que pidieron compactación mientras ya se compactaban
+_TAREAS: set[asyncio.Task] = set()
+_METRICAS = {"compactaciones": 0, "mensajes_eliminados": 0, "descartadas": 0, "errores": 0}
+
+
+@contextmanager
+def turno_activo(thread_id: str):
+    """Marca el hilo como ocupado mientras el grafo procesa un turno."""
+    _TURNOS_ACTIVOS[thread_id] += 1
+    if thread_id in _COMPACTANDO:
+        _GENERACION[thread_id] += 1
+    try:
+        yield
+    finally:
+        _TURNOS_ACTIVOS[thread_id] -= 1
+        if _TURNOS_ACTIVOS[thread_id] <= 0:
+            del _TURNOS_ACTIVOS[thread_id]
+
+
+def programar_compactacion(grafo, thread_id: str) -> None:
+    """Lanza la compactación del hilo en segundo plano (no bloquea la respuesta)."""
+    if MEMORIA_MAX_MENSAJES <= 0:
+        return
+    if thread_id in _COMPACTANDO:
+        _REPETIR.add(thread_id)
+        return
+    tarea = asyncio.create_task(_compactar(grafo, thread_id))
+    _TAREAS.add(tarea)  # referencia fuerte hasta que termine
+    tarea.add_done_callback(_TAREAS.discard)
+
+
+def _texto(content) -> str:
+    if isinstance(content, list):
+        return " ".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content)
+    return str(content)
+
+
+def _corte(mensajes: list) -> int | None:
+    """Índice del primer mensaje reciente (un HumanMessage), o None si no hay corte válido."""
+    for i in range(max(0, len(mensajes) - MEMORIA_MENSAJES_RECIENTES), len(mensajes)):
+        if isinstance(mensajes[i], HumanMessage):
+            return i if i > 0 else None
+    return None
+
+
+def _transcribir(mensajes: list) -> str:
+    """Turnos usuario/asistente en texto plano (sin tools ni llamadas a tools)."""
+    lineas = []
+    for m in mensajes:
+        if isinstance(m, HumanMessage):
+            rol = "Usuario"
+        elif isinstance(m, AIMessage) and not getattr(m, "tool_calls", None):
+            rol = "Asistente"
+        else:
+            continue  # ToolMessage / AIMessage con tool_calls / resúmenes
+        texto = _texto(m.content).strip()
+        if texto:
+            lineas.append(f"{rol}: {texto[:_MAX_CHARS_POR_MENSAJE]}")
+    return "\n".join(lineas)
+
+
+def _id_checkpoint(estado) -> str | None:
+    return ((estado.config or {}).get("configurable") or {}).get("checkpoint_id") if estado else None
+
+
+async def _generar_resumen(thread_id: str, previo: str, antiguos: list) -> str:
+    llm = _crear_chat_llm(
+        temperature=0.0, streaming=False,
+        specs=_spec_modelo("LLM_MODELO_RESUMEN") or _spec_modelo("LLM_MODELO_RAPIDO"),
+    )
+    contenido = (f"RESUMEN PREVIO:\n{previo}\n\n" if previo else "") + \
+                f"CONVERSACIÓN:\n{_transcribir(antiguos)}"
+    config = {"configurable": {"thread_id": thread_id, "prioridad_llm": "warmup"}}
+    respuesta = await _llm_invoke_con_retry(
+        llm, [SystemMessage(content=_PROMPT_RESUMEN), HumanMessage(content=contenido)], config=config
+    )
+    return _texto(respuesta.content).strip()[:_MAX_CHARS_RESUMEN]
+
+
+async def _compactar(grafo, thread_id: str) -> None:
+    _COMPACTANDO.add(thread_id)
+    try:
+        config = {"configurable": {"thread_id": thread_id}}
+        generacion = _GENERACION[thread_id]
+        estado = await grafo.aget_state(config)
+        mensajes = estado.values.get("messages", []) if estado else []
+        if len(mensajes) <= MEMORIA_MAX_MENSAJES or _TURNOS_ACTIVOS[thread_id]:
+            return
+
+        corte = _corte(mensajes)
+        if corte is None:
+            return
+        antiguos, recientes = mensajes[:corte], mensajes[corte:]
+        previo = "\n".join(_texto(m.content) for m in antiguos if es_resumen(m))
+
+        resumen = await _generar_resumen(thread_id, previo, antiguos)
+        if not resumen:
+            return
+
+        # Mientras se generaba el resumen pudo empezar (o empezar y terminar) un
+        # turno: reescribir con 'recientes' borraría sus mensajes.
+        actual = await grafo.aget_state(config)
+        if (_TURNOS_ACTIVOS[thread_id] or _GENERACION[thread_id] != generacion
+                or _id_checkpoint(actual) != _id_checkpoint(estado)):
+            _METRICAS["descartadas"] += 1
+            print(f"   🧠 [MEMORIA] Compactación de '{thread_id}' descartada (el hilo ha cambiado)")
+            return
+
+        nodo = _NODO_POR_RAMA.get(estado.values.get("tipo_consulta") or "publica", "chatbot_publico")
+        await grafo.aupdate_state(
+            config,
+            {"messages": [
+                RemoveMessage(id=REMOVE_ALL_MESSAGES),
+                SystemMessage(content=resumen, additional_kwargs={CLAVE_RESUMEN: True}),
+                *recientes,
+            ]},
+            as_node=nodo,
+        )
+        _METRICAS["compactaciones"] += 1
+        _METRICAS["mensajes_eliminados"] += len(antiguos)
+        print(f"   🧠 [MEMORIA] Hilo '{thread_id}' compactado: {len(mensajes)} → {len(recientes) + 1} mensajes")
+    except Exception as e:
+        _METRICAS["errores"] += 1
+        print(f"   ⚠️ [MEMORIA] Error compactando '{thread_id}': {e}")
+    finally:
+        _COMPACTANDO.discard(thread_id)
+        _GENERACION.pop(thread_id, None)
+        if thread_id in _REPETIR:
+            _REPETIR.discard(thread_id)
+            programar_compactacion(grafo, thread_id)
+
+
+def stats_memoria() -> dict:
+    return {
+        **_METRICAS,
+        "max_mensajes": MEMORIA_MAX_MENSAJES,
+        "mensajes_recientes": MEMORIA_MENSAJES_RECIENTES,
+        "en_curso": len(_COMPACTANDO),
+    }
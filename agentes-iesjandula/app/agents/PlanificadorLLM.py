@@ -0,0 +1,307 @@
+"""
+PlanificadorLLM.py — IES Jándula
+Planificador central y asíncrono para TODAS las llamadas al chat-LLM
+(clasificador y nodos chatbot).
+
+Sustituye las esperas exponenciales ciegas de cada petición por una cola
+ordenada común:
+- Presupuesto de peticiones por minuto POR PROVEEDOR (ventana deslizante de
+  60 s): LLM_RPM_<PROVEEDOR>, con Gemini heredando LLM_RPM (free tier: 5 rpm)
+  y los proveedores autohospedados (ollama, openai-compatible) sin límite.
+- Clases de prioridad: stream interactivo > chat síncrono > warmup/background.
+- Reparto justo (round-robin) entre usuarios/hilos dentro de cada prioridad.
+- Métricas de profundidad de cola y tiempo de espera (expuestas en /api/admin/stats).
+
+Cada petición declara los proveedores que puede usar (el router, varios) y
+se admite en cuanto UNO tiene cuota: el turno reserva la emisión en ese
+proveedor y lo expone en 'proveedor_asignado' para que el router lo pruebe
+primero. Así un Gemini agotado no frena el failover a un Ollama local.
+
+Ante un 429 por minuto se PAUSA el cupo de ese proveedor hasta que su ventana
+se libera, en vez de que cada petición duerma por su cuenta y vuelva a golpear
+la misma cuota agotada (efecto manada).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+# Prioridades (menor número = antes)
+PRIORIDAD_STREAM = 0
+PRIORIDAD_CHAT = 1
+PRIORIDAD_WARMUP = 2
+
+_NOMBRES_PRIORIDAD = {
+    PRIORIDAD_STREAM: "stream",
+    PRIORIDAD_CHAT: "chat",
+    PRIORIDAD_WARMUP: "warmup",
+}
+_PRIORIDAD_POR_NOMBRE = {v: k for k, v in _NOMBRES_PRIORIDAD.items()}
+
+_VENTANA_S = 60.0
+_CUPO_DEFECTO = "default"  # LLMs sin proveedor conocido: presupuesto LLM_RPM
+
+# Proveedor cuyo cupo reservó el turno en curso (el router lo prueba primero)
+proveedor_asignado: ContextVar[str | None] = ContextVar("proveedor_asignado", default=None)
+
+
+def rpm_proveedor(proveedor: str) -> int:
+    """Peticiones/minuto de un proveedor (LLM_RPM_<PROVEEDOR>); 0 = sin límite."""
+    valor = os.getenv(f"LLM_RPM_{proveedor.strip().upper()}")
+    if valor is None and proveedor.strip().lower() == "gemini":
+        valor = os.getenv("LLM_RPM", "5")
+    return int(valor or 0)
+
+
+def prioridad_desde_nombre(nombre: str | int | None) -> int:
+    """Convierte 'stream' | 'chat' | 'warmup' (o un int) en la prioridad numérica."""
+    if isinstance(nombre, int):
+        return nombre if nombre in _NOMBRES_PRIORIDAD else PRIORIDAD_CHAT
+    return _PRIORIDAD_POR_NOMBRE.get(str(nombre or "").lower(), PRIORIDAD_CHAT)
+
+
+class _Peticion:
+    __slots__ = ("futuro", "encolada", "proveedores")
+
+    def __init__(self, futuro: asyncio.Future, proveedores: tuple[str, ...]):
+        self.futuro = futuro
+        self.encolada = time.monotonic()
+        self.proveedores = proveedores
+
+
+class _Cupo:
+    """Ventana deslizante de emisiones y pausa por 429 de un proveedor."""
+
+    __slots__ = ("rpm", "emisiones", "pausa_hasta")
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self.emisiones: deque[float] = deque()  # instantes (monotonic) de admisión
+        self.pausa_hasta = 0.0
+
+    def _purgar(self, ahora: float) -> None:
+        while self.emisiones and ahora - self.emisiones[0] >= _VENTANA_S:
+            self.emisiones.popleft()
+
+    def espera(self, ahora: float) -> float:
+        """Segundos hasta que el cupo admita otra petición (0 = libre ya)."""
+        self._purgar(ahora)
+        espera = max(0.0, self.pausa_hasta - ahora)
+        if self.rpm > 0 and len(self.emisiones) >= self.rpm:
+            espera = max(espera, self.emisiones[0] + _VENTANA_S - ahora)
+        return espera
+
+    def registrar(self, ahora: float) -> None:
+        if self.rpm > 0:
+            self.emisiones.append(ahora)
+
+
+class PlanificadorLLM:
+    def __init__(self, rpm: int | None = None, max_concurrencia: int | None = None):
+        # Presupuesto de los LLM sin proveedor declarado; LLM_RPM=0 lo desactiva
+        self._rpm = int(os.getenv("LLM_RPM", rpm if rpm is not None else 5))
+        self._max_concurrencia = int(os.getenv("LLM_MAX_CONCURRENCIA", max_concurrencia or 4))
+
+        # prioridad → (clave usuario/hilo → cola FIFO de peticiones)
+        self._colas: dict[int, OrderedDict[str, deque[_Peticion]]] = {
+            p: OrderedDict() for p in _NOMBRES_PRIORIDAD
+        }
+        self._cupos: dict[str, _Cupo] = {}  # nombre de proveedor → cupo por minuto
+        self._en_curso = 0
+        self._reintento_programado: asyncio.TimerHandle | None = None
+
+        self._metricas = {
+            nombre: {"admitidas": 0, "espera_total_ms": 0.0, "espera_max_ms": 0.0}
+            for nombre in _NOMBRES_PRIORIDAD.values()
+        }
+        self._rate_limits_429 = 0
+
+    # ── API pública ───────────────────────────────────────────────────────────
+
+    @asynccontextmanager
+    async def turno(
+        self,
+        prioridad: str | int | None = None,
+        clave: str | None = None,
+        proveedores: tuple[str, ...] | None = None,
+    ):
+        """
+        Espera turno en la cola y ocupa un hueco de concurrencia durante el bloque.
+        'proveedores' son los cupos que puede usar la llamada (en orden de
+        preferencia); el bloque recibe el proveedor cuyo cupo se reservó.
+        Un 429 por minuto dentro del bloque pausa ese cupo ANTES de devolver el
+        hueco, para que _liberar() no despache la siguiente petición contra la
+        cuota agotada.
+
+            async with planificador_llm.turno("stream", clave=thread_id, proveedores=nombres):
+                respuesta = await llm.ainvoke(...)
+        """
+        from .RouterLLM import _clasificar_error  # RouterLLM importa este módulo
+
+        nombre = await self._adquirir(
+            prioridad_desde_nombre(prioridad), clave or "default", tuple(proveedores or (_CUPO_DEFECTO,))
+        )
+        token = proveedor_asignado.set(nombre)
+        try:
+            yield nombre
+        except Exception as e:
+            fallo = _clasificar_error(e)
+            if fallo is not None and fallo[0] == "cuota por minuto":
+                self.penalizar_rate_limit(nombre)
+            raise
+        finally:
+            proveedor_asignado.reset(token)
+            self._liberar()
+
+    def configurar_cupo(self, nombre: str, rpm: int) -> None:
+        """Fija el presupuesto por minuto de un proveedor (0 = sin límite)."""
+        self._cupo(nombre).rpm = rpm
+
+    def cupo_libre(self, nombre: str) -> bool:
+        return self._cupo(nombre).espera(time.monotonic()) == 0
+
+    def registrar_emision(self, nombre: str) -> None:
+        """Anota una llamada hecha fuera del turno reservado (conmutación del router)."""
+        self._cupo(nombre).registrar(time.monotonic())
+
+    def penalizar_rate_limit(self, nombre: str = _CUPO_DEFECTO, espera_s: float | None = None) -> None:
+        """
+        Registra un 429 por minuto: pausa el cupo de 'nombre' hasta que su ventana
+        de 60 s quede libre (o 'espera_s' si se indica), en lugar de backoffs
+        individuales. Las peticiones que admiten otro proveedor siguen saliendo.
+        """
+        self._rate_limits_429 += 1
+        cupo = self._cupo(nombre)
+        ahora = time.monotonic()
+        if espera_s is None:
+            # La cuota se libera cuando sale de la ventana la emisión más antigua
+            espera_s = (cupo.emisiones[0] + _VENTANA_S - ahora) if cupo.emisiones else _VENTANA_S / 4
+            espera_s = max(espera_s, 5.0)
+        cupo.pausa_hasta = max(cupo.pausa_hasta, ahora + espera_s)
+        print(f"   ⏸️  [PLANIFICADOR] 429 por minuto en '{nombre}' → cupo pausado {espera_s:.0f}s")
+
+    def stats(self) -> dict:
+        ahora = time.monotonic()
+        cupos = {
+            nombre: {
+                "rpm_limite": cupo.rpm,
+                "rpm_usadas": len(cupo.emisiones),
+                "pausa_restante_s": round(max(0.0, cupo.pausa_hasta - ahora), 1),
+                "espera_s": round(cupo.espera(ahora), 1),
+            }
+            for nombre, cupo in self._cupos.items()
+        }
+        por_prioridad = {}
+        for p, nombre in _NOMBRES_PRIORIDAD.items():
+            m = self._metricas[nombre]
+            por_prioridad[nombre] = {
+                "en_cola": sum(len(q) for q in self._colas[p].values()),
+                "admitidas": m["admitidas"],
+                "espera_media_ms": round(m["espera_total_ms"] / m["admitidas"], 1) if m["admitidas"] else 0,
+                "espera_max_ms": round(m["espera_max_ms"], 1),
+            }
+        return {
+            "max_concurrencia": self._max_concurrencia,
+            "en_curso": self._en_curso,
+            "en_cola": sum(v["en_cola"] for v in por_prioridad.values()),
+            "rate_limits_429": self._rate_limits_429,
+            "cupos": cupos,
+            "prioridades": por_prioridad,
+        }
+
+    # ── Internos ──────────────────────────────────────────────────────────────
+
+    async def _adquirir(self, prioridad: int, clave: str, proveedores: tuple[str, ...]) -> str:
+        loop = asyncio.get_running_loop()
+        peticion = _Peticion(loop.create_future(), proveedores)
+        self._colas[prioridad].setdefault(clave, deque()).append(peticion)
+        self._despachar()
+        try:
+            nombre = await peticion.futuro
+        except asyncio.CancelledError:
+            # Si ya se nos había concedido el hueco, devolverlo
+            if peticion.futuro.done() and not peticion.futuro.cancelled():
+                self._liberar()
+            raise
+
+        espera_ms = (time.monotonic() - peticion.encolada) * 1000
+        m = self._metricas[_NOMBRES_PRIORIDAD[prioridad]]
+        m["admitidas"] += 1
+        m["espera_total_ms"] += espera_ms
+        m["espera_max_ms"] = max(m["espera_max_ms"], espera_ms)
+        if espera_ms > 1000:
+            print(f"   ⏳ [PLANIFICADOR] Turno concedido tras {espera_ms / 1000:.1f}s en cola "
+                  f"({_NOMBRES_PRIORIDAD[prioridad]}, {nombre})")
+        return nombre
+
+    def _liberar(self) -> None:
+        self._en_curso = max(0, self._en_curso - 1)
+        self._despachar()
+
+    def _cupo(self, nombre: str) -> _Cupo:
+        if nombre not in self._cupos:
+            self._cupos[nombre] = _Cupo(self._rpm)
+        return self._cupos[nombre]
+
+    def _siguiente(self, ahora: float) -> tuple[_Peticion | None, str | None, float | None]:
+        """
+        (petición, proveedor) a despachar: mayor prioridad primero, round-robin
+        por clave. Se salta las claves cuyos proveedores no tienen cupo (sin
+        romper su FIFO); si no sale ninguna, el tercer valor es la espera mínima.
+        """
+        espera_min = None
+        for p in sorted(self._colas):
+            colas = self._colas[p]
+            for clave in list(colas):
+                cola = colas[clave]
+                while cola and cola[0].futuro.done():  # descartar las canceladas
+                    cola.popleft()
+                if not cola:
+                    del colas[clave]
+                    continue
+                peticion = cola[0]
+                esperas = {n: self._cupo(n).espera(ahora) for n in peticion.proveedores}
+                libre = next((n for n, e in esperas.items() if e == 0), None)
+                if libre is None:
+                    espera = min(esperas.values())
+                    espera_min = espera if espera_min is None else min(espera_min, espera)
+                    continue
+                cola.popleft()
+                if cola:
+                    colas.move_to_end(clave)  # el resto de esta clave espera su vuelta
+                else:
+                    del colas[clave]
+                return peticion, libre, None
+        return None, None, espera_min
+
+    def _despachar(self) -> None:
+        ahora = time.monotonic()
+        while self._en_curso < self._max_concurrencia:
+            peticion, nombre, espera = self._siguiente(ahora)
+            if peticion is None:
+                if espera is not None:
+                    self._programar_reintento(espera)
+                return
+            self._en_curso += 1
+            self._cupo(nombre).registrar(ahora)
+            peticion.futuro.set_result(nombre)
+
+    def _programar_reintento(self, retraso: float) -> None:
+        if self._reintento_programado is not None and not self._reintento_programado.cancelled():
+            return  # ya hay un despertar pendiente
+        loop = asyncio.get_running_loop()
+
+        def _despertar():
+            self._reintento_programado = None
+            self._despachar()
+
+        self._reintento_programado = loop.call_later(max(retraso, 0.05), _despertar)
+
+
+# Instancia singleton compartida por todos los grafos
+planificador_llm = PlanificadorLLM()
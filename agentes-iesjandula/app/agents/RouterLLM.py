@@ -0,0 +1,266 @@
+"""
+RouterLLM.py — IES Jándula
+Chat-LLM "router" que agrupa varios proveedores (Gemini de distintos tiers,
+Ollama, cualquier servidor compatible con OpenAI) y conmuta entre ellos.
+
+Se activa con LLM_ROUTER, una lista separada por comas de especificaciones:
+
+    proveedor:modelo[@base_url][#peticiones_por_dia]
+
+    LLM_ROUTER=gemini:gemini-2.5-flash#250,gemini:gemini-2.0-flash-lite#1000,ollama:qwen2.5:7b@http://ollama:11434,openai:llama3.1@http://localhost:8080/v1
+
+- Ante 429/5xx/errores de conexión se marca el proveedor como no disponible
+  (cuota diaria → hasta las 00:00 UTC; por minuto → 60 s; caídas → backoff)
+  y se reintenta EN LA MISMA llamada con el siguiente, sin perder el turno.
+- Política (LLM_ROUTER_POLITICA): 'prioridad' (orden declarado, por defecto)
+  o 'latencia' (menor latencia media primero).
+- Cada proveedor tiene su propio presupuesto por minuto en el planificador
+  (LLM_RPM_<PROVEEDOR>): se prueba primero el que reservó el turno y, al
+  conmutar, se saltan los que tienen la ventana llena.
+- El estado de salud es global por especificación: todos los grafos ven la
+  misma cuota agotada de un modelo.
+
+Nota: si un proveedor falla a MITAD de un stream, los tokens ya emitidos no
+se retiran; en la práctica los 429/5xx llegan antes del primer token.
+
+Para probarlo sin red: scratch/servidor_llm_local.py (servidor OpenAI-compatible).
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from .PlanificadorLLM import planificador_llm, proveedor_asignado, rpm_proveedor
+
+_ALFA_LATENCIA = 0.3
+_BLOQUEO_MINUTO_S = 60.0
+_BLOQUEO_BASE_S = 15.0
+_BLOQUEO_MAX_S = 300.0
+
+# Errores de red/caída por tipo: los de httpx (ollama, openai y google-genai lo
+# usan por debajo) y los de la librería estándar. Las excepciones propias de cada
+# SDK se reconocen por nombre para no importar SDKs opcionales.
+_TIPOS_CAIDA = (httpx.ConnectError, httpx.TimeoutException, httpx.RemoteProtocolError,
+                ConnectionError, TimeoutError)
+_NOMBRES_CAIDA = {
+    "APIConnectionError", "APITimeoutError",                                       # openai
+    "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "ServerError",  # google
+}
+
+
+class _EstadoProveedor:
+    """Salud y consumo de un proveedor/modelo concreto (compartido entre grafos)."""
+
+    def __init__(self, nombre: str, rpd: int | None):
+        self.nombre = nombre
+        self.rpd = rpd
+        self.latencia_ewma_ms: float | None = None
+        self.exitos = 0
+        self.fallos = 0
+        self.fallos_consecutivos = 0
+        self.bloqueado_hasta = 0.0
+        self.motivo_bloqueo = ""
+        self.peticiones_hoy = 0
+        self._dia = datetime.now(timezone.utc).date()
+
+    def _rotar_dia(self) -> None:
+        hoy = datetime.now(timezone.utc).date()
+        if hoy != self._dia:
+            self._dia = hoy
+            self.peticiones_hoy = 0
+
+    def disponible(self) -> bool:
+        self._rotar_dia()
+        if self.rpd is not None and self.peticiones_hoy >= self.rpd:
+            return False
+        return time.time() >= self.bloqueado_hasta
+
+    def registrar_exito(self, latencia_ms: float) -> None:
+        self.exitos += 1
+        self.fallos_consecutivos = 0
+        self.motivo_bloqueo = ""
+        if self.latencia_ewma_ms is None:
+            self.latencia_ewma_ms = latencia_ms
+        else:
+            self.latencia_ewma_ms = _ALFA_LATENCIA * latencia_ms + (1 - _ALFA_LATENCIA) * self.latencia_ewma_ms
+
+    def bloquear(self, segundos: float, motivo: str) -> None:
+        self.fallos += 1
+        self.fallos_consecutivos += 1
+        self.bloqueado_hasta = max(self.bloqueado_hasta, time.time() + segundos)
+        self.motivo_bloqueo = motivo
+        print(f"   🔌 [ROUTER LLM] '{self.nombre}' fuera de servicio {segundos:.0f}s ({motivo})")
+
+    def stats(self) -> dict:
+        return {
+            "disponible": self.disponible(),
+            "latencia_media_ms": round(self.latencia_ewma_ms, 1) if self.latencia_ewma_ms is not None else None,
+            "exitos": self.exitos,
+            "fallos": self.fallos,
+            "peticiones_hoy": self.peticiones_hoy,
+            "limite_diario": self.rpd,
+            "bloqueado_restante_s": round(max(0.0, self.bloqueado_hasta - time.time()), 1),
+            "motivo_bloqueo": self.motivo_bloqueo,
+        }
+
+
+# nombre de especificación → estado (global al proceso)
+_ESTADOS: dict[str, _EstadoProveedor] = {}
+
+
+def parsear_spec(spec: str) -> dict:
+    """'ollama:qwen2.5:7b@http://host:11434#500' → {proveedor, modelo, base_url, rpd, nombre}."""
+    spec = spec.strip()
+    nombre = spec
+    rpd = None
+    if "#" in spec:
+        spec, _rpd = spec.rsplit("#", 1)
+        rpd = int(_rpd) if _rpd.strip().isdigit() else None
+    base_url = None
+    if "@" in spec:
+        spec, base_url = spec.split("@", 1)
+    if ":" in spec:
+        proveedor, modelo = spec.split(":", 1)
+    else:
+        proveedor, modelo = os.getenv("LLM_PROVIDER", "gemini"), spec
+    return {
+        "nombre": nombre.split("#", 1)[0],
+        "proveedor": proveedor.strip().lower(),
+        "modelo": modelo.strip(),
+        "base_url": base_url.strip() if base_url else None,
+        "rpd": rpd,
+    }
+
+
+def _segundos_hasta_medianoche_utc() -> float:
+    ahora = datetime.now(timezone.utc)
+    manana = (ahora + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (manana - ahora).total_seconds()
+
+
+def _cadena(error: BaseException):
+    """La excepción y sus causas (los SDK envuelven el error de httpx)."""
+    vistos = set()
+    while error is not None and id(error) not in vistos:
+        vistos.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _estado_http(error: BaseException) -> int | None:
+    """Código HTTP de la excepción (status_code en openai/ollama/httpx, code en google)."""
+    respuesta = getattr(error, "response", None)
+    for valor in (getattr(error, "status_code", None), getattr(error, "code", None),
+                  getattr(respuesta, "status_code", None)):
+        if isinstance(valor, int) and 100 <= valor < 600:
+            return valor
+    return None
+
+
+def _clasificar_error(error: BaseException) -> tuple[str, float] | None:
+    """Devuelve (motivo, segundos de bloqueo) si el error justifica conmutar de proveedor."""
+    err = str(error)
+    cadena = list(_cadena(error))
+    estados = {estado for estado in map(_estado_http, cadena) if estado}
+    if 429 in estados or "RESOURCE_EXHAUSTED" in err or "rate limit" in err.lower():
+        if "PerDay" in err or "per_day" in err.lower():
+            return "cuota diaria", _segundos_hasta_medianoche_utc()
+        return "cuota por minuto", _BLOQUEO_MINUTO_S
+    if (any(estado >= 500 for estado in estados)
+            or any(isinstance(e, _TIPOS_CAIDA) or type(e).__name__ in _NOMBRES_CAIDA for e in cadena)):
+        return "caída/5xx", 0.0  # el backoff depende de los fallos consecutivos
+    return None
+
+
+class RouterChatLLM:
+    """
+    Duck-typing de chat-model: expone ainvoke() y bind_tools(), que es todo lo
+    que usa el grafo. Cada 'bind_tools' devuelve un router nuevo con los mismos
+    estados de salud y los modelos subyacentes ya enlazados a las tools.
+    """
+
+    def __init__(self, proveedores: list[tuple[_EstadoProveedor, object]], politica: str | None = None):
+        if not proveedores:
+            raise ValueError("⚠️ RouterChatLLM necesita al menos un proveedor")
+        self._proveedores = proveedores
+        self._politica = (politica or os.getenv("LLM_ROUTER_POLITICA", "prioridad")).strip().lower()
+
+    @classmethod
+    def desde_specs(cls, specs: str, fabrica, **kwargs_modelo) -> "RouterChatLLM":
+        """
+        Construye el router a partir de LLM_ROUTER.
+        'fabrica(proveedor, modelo, base_url, **kwargs_modelo)' crea cada chat-model.
+        """
+        proveedores = []
+        for spec in (s for s in specs.split(",") if s.strip()):
+            datos = parsear_spec(spec)
+            estado = _ESTADOS.setdefault(datos["nombre"], _EstadoProveedor(datos["nombre"], datos["rpd"]))
+            planificador_llm.configurar_cupo(datos["nombre"], rpm_proveedor(datos["proveedor"]))
+            llm = fabrica(datos["proveedor"], datos["modelo"], datos["base_url"], **kwargs_modelo)
+            proveedores.append((estado, llm))
+        print(f"   🔀 LLM Router: {[e.nombre for e, _ in proveedores]}")
+        return cls(proveedores)
+
+    @property
+    def nombres(self) -> tuple[str, ...]:
+        """Proveedores del router, en orden declarado (cupos para el planificador)."""
+        return tuple(estado.nombre for estado, _ in self._proveedores)
+
+    def bind_tools(self, tools, **kwargs) -> "RouterChatLLM":
+        return RouterChatLLM(
+            [(estado, llm.bind_tools(tools, **kwargs)) for estado, llm in self._proveedores],
+            politica=self._politica,
+        )
+
+    def _orden(self) -> list[tuple[_EstadoProveedor, object]]:
+        asignado = proveedor_asignado.get()
+        disponibles = [
+            p for p in self._proveedores
+            if p[0].disponible() and (p[0].nombre == asignado or planificador_llm.cupo_libre(p[0].nombre))
+        ]
+        if self._politica == "latencia":
+            # Los que aún no tienen medida se prueban primero para obtenerla
+            disponibles.sort(key=lambda p: p[0].latencia_ewma_ms or 0.0)
+        # El proveedor cuyo cupo reservó el planificador va delante
+        disponibles.sort(key=lambda p: p[0].nombre != asignado)
+        return disponibles
+
+    async def ainvoke(self, mensajes, config=None, **kwargs):
+        ultimo_error: Exception | None = None
+        asignado = proveedor_asignado.get()
+        for estado, llm in self._orden():
+            t0 = time.perf_counter()
+            estado.peticiones_hoy += 1
+            if estado.nombre != asignado:
+                planificador_llm.registrar_emision(estado.nombre)
+            try:
+                respuesta = await llm.ainvoke(mensajes, config=config, **kwargs)
+            except Exception as e:
+                fallo = _clasificar_error(e)
+                if fallo is None:
+                    raise  # error de la petición (no del proveedor): conmutar no ayuda
+                motivo, segundos = fallo
+                if not segundos:
+                    segundos = min(_BLOQUEO_BASE_S * 2 ** estado.fallos_consecutivos, _BLOQUEO_MAX_S)
+                estado.bloquear(segundos, motivo)
+                ultimo_error = e
+                continue
+            estado.registrar_exito((time.perf_counter() - t0) * 1000)
+            return respuesta
+
+        if ultimo_error is not None:
+            raise ultimo_error
+        # Ninguno disponible antes de intentarlo: propagar como rate-limit para
+        # que el planificador pause la cola (o informe de cuota diaria).
+        motivos = {e.motivo_bloqueo for e, _ in self._proveedores}
+        tipo = "PerDay" if motivos == {"cuota diaria"} else "PerMinute"
+        raise RuntimeError(f"429 RESOURCE_EXHAUSTED ({tipo}): ningún proveedor LLM disponible")
+
+
+def stats_router() -> dict:
+    """Estado de salud/consumo de todos los proveedores configurados."""
+    return {nombre: estado.stats() for nombre, estado in _ESTADOS.items()}
@@ -1,17 +1,17 @@
 """
 Audio.py — IES Jándula
-STT : Whisper medium   — mejor precisión en español que whisper-base
+STT : Whisper          — backend en BackendsSTT.py (faster-whisper int8 por defecto)
 TTS : kokoro-onnx      — compatible con Python 3.13, sin espeak-ng, sin compilador C
 
 Instalación:
-    pip install kokoro-onnx soundfile torch transformers
+    pip install kokoro-onnx soundfile torch transformers faster-whisper
 
 Archivos de modelo necesarios (descargar una sola vez):
     onnx/kokoro-v1.0.onnx  →  https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/kokoro-v1.0.onnx
     voices/voices-v1.0.bin →  https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/voices-v1.0.bin
 
 Coloca ambos archivos en el mismo directorio que este script,
-o ajusta MODEL_PATH y VOICES_PATH a la ruta que prefieras.
+o ajusta MODEL_PATH y VOICES_PATH (en ModelosVoz.py) a la ruta que prefieras.
 
 Voces en español disponibles:
     ef_dora   — femenina (recomendada, la más natural)
@@ -20,134 +20,192 @@ Voces en español disponibles:
     em_santa  — masculina alternativa
 """
 
-import torch
-import numpy as np
-import soundfile as sf
+import io
+import re
+import struct
+import subprocess
 from pathlib import Path
-from transformers import pipeline
+from typing import AsyncIterator
 
+import numpy as np
+import soundfile as sf
 
-# ── Rutas de los archivos ONNX ────────────────────────────────────────────────
-_BASE_DIR   = Path(__file__).parent
-MODEL_PATH  = _BASE_DIR / "kokoro-v1.0.onnx"
-VOICES_PATH = _BASE_DIR / "voices-v1.0.bin"
+from .ModelosVoz import VOICES_PATH, modelos_voz
 
 LANG_CODE = "es"
+VOZ_DEFECTO = "ef_dora"
+VELOCIDAD_VOZ = 0.95  # ligeramente más lento suena más natural en español
+SAMPLE_RATE = 24000  # Kokoro siempre sintetiza a 24 kHz
+_PAUSA_ENTRE_FRASES_S = 0.15  # Kokoro recorta el silencio de cada frase
+
+# Segmentación para TTS en streaming: se corta en fin de frase a partir de
+# _MIN_CHARS_FRASE (la primera frase corta = primer audio antes) y, si no hay
+# puntuación, en el último espacio antes de _MAX_CHARS_FRASE.
+_MIN_CHARS_FRASE = 20
+_MAX_CHARS_FRASE = 250
+_RE_FIN_FRASE = re.compile(r"(?<=[.!?…:;])\s+|\n+")
+_RE_ENLACE_MD = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_RE_URL = re.compile(r"https?://\S+")
+_RE_MARKDOWN = re.compile(r"[*_#`>|]+|^\s*[-•]\s+", re.MULTILINE)
+
+
+def cabecera_wav_stream(sample_rate: int = SAMPLE_RATE) -> bytes:
+    """
+    Cabecera WAV PCM16 mono de longitud desconocida (tamaños a 0xFFFFFFFF):
+    navegadores y reproductores leen las muestras hasta que se cierra el stream.
+    """
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 0xFFFFFFFF, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", 0xFFFFFFFF,
+    )
+
+
+def a_pcm16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+PAUSA_ENTRE_FRASES_PCM = a_pcm16(np.zeros(int(SAMPLE_RATE * _PAUSA_ENTRE_FRASES_S), dtype=np.float32))
+
+
+# formato → (formato libsndfile, subtipo, códec ffmpeg, contenedor ffmpeg, media type)
+FORMATOS_AUDIO = {
+    "wav": ("WAV", "PCM_16", "pcm_s16le", "wav", "audio/wav"),
+    "opus": ("OGG", "OPUS", "libopus", "ogg", "audio/ogg"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "libmp3lame", "mp3", "audio/mpeg"),
+}
+_BITRATE_COMPRIMIDO = "32k"  # voz mono: de sobra para Opus/MP3
+
+
+def codificar_audio(samples: np.ndarray, sample_rate: int = SAMPLE_RATE, formato: str = "wav") -> bytes:
+    """Codifica en memoria con soundfile; si libsndfile no trae el códec, con ffmpeg por tuberías."""
+    formato_sf, subtipo, codec, contenedor, _ = FORMATOS_AUDIO[formato]
+    buffer = io.BytesIO()
+    try:
+        sf.write(buffer, samples, sample_rate, format=formato_sf, subtype=subtipo)
+        return buffer.getvalue()
+    except (RuntimeError, ValueError, TypeError):
+        # libsndfile < 1.1 no soporta Opus ni MP3
+        pass
+    comando = [
+        "ffmpeg", "-loglevel", "error",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+        "-c:a", codec,
+    ]
+    if formato != "wav":
+        comando += ["-b:a", _BITRATE_COMPRIMIDO]
+    comando += ["-f", contenedor, "pipe:1"]
+    return subprocess.run(comando, input=a_pcm16(samples), capture_output=True, check=True).stdout
+
+
+def limpiar_para_voz(texto: str) -> str:
+    """Quita markdown, enlaces y URLs que el TTS leería literalmente."""
+    texto = _RE_ENLACE_MD.sub(r"\1", texto)
+    texto = _RE_URL.sub("", texto)
+    texto = _RE_MARKDOWN.sub("", texto)
+    return " ".join(texto.split())
+
+
+def _buscar_corte(buffer: str) -> int | None:
+    for m in _RE_FIN_FRASE.finditer(buffer):
+        if m.start() >= _MIN_CHARS_FRASE:
+            return m.end()
+    if len(buffer) > _MAX_CHARS_FRASE:
+        espacio = buffer.rfind(" ", 0, _MAX_CHARS_FRASE)
+        return espacio + 1 if espacio > 0 else _MAX_CHARS_FRASE
+    return None
+
+
+async def frases_de_tokens(tokens: AsyncIterator[str | None]) -> AsyncIterator[str]:
+    """
+    Agrupa los tokens del LLM en frases listas para sintetizar.
+    Un None descarta lo acumulado (texto previo a una llamada a herramienta).
+    """
+    buffer = ""
+    async for token in tokens:
+        if token is None:
+            buffer = ""
+            continue
+        buffer += token
+        while (corte := _buscar_corte(buffer)) is not None:
+            frase, buffer = limpiar_para_voz(buffer[:corte]), buffer[corte:]
+            if frase:
+                yield frase
+    frase = limpiar_para_voz(buffer)
+    if frase:
+        yield frase
 
 
 class MotorVoz:
-    def __init__(self,voz:str ="ef_dora", voz_path: Path = VOICES_PATH):
-        self._device    = "cuda" if torch.cuda.is_available() else "cpu"
+    """
+    Fachada ligera sobre los modelos compartidos de ModelosVoz: crear un
+    MotorVoz no carga nada, y todos usan el mismo Whisper y el mismo Kokoro.
+    """
+
+    def __init__(self,voz:str =VOZ_DEFECTO, voz_path: Path = VOICES_PATH):
         self._voz    = voz
         self._voz_path  = Path(voz_path)
         self._stt       = None
         self._tts       = None
 
-    # ── Carga perezosa ────────────────────────────────────────────────────────
+    # ── Carga perezosa (una vez por proceso, en el registro) ──────────────────
 
     def _cargar_stt(self):
-        if self._stt is not None:
-            return
-        print("Cargando Whisper base...")
-        self._stt = pipeline(
-            "automatic-speech-recognition",
-            model="openai/whisper-base",
-            device=0 if self._device == "cuda" else -1,
-            generate_kwargs={"language": "spanish", "task": "transcribe"},
-            chunk_length_s=30,
-            stride_length_s=5,
-        )
-        print("STT listo.")
+        if self._stt is None:
+            self._stt = modelos_voz.stt()
 
     def _cargar_tts(self):
-        if self._tts is not None:
-            return
-
-        if not MODEL_PATH.exists():
-            raise FileNotFoundError(
-                f"Falta el modelo Kokoro.\n"
-                f"Descarga 'kokoro-v1.0.onnx' desde:\n"
-                f"  https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/kokoro-v1.0.onnx\n"
-                f"y colócalo en: '{_BASE_DIR}'"
-            )
-        if not self._voz_path.exists():
-            raise FileNotFoundError(
-                f"Falta el archivo de voz '{self._voz_path.name}'.\n"
-                f"Descárgalo desde:\n"
-                f"  https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/voices-v1.0.bin\n"
-                f"y colócalo en: '{_BASE_DIR}'"
-            )
-
-        print("Cargando Kokoro ONNX...")
-        from kokoro_onnx import Kokoro
-        self._tts = Kokoro(str(MODEL_PATH), str(self._voz_path))
-        print("TTS listo.")
+        if self._tts is None:
+            self._tts = modelos_voz.tts(self._voz_path)
 
     # ── API pública ───────────────────────────────────────────────────────────
 
-    def escuchar(self, ruta: str) -> str:
+    def escuchar(self, audio: bytes | str) -> str:
         """
-        Transcribe un archivo de audio a texto en español.
+        Transcribe audio a texto en español.
 
         Args:
-            ruta: ruta al archivo (.wav, .mp3, .ogg, .m4a)
+            audio: bytes del audio subido (.wav, .webm, .mp3, .ogg, .m4a) o ruta a un archivo
 
         Returns:
             Texto transcrito.
         """
         self._cargar_stt()
-        resultado = self._stt(ruta)
-        texto = resultado["text"].strip()
+        texto = self._stt.transcribir(audio)
         print(f"Transcrito: {texto}")
         return texto
 
-    def hablar(self, texto: str, ruta_salida: str = "respuesta_jandula.wav") -> str:
+    def escuchar_lote(self, audios: list[bytes]) -> list[str]:
+        """Transcribe varios audios en una sola inferencia (micro-batching de PoolVoz)."""
+        self._cargar_stt()
+        textos = self._stt.transcribir_lote(audios)
+        print(f"Transcrito lote de {len(audios)}: {textos}")
+        return textos
+
+    def hablar(self, texto: str, formato: str = "wav") -> bytes:
         """
-        Convierte texto a voz en español y guarda el resultado en WAV.
+        Convierte texto a voz en español, en memoria.
 
         Args:
-            texto:       Texto a sintetizar.
-            ruta_salida: Ruta del archivo WAV de salida.
+            texto:   Texto a sintetizar.
+            formato: "wav", "opus" u "mp3" (ver FORMATOS_AUDIO).
 
         Returns:
-            Ruta del archivo WAV generado.
+            Bytes del audio codificado.
         """
-        self._cargar_tts()
-
-        samples, sample_rate = self._tts.create(
-            texto,
-            voice=self._voz,
-            speed=0.95,     # ligeramente más lento suena más natural en español
-            lang=LANG_CODE,
-        )
+        samples = self.sintetizar(texto)
+        audio = codificar_audio(samples, SAMPLE_RATE, formato)
+        print(f"Audio generado: {len(audio) // 1024} KB ({formato})")
+        return audio
 
-        sf.write(ruta_salida, samples, sample_rate)
-        print(f"Audio guardado en: {ruta_salida}")
-        return ruta_salida
-
-    async def hablar_async(self, texto: str, ruta_salida: str = "respuesta_jandula.wav") -> str:
-        """
-        Versión async para textos largos — genera por fragmentos.
-        Usar dentro de endpoints FastAPI en vez de hablar().
-        """
+    def sintetizar(self, texto: str) -> np.ndarray:
+        """Muestras float32 (24 kHz) de una frase; la usa PoolVoz.hablar_stream."""
         self._cargar_tts()
-
-        fragmentos = []
-        sample_rate_final = 24000
-
-        async for samples, sample_rate in self._tts.create_stream(
+        samples, _ = self._tts.create(
             texto,
             voice=self._voz,
-            speed=0.95,
+            speed=VELOCIDAD_VOZ,
             lang=LANG_CODE,
-        ):
-            fragmentos.append(samples)
-            sample_rate_final = sample_rate
-
-        if not fragmentos:
-            raise RuntimeError("Kokoro no generó audio.")
-
-        audio_final = np.concatenate(fragmentos)
-        sf.write(ruta_salida, audio_final, sample_rate_final)
-        print(f"Audio (stream) guardado en: {ruta_salida}")
-        return ruta_salida
\ No newline at end of file
+        )
+        return samples
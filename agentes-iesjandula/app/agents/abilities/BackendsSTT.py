@@ -0,0 +1,211 @@
+"""
+BackendsSTT.py — IES Jándula
+Backends intercambiables de transcripción (STT_BACKEND).
+
+- faster-whisper (por defecto): Whisper en CTranslate2 cuantizado a int8
+  (STT_COMPUTE_TYPE). En CPU transcribe varias veces más rápido que el
+  pipeline de transformers en float32, con la misma calidad en español.
+  El VAD (Silero) integrado descarta los silencios antes de la inferencia.
+- transformers: el pipeline original de Hugging Face. Se le aplica un VAD
+  por energía (recortar_silencio) antes de la inferencia.
+
+Todos exponen transcribir(audio) -> str, con los bytes subidos (o una ruta),
+y transcribir_lote(audios) -> list[str], que pasa varios clips cortos por
+Whisper en una sola inferencia (lo usa el micro-batching de PoolVoz).
+Decodifican en memoria y son seguros entre hilos.
+STT_MODELO elige el tamaño de Whisper (tiny, base, small, medium...).
+Comparativa de velocidad (RTF) y WER: scratch/bench_stt.py.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import threading
+
+import numpy as np
+
+STT_BACKEND = os.getenv("STT_BACKEND", "faster-whisper").strip().lower()
+STT_MODELO = os.getenv("STT_MODELO", "base")
+STT_COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "int8")
+STT_BEAM = int(os.getenv("STT_BEAM", "1"))
+STT_VAD = os.getenv("STT_VAD", "true").strip().lower() in ("1", "true", "yes")
+
+SAMPLE_RATE_STT = 16000  # Whisper trabaja a 16 kHz mono
+# Whisper ve ventanas de 30 s (relleno con ceros): los clips más cortos se
+# pueden apilar en un lote; los más largos necesitan segmentación propia
+_MAX_MUESTRAS_LOTE = 30 * SAMPLE_RATE_STT
+
+# VAD por energía: ventanas de 30 ms, voz = energía a menos de _UMBRAL_DB del pico;
+# se conservan _MARGEN_S alrededor de la voz y solo se quitan silencios > _SILENCIO_MIN_S
+_VENTANA_S = 0.03
+_UMBRAL_DB = 35.0
+_MARGEN_S = 0.2
+_SILENCIO_MIN_S = 0.5
+
+
+def cargar_audio(audio: bytes | str) -> np.ndarray:
+    """Decodifica cualquier formato (wav, webm, ogg, mp3...) a float32 16 kHz mono, sin tocar disco."""
+    try:
+        from faster_whisper.audio import decode_audio
+        return decode_audio(io.BytesIO(audio) if isinstance(audio, bytes) else audio,
+                            sampling_rate=SAMPLE_RATE_STT)
+    except ImportError:
+        from transformers.pipelines.audio_utils import ffmpeg_read
+        if not isinstance(audio, bytes):
+            with open(audio, "rb") as f:
+                audio = f.read()
+        return ffmpeg_read(audio, SAMPLE_RATE_STT)
+
+
+def recortar_silencio(audio: np.ndarray, sr: int = SAMPLE_RATE_STT) -> np.ndarray:
+    """Quita los tramos de silencio largos (inicio, final e intermedios)."""
+    ventana = int(sr * _VENTANA_S)
+    n = len(audio) // ventana
+    if n == 0:
+        return audio
+    tramas = audio[: n * ventana].reshape(n, ventana)
+    energia_db = 10 * np.log10(np.mean(tramas ** 2, axis=1) + 1e-10)
+    voz = energia_db > energia_db.max() - _UMBRAL_DB
+    if not voz.any():
+        return audio
+
+    # Dilatar la máscara de voz con el margen y rellenar silencios cortos
+    margen = int(_MARGEN_S / _VENTANA_S)
+    hueco_min = int(_SILENCIO_MIN_S / _VENTANA_S)
+    indices = np.flatnonzero(voz)
+    conservar = np.zeros(n, dtype=bool)
+    inicio = fin = indices[0]
+    for i in indices[1:]:
+        if i - fin > hueco_min:
+            conservar[max(0, inicio - margen): fin + margen + 1] = True
+            inicio = i
+        fin = i
+    conservar[max(0, inicio - margen): fin + margen + 1] = True
+    return tramas[conservar].reshape(-1)
+
+
+class STTFasterWhisper:
+    nombre = "faster-whisper"
+
+    def __init__(self, modelo: str = STT_MODELO, compute_type: str = STT_COMPUTE_TYPE):
+        from faster_whisper import WhisperModel
+
+        print(f"Cargando faster-whisper '{modelo}' ({compute_type})...")
+        self.modelo = WhisperModel(
+            modelo,
+            device="cpu",
+            compute_type=compute_type,
+            cpu_threads=int(os.getenv("VOZ_HILOS_INTRAOP", max(1, (os.cpu_count() or 2) // 2))),
+            # Transcripciones concurrentes desde varios workers de PoolVoz
+            num_workers=max(1, int(os.getenv("VOZ_WORKERS", "1"))),
+        )
+
+    def transcribir(self, audio: bytes | str) -> str:
+        segmentos, info = self.modelo.transcribe(
+            io.BytesIO(audio) if isinstance(audio, bytes) else audio,
+            language="es",
+            beam_size=STT_BEAM,
+            vad_filter=STT_VAD,
+            vad_parameters={"min_silence_duration_ms": int(_SILENCIO_MIN_S * 1000)},
+        )
+        # 'segmentos' es perezoso: la inferencia ocurre al recorrerlo
+        texto = "".join(s.text for s in segmentos).strip()
+        if STT_VAD and info.duration:
+            print(f"   🎙️ [STT] VAD: {info.duration_after_vad:.1f}s de voz en {info.duration:.1f}s de audio")
+        return texto
+
+    def transcribir_lote(self, audios: list[bytes | str]) -> list[str]:
+        """
+        Un solo encode + generate de CTranslate2 para todos los clips de hasta 30 s
+        (mel rellenado a 3000 tramas, como hace Whisper con cada ventana).
+        """
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.tokenizer import Tokenizer
+
+        senales = [cargar_audio(a) for a in audios]
+        if STT_VAD:
+            senales = [recortar_silencio(s) for s in senales]
+        textos = [""] * len(audios)
+        cortos = [i for i, s in enumerate(senales) if len(s) <= _MAX_MUESTRAS_LOTE]
+        for i in range(len(audios)):
+            if i not in cortos:
+                textos[i] = self.transcribir(audios[i])
+        if not cortos:
+            return textos
+
+        tokenizer = Tokenizer(
+            self.modelo.hf_tokenizer, self.modelo.model.is_multilingual, task="transcribe", language="es"
+        )
+        prompt = self.modelo.get_prompt(tokenizer, previous_tokens=[], without_timestamps=True)
+        features = np.stack([pad_or_trim(self.modelo.feature_extractor(senales[i])) for i in cortos])
+        resultados = self.modelo.model.generate(
+            self.modelo.encode(features),
+            [list(prompt) for _ in cortos],
+            beam_size=STT_BEAM,
+            max_length=self.modelo.max_length,
+            suppress_blank=True,
+            suppress_tokens=[-1],
+        )
+        for i, resultado in zip(cortos, resultados):
+            textos[i] = tokenizer.decode(resultado.sequences_ids[0]).strip()
+        return textos
+
+
+class STTTransformers:
+    nombre = "transformers"
+
+    def __init__(self, modelo: str = STT_MODELO):
+        import torch
+        from transformers import pipeline
+
+        print(f"Cargando openai/whisper-{modelo} (transformers)...")
+        self.pipeline = pipeline(
+            "automatic-speech-recognition",
+            model=f"openai/whisper-{modelo}",
+            device=0 if torch.cuda.is_available() else -1,
+            generate_kwargs={"language": "spanish", "task": "transcribe"},
+            chunk_length_s=30,
+            stride_length_s=5,
+        )
+        # El pipeline no garantiza ser thread-safe: una transcripción a la vez
+        self._cerrojo = threading.Lock()
+
+    def transcribir(self, audio: bytes | str) -> str:
+        audio = cargar_audio(audio)
+        if STT_VAD:
+            recortado = recortar_silencio(audio)
+            print(f"   🎙️ [STT] VAD: {len(recortado) / SAMPLE_RATE_STT:.1f}s de voz "
+                  f"en {len(audio) / SAMPLE_RATE_STT:.1f}s de audio")
+            audio = recortado
+        with self._cerrojo:
+            resultado = self.pipeline({"raw": audio, "sampling_rate": SAMPLE_RATE_STT})
+        return resultado["text"].strip()
+
+    def transcribir_lote(self, audios: list[bytes | str]) -> list[str]:
+        """El pipeline rellena y agrupa las entradas él mismo con batch_size."""
+        entradas = []
+        for audio in audios:
+            senal = cargar_audio(audio)
+            if STT_VAD:
+                senal = recortar_silencio(senal)
+            entradas.append({"raw": senal, "sampling_rate": SAMPLE_RATE_STT})
+        with self._cerrojo:
+            resultados = self.pipeline(entradas, batch_size=len(entradas))
+        return [r["text"].strip() for r in resultados]
+
+
+BACKENDS_STT = {STTFasterWhisper.nombre: STTFasterWhisper, STTTransformers.nombre: STTTransformers}
+
+
+def crear_backend_stt(nombre: str = STT_BACKEND):
+    """Instancia el backend pedido; si faster-whisper no está instalado, usa transformers."""
+    if nombre not in BACKENDS_STT:
+        raise ValueError(f"STT_BACKEND desconocido: '{nombre}' (opciones: {', '.join(BACKENDS_STT)})")
+    if nombre == STTFasterWhisper.nombre:
+        try:
+            return STTFasterWhisper()
+        except ImportError:
+            print("⚠️ [STT] faster-whisper no está instalado → backend transformers")
+            return STTTransformers()
+    return BACKENDS_STT[nombre]()
@@ -0,0 +1,113 @@
+"""
+CacheAudio.py — IES Jándula
+Caché en disco del audio sintetizado por Kokoro.
+
+Las respuestas frecuentes ("¿a qué hora abre secretaría?") se volvían a
+sintetizar en cada petición de voz. Ahora cada audio se guarda en
+TTS_CACHE_DIR con clave sha256(texto, voz, velocidad, formato):
+
+- Tope de tamaño TTS_CACHE_MB (0 desactiva la caché); al superarlo se
+  expulsan los ficheros usados hace más tiempo (LRU por mtime: cada acierto
+  actualiza el mtime del fichero).
+- Escritura atómica (fichero temporal + os.replace): un lector nunca ve un
+  audio a medias y varios workers pueden escribir a la vez.
+- Al estar en disco sobrevive a reinicios y despliegues del contenedor.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+_RAIZ = Path(__file__).resolve().parents[3]
+_DIR_DEFECTO = _RAIZ / "data" / "cache_tts"
+# Tras expulsar se baja hasta este porcentaje del tope para no expulsar en cada escritura
+_OBJETIVO_TRAS_EXPULSAR = 0.9
+
+
+class CacheAudio:
+    def __init__(self):
+        self._dir = Path(os.getenv("TTS_CACHE_DIR", _DIR_DEFECTO))
+        self._max_bytes = int(float(os.getenv("TTS_CACHE_MB", "200")) * 1024 * 1024)
+        self._cerrojo = threading.Lock()
+        self._bytes: int | None = None  # se calcula al primer uso
+        self._aciertos = self._fallos = self._expulsados = 0
+
+    @property
+    def activa(self) -> bool:
+        return self._max_bytes > 0
+
+    @staticmethod
+    def clave(texto: str, voz: str, velocidad: float, formato: str) -> str:
+        return hashlib.sha256(f"{voz}|{velocidad}|{formato}|{texto.strip()}".encode()).hexdigest()
+
+    def _ruta(self, clave: str) -> Path:
+        return self._dir / clave[:2] / clave
+
+    def _ficheros(self) -> list[tuple[os.stat_result, Path]]:
+        return [(r.stat(), r) for r in self._dir.glob("*/*") if r.is_file() and not r.name.endswith(".tmp")]
+
+    def _tamano(self) -> int:
+        if self._bytes is None:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            self._bytes = sum(st.st_size for st, _ in self._ficheros())
+        return self._bytes
+
+    def obtener(self, clave: str) -> bytes | None:
+        """Audio guardado o None. Síncrono: llamarlo fuera del event loop."""
+        if not self.activa:
+            return None
+        ruta = self._ruta(clave)
+        try:
+            datos = ruta.read_bytes()
+            os.utime(ruta)  # marca de uso para el LRU
+        except FileNotFoundError:
+            self._fallos += 1
+            return None
+        self._aciertos += 1
+        return datos
+
+    def guardar(self, clave: str, datos: bytes) -> None:
+        if not self.activa or len(datos) > self._max_bytes:
+            return
+        ruta = self._ruta(clave)
+        with self._cerrojo:
+            self._tamano()
+            ruta.parent.mkdir(exist_ok=True)
+            previo = ruta.stat().st_size if ruta.exists() else 0
+            temporal = ruta.with_name(f"{ruta.name}.{threading.get_ident()}.tmp")
+            temporal.write_bytes(datos)
+            os.replace(temporal, ruta)
+            self._bytes += len(datos) - previo
+            if self._bytes > self._max_bytes:
+                self._expulsar()
+
+    def _expulsar(self) -> None:
+        objetivo = self._max_bytes * _OBJETIVO_TRAS_EXPULSAR
+        for st, ruta in sorted(self._ficheros(), key=lambda f: f[0].st_mtime):
+            if self._bytes <= objetivo:
+                break
+            try:
+                ruta.unlink()
+            except FileNotFoundError:
+                continue
+            self._bytes -= st.st_size
+            self._expulsados += 1
+        print(f"🧹 [CACHE TTS] Expulsión LRU → {self._bytes / 1024 / 1024:.1f} MB")
+
+    def stats(self) -> dict:
+        consultas = self._aciertos + self._fallos
+        return {
+            "activa": self.activa,
+            "max_mb": round(self._max_bytes / 1024 / 1024, 1),
+            "mb": round((self._bytes or 0) / 1024 / 1024, 1),
+            "aciertos": self._aciertos,
+            "fallos": self._fallos,
+            "tasa_acierto": round(self._aciertos / consultas, 3) if consultas else 0,
+            "expulsados": self._expulsados,
+        }
+
+
+cache_audio = CacheAudio()
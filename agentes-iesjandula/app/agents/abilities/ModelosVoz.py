@@ -0,0 +1,109 @@
+"""
+ModelosVoz.py — IES Jándula
+Registro único (por proceso) de los modelos de voz.
+
+Antes cada MotorVoz cargaba su propio Whisper y su propio Kokoro, así que la
+memoria se multiplicaba por cada agente perfil×modo (y por cada worker de
+PoolVoz). Aquí cada modelo se carga UNA vez y todos los MotorVoz lo comparten:
+
+- Kokoro (onnxruntime): InferenceSession es thread-safe, se usa sin cerrojo.
+- STT: el backend elegido en BackendsSTT (STT_BACKEND); cada backend se
+  encarga de ser seguro entre hilos.
+
+La carga es perezosa, o anticipada con precargar() (WARMUP_VOZ=true), y se
+mide la memoria residente (RSS) que añade cada modelo.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from pathlib import Path
+
+_BASE_DIR = Path(__file__).parent
+MODEL_PATH = _BASE_DIR / "kokoro-v1.0.onnx"
+VOICES_PATH = _BASE_DIR / "voices-v1.0.bin"
+
+
+def rss_mb() -> float:
+    """Memoria residente del proceso en MB (/proc en Linux; pico de getrusage si no)."""
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RegistroModelosVoz:
+    def __init__(self):
+        self._modelos: dict[str, object] = {}
+        self._info: dict[str, dict] = {}
+        # Una carga a la vez: evita cargas duplicadas y hace fiable el delta de RSS
+        self._cerrojo_carga = threading.Lock()
+
+    def _obtener(self, clave: str, cargar) -> object:
+        modelo = self._modelos.get(clave)
+        if modelo is not None:
+            return modelo
+        with self._cerrojo_carga:
+            modelo = self._modelos.get(clave)
+            if modelo is None:
+                rss_antes, t0 = rss_mb(), time.perf_counter()
+                modelo = cargar()
+                self._info[clave] = {
+                    "rss_mb": round(rss_mb() - rss_antes, 1),
+                    "carga_ms": round((time.perf_counter() - t0) * 1000),
+                }
+                self._modelos[clave] = modelo
+                print(f"🧠 [VOZ] {clave} cargado: +{self._info[clave]['rss_mb']} MB RSS "
+                      f"en {self._info[clave]['carga_ms']} ms")
+        return modelo
+
+    def stt(self):
+        """Backend de transcripción compartido (ver BackendsSTT)."""
+        from .BackendsSTT import STT_BACKEND, STT_MODELO, crear_backend_stt
+        return self._obtener(f"stt:{STT_BACKEND}:{STT_MODELO}", crear_backend_stt)
+
+    def tts(self, voices_path: Path = VOICES_PATH):
+        """Kokoro compartido para el fichero de voces indicado."""
+        voices_path = Path(voices_path)
+        return self._obtener(f"tts:{voices_path.name}", lambda: _cargar_kokoro(voices_path))
+
+    def precargar(self) -> str:
+        self.stt()
+        self.tts()
+        return ", ".join(f"{clave} (+{info['rss_mb']} MB)" for clave, info in self._info.items())
+
+    def stats(self) -> dict:
+        return {
+            "rss_proceso_mb": round(rss_mb(), 1),
+            "modelos": dict(self._info),
+        }
+
+
+def _cargar_kokoro(voices_path: Path):
+    if not MODEL_PATH.exists():
+        raise FileNotFoundError(
+            f"Falta el modelo Kokoro.\n"
+            f"Descarga 'kokoro-v1.0.onnx' desde:\n"
+            f"  https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/kokoro-v1.0.onnx\n"
+            f"y colócalo en: '{_BASE_DIR}'"
+        )
+    if not voices_path.exists():
+        raise FileNotFoundError(
+            f"Falta el archivo de voz '{voices_path.name}'.\n"
+            f"Descárgalo desde:\n"
+            f"  https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/voices-v1.0.bin\n"
+            f"y colócalo en: '{_BASE_DIR}'"
+        )
+
+    print("Cargando Kokoro ONNX...")
+    from kokoro_onnx import Kokoro
+    return Kokoro(str(MODEL_PATH), str(voices_path))
+
+
+modelos_voz = RegistroModelosVoz()
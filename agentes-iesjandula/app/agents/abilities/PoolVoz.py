@@ -0,0 +1,321 @@
+"""
+PoolVoz.py — IES Jándula
+Ejecución de STT (Whisper) y TTS (Kokoro) fuera del event loop.
+
+MotorVoz.escuchar / hablar son síncronos y tardan segundos: llamados desde
+un endpoint async bloqueaban el event loop y congelaban todos los chats de
+texto concurrentes. Ahora toda la inferencia de voz pasa por un pool de
+hilos acotado:
+
+- VOZ_WORKERS hilos dedicados (no el executor por defecto de asyncio) que
+  comparten los modelos del registro ModelosVoz (cargados una vez por proceso).
+- Cola con contrapresión: con más de VOZ_COLA_MAX peticiones esperando se
+  rechaza con VozSaturadaError (la API responde 503 + Retry-After).
+- Timeout por petición (VOZ_TIMEOUT_STT_S / VOZ_TIMEOUT_TTS_S); una petición
+  que vence mientras espera en cola no llega a ejecutarse.
+- VOZ_HILOS_INTRAOP limita los hilos de torch para que la inferencia no se
+  coma todos los núcleos que necesita el event loop.
+- Métricas de espera en cola vs. inferencia por tipo (stt / tts).
+- El audio sintetizado se busca antes en CacheAudio: un acierto no pasa por
+  la cola ni por Kokoro.
+- Micro-batching de STT: las transcripciones que llegan juntas (cambio de
+  clase) se agrupan durante STT_LOTE_ESPERA_MS, hasta STT_LOTE_MAX, y pasan
+  por Whisper en una sola inferencia. Mientras los workers están ocupados el
+  lote sigue creciendo en vez de encolar transcripciones sueltas. Cada
+  transcripción ocupa su propio hueco de la cola (se rechaza al llegar, no
+  al despachar el lote) y conserva su propio timeout; el del lote crece con
+  su tamaño para que un lote grande no agote el de todos sus miembros.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable
+
+from .CacheAudio import cache_audio
+from .ModelosVoz import modelos_voz
+
+_TIPOS = ("stt", "tts")
+
+
+class VozSaturadaError(RuntimeError):
+    """La cola de voz está llena: el cliente debe reintentar más tarde."""
+
+    def __init__(self, tipo: str, reintentar_s: int):
+        super().__init__(f"Cola de voz ({tipo}) llena")
+        self.tipo = tipo
+        self.reintentar_s = reintentar_s
+
+
+def _iniciar_worker(hilos_intraop: int) -> None:
+    if hilos_intraop > 0:
+        import torch
+        torch.set_num_threads(hilos_intraop)
+
+
+class PoolVoz:
+    def __init__(self):
+        self._workers = max(1, int(os.getenv("VOZ_WORKERS", "1")))
+        self._cola_max = int(os.getenv("VOZ_COLA_MAX", "8"))
+        self._timeouts = {
+            "stt": float(os.getenv("VOZ_TIMEOUT_STT_S", "60")),
+            "tts": float(os.getenv("VOZ_TIMEOUT_TTS_S", "30")),
+        }
+        self._hilos_intraop = int(os.getenv("VOZ_HILOS_INTRAOP", max(1, (os.cpu_count() or 2) // 2)))
+        self._lote_max = int(os.getenv("STT_LOTE_MAX", "8"))  # 1 desactiva el micro-batching
+        self._lote_espera_s = float(os.getenv("STT_LOTE_ESPERA_MS", "30")) / 1000
+        self._ejecutor: ThreadPoolExecutor | None = None
+        self._motor = None
+        self._pendientes = 0  # en cola + en ejecución
+        # Micro-batching de STT: (audio, futuro) acumulados y lotes en ejecución
+        self._lote: list[tuple[bytes, asyncio.Future]] = []
+        self._temporizador_lote: asyncio.TimerHandle | None = None
+        self._lotes_en_curso = 0
+        self._tareas_lote: set[asyncio.Task] = set()
+        self._lotes = self._peticiones_en_lotes = 0
+        self._metricas = {
+            tipo: {
+                "completadas": 0, "errores": 0, "rechazadas": 0, "timeouts": 0,
+                "espera_total_ms": 0.0, "espera_max_ms": 0.0,
+                "inferencia_total_ms": 0.0, "inferencia_max_ms": 0.0,
+            }
+            for tipo in _TIPOS
+        }
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._ejecutor is None:
+            self._ejecutor = ThreadPoolExecutor(
+                max_workers=self._workers,
+                thread_name_prefix="voz",
+                initializer=_iniciar_worker,
+                initargs=(self._hilos_intraop,),
+            )
+        return self._ejecutor
+
+    def _motor_voz(self):
+        if self._motor is None:
+            from .Audio import MotorVoz
+            self._motor = MotorVoz()
+        return self._motor
+
+    def _reservar(self, tipo: str) -> None:
+        """Ocupa un hueco de la cola o rechaza con VozSaturadaError si está llena."""
+        if self._pendientes >= self._workers + self._cola_max:
+            self._metricas[tipo]["rechazadas"] += 1
+            print(f"🚦 [VOZ] Cola llena ({self._pendientes} pendientes) → {tipo} rechazado")
+            raise VozSaturadaError(tipo, reintentar_s=max(1, round(self._timeouts[tipo] / 4)))
+        self._pendientes += 1
+
+    async def _ejecutar(self, tipo: str, funcion: Callable, *args, reservadas: int = 0,
+                        timeout: float | None = None):
+        """
+        Ejecuta funcion(motor, *args) en un worker de voz con contrapresión y timeout.
+        'reservadas' son los huecos ya ocupados por las peticiones de un lote
+        (0 = petición suelta, se reserva aquí).
+        """
+        m = self._metricas[tipo]
+        if not reservadas:
+            self._reservar(tipo)
+        n = reservadas or 1
+        timeout = timeout or self._timeouts[tipo]
+
+        loop = asyncio.get_running_loop()
+        encolada = time.perf_counter()
+        tiempos: dict[str, float] = {}
+
+        def _trabajo():
+            tiempos["inicio"] = time.perf_counter()
+            try:
+                return funcion(self._motor_voz(), *args)
+            finally:
+                tiempos["fin"] = time.perf_counter()
+
+        def _terminado(_):
+            # El hueco se libera cuando el hilo acaba de verdad, no cuando vence el timeout
+            loop.call_soon_threadsafe(self._liberar, tipo, encolada, tiempos, n)
+
+        try:
+            futuro = self._pool().submit(_trabajo)
+        except BaseException:
+            self._pendientes = max(0, self._pendientes - n)
+            raise
+        futuro.add_done_callback(_terminado)
+        try:
+            # Si vence en cola, cancelar el futuro asyncio cancela también el del pool
+            return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout=timeout)
+        except asyncio.TimeoutError:
+            m["timeouts"] += 1
+            print(f"⏱️ [VOZ] {tipo} superó {timeout:.0f}s")
+            raise
+        except Exception:
+            m["errores"] += 1
+            raise
+
+    def _liberar(self, tipo: str, encolada: float, tiempos: dict[str, float], n: int = 1) -> None:
+        self._pendientes = max(0, self._pendientes - n)
+        if "inicio" not in tiempos:
+            return  # cancelada antes de salir de la cola
+        m = self._metricas[tipo]
+        espera_ms = (tiempos["inicio"] - encolada) * 1000
+        inferencia_ms = (tiempos["fin"] - tiempos["inicio"]) * 1000
+        # Un lote cuenta como n peticiones que comparten espera e inferencia
+        m["completadas"] += n
+        m["espera_total_ms"] += espera_ms * n
+        m["espera_max_ms"] = max(m["espera_max_ms"], espera_ms)
+        m["inferencia_total_ms"] += inferencia_ms * n
+        m["inferencia_max_ms"] = max(m["inferencia_max_ms"], inferencia_ms)
+
+    # ── API pública ───────────────────────────────────────────────────────────
+
+    async def transcribir(self, audio: bytes | str) -> str:
+        if self._lote_max <= 1:
+            return await self._ejecutar("stt", lambda motor, a: motor.escuchar(a), audio)
+        self._reservar("stt")  # cada transcripción ocupa su hueco aunque vaya en lote
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._lote.append((audio, futuro))
+        if len(self._lote) >= self._lote_max:
+            self._despachar_lote()
+        elif self._temporizador_lote is None:
+            self._temporizador_lote = loop.call_later(self._lote_espera_s, self._despachar_lote)
+        try:
+            # Timeout propio (cuenta también la espera del lote); al vencer se cancela
+            # el futuro y, si el lote aún no ha salido, se libera su hueco
+            return await asyncio.wait_for(futuro, timeout=self._timeouts["stt"])
+        except asyncio.TimeoutError:
+            if futuro.cancelled():  # vencido aquí (no propagado desde el lote, ya contado)
+                self._metricas["stt"]["timeouts"] += 1
+                print(f"⏱️ [VOZ] stt superó {self._timeouts['stt']:.0f}s (en lote)")
+            raise
+
+    def _despachar_lote(self) -> None:
+        if self._temporizador_lote is not None:
+            self._temporizador_lote.cancel()
+            self._temporizador_lote = None
+        vivos = [(a, f) for a, f in self._lote if not f.done()]  # fuera los cancelados
+        self._pendientes = max(0, self._pendientes - (len(self._lote) - len(vivos)))
+        self._lote = vivos
+        if not self._lote:
+            return
+        if self._lotes_en_curso >= self._workers and len(self._lote) < self._lote_max:
+            return  # workers ocupados: el lote crece y sale cuando acabe el que está en curso
+        lote, self._lote = self._lote[:self._lote_max], self._lote[self._lote_max:]
+        self._lotes_en_curso += 1
+        tarea = asyncio.create_task(self._transcribir_lote(lote))
+        self._tareas_lote.add(tarea)
+        tarea.add_done_callback(self._tareas_lote.discard)
+        if self._lote and self._temporizador_lote is None:
+            self._temporizador_lote = asyncio.get_running_loop().call_later(
+                self._lote_espera_s, self._despachar_lote
+            )
+
+    async def _transcribir_lote(self, lote: list[tuple[bytes, asyncio.Future]]) -> None:
+        audios = [audio for audio, _ in lote]
+        n = len(audios)
+        try:
+            if n == 1:
+                textos = [await self._ejecutar(
+                    "stt", lambda motor, a: motor.escuchar(a), audios[0], reservadas=1,
+                )]
+            else:
+                textos = await self._ejecutar(
+                    "stt", lambda motor, a: motor.escuchar_lote(a), audios,
+                    reservadas=n, timeout=self._timeouts["stt"] * n,
+                )
+            self._lotes += 1
+            self._peticiones_en_lotes += n
+            for (_, futuro), texto in zip(lote, textos):
+                if not futuro.done():
+                    futuro.set_result(texto)
+        except Exception as e:
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+        finally:
+            self._lotes_en_curso -= 1
+            if self._lote:
+                self._despachar_lote()
+
+    async def _con_cache(self, texto: str, formato: str, sintetizar: Callable) -> bytes:
+        """Audio de CacheAudio si existe; si no, 'sintetizar()' en el pool y se guarda."""
+        from .Audio import VELOCIDAD_VOZ, VOZ_DEFECTO
+
+        if not cache_audio.activa:
+            return await sintetizar()
+        clave = cache_audio.clave(texto, VOZ_DEFECTO, VELOCIDAD_VOZ, formato)
+        audio = await asyncio.to_thread(cache_audio.obtener, clave)
+        if audio is None:
+            audio = await sintetizar()
+            await asyncio.to_thread(cache_audio.guardar, clave, audio)
+        return audio
+
+    async def hablar(self, texto: str, formato: str = "wav") -> bytes:
+        return await self._con_cache(
+            texto, formato,
+            lambda: self._ejecutar("tts", lambda motor, t, f: motor.hablar(t, f), texto, formato),
+        )
+
+    async def hablar_stream(self, frases: AsyncIterator[str]) -> AsyncIterator[bytes]:
+        """
+        PCM16 (24 kHz, mono) de cada frase en cuanto un worker la sintetiza.
+        Precede la salida con cabecera_wav_stream() para servirlo como WAV.
+        """
+        from .Audio import PAUSA_ENTRE_FRASES_PCM, a_pcm16
+
+        async def _pcm(frase: str) -> bytes:
+            return a_pcm16(await self._ejecutar("tts", lambda motor, f: motor.sintetizar(f), frase))
+
+        primera = True
+        async for frase in frases:
+            # Caché por frase: las respuestas repetidas suenan sin pasar por Kokoro
+            pcm = await self._con_cache(frase, "pcm16", lambda: _pcm(frase))
+            if not primera:
+                yield PAUSA_ENTRE_FRASES_PCM
+            primera = False
+            yield pcm
+
+    async def precargar(self) -> str:
+        """Carga Whisper y Kokoro en el registro compartido (una vez por proceso)."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), modelos_voz.precargar)
+
+    def stats(self) -> dict:
+        por_tipo = {}
+        for tipo, m in self._metricas.items():
+            n = m["completadas"]
+            por_tipo[tipo] = {
+                "completadas": n,
+                "errores": m["errores"],
+                "rechazadas": m["rechazadas"],
+                "timeouts": m["timeouts"],
+                "timeout_s": self._timeouts[tipo],
+                "espera_media_ms": round(m["espera_total_ms"] / n, 1) if n else 0,
+                "espera_max_ms": round(m["espera_max_ms"], 1),
+                "inferencia_media_ms": round(m["inferencia_total_ms"] / n, 1) if n else 0,
+                "inferencia_max_ms": round(m["inferencia_max_ms"], 1),
+            }
+        return {
+            "workers": self._workers,
+            "cola_max": self._cola_max,
+            "hilos_intraop": self._hilos_intraop,
+            "pendientes": self._pendientes,
+            **por_tipo,
+            "stt_lotes": {
+                "lote_max": self._lote_max,
+                "espera_ms": round(self._lote_espera_s * 1000),
+                "lotes": self._lotes,
+                "tamano_medio": round(self._peticiones_en_lotes / self._lotes, 2) if self._lotes else 0,
+            },
+            "modelos": modelos_voz.stats(),
+            "cache_tts": cache_audio.stats(),
+        }
+
+    def cerrar(self) -> None:
+        if self._ejecutor is not None:
+            self._ejecutor.shutdown(wait=False, cancel_futures=True)
+            self._ejecutor = None
+
+
+pool_voz = PoolVoz()
@@ -1,16 +1,42 @@
 import asyncio
+import os
 from app.api.services.AdminService import admin_service
 from app.api.services.CacheService import cache_service
+from app.api.services.CheckpointService import checkpoint_service
+from app.api.services.StreamService import stream_service
+from app.agents.PlanificadorLLM import planificador_llm
+from app.agents.RouterLLM import stats_router
+from app.agents.ConstructorContexto import stats_contexto
+from app.agents.CacheTools import invalidar_tools_rag, stats_cache_tools
+from app.agents.LatenciaTools import stats_latencia_tools
+from app.agents.abilities.PoolVoz import pool_voz
+from app.tools.pool_navegador import pool_navegador
+from app.tools.extraccion_web import extractor_web
 
 
 class AdminController:
 
     @staticmethod
-    def get_stats() -> dict:
+    async def get_stats() -> dict:
+        from app.agents.AgentConfig import stats_ruta_rapida
+        from app.agents.MemoriaResumen import stats_memoria
+        from data.data import stats_prefetch
         stats = admin_service.get_stats()
         cache = cache_service.stats()
         seed = admin_service.get_seed_status()
-        return {**stats, "cache": cache, "seed": seed}
+        return {
+            **stats, "cache": {**cache, "tools": stats_cache_tools()}, "seed": seed,
+            "llm": {**planificador_llm.stats(), "proveedores": stats_router()},
+            "contexto": stats_contexto(),
+            "latencia_tools": stats_latencia_tools(),
+            "sse": stream_service.stats(),
+            "voz": pool_voz.stats(),
+            "navegador": pool_navegador.stats(),
+            "extraccion_web": extractor_web.stats(),
+            "prefetch": stats_prefetch(),
+            "ruta_rapida": stats_ruta_rapida(),
+            "memoria": {**stats_memoria(), "checkpoints": await checkpoint_service.stats()},
+        }
 
     @staticmethod
     def get_queries(limite: int = 50, solo_sin_resultado: bool = False) -> dict:
@@ -30,5 +56,23 @@ class AdminController:
     async def run_seed() -> dict:
         """Lanza el seed de legislación en background desde dentro del proceso de la app."""
         from data.data import seed_legislacion_folder
-        asyncio.create_task(asyncio.to_thread(seed_legislacion_folder))
+
+        async def _seed():
+            await asyncio.to_thread(seed_legislacion_folder)
+            invalidar_tools_rag("legislacion")
+        asyncio.create_task(_seed())
         return {"status": "started", "mensaje": "Seed de legislación iniciado en segundo plano."}
+
+    @staticmethod
+    async def mantenimiento_checkpoints() -> dict:
+        """Retención, caducidad y compactación de checkpoints.db bajo demanda."""
+        return await checkpoint_service.mantenimiento()
+
+    @staticmethod
+    async def generar_imagen_grafo(perfil: str = "profesores", es_voz: bool = False) -> dict:
+        """Renderiza el grafo LangGraph a PNG (antes se hacía en cada compilación)."""
+        from app.agents.AgentConfig import guardar_imagen_grafo
+        ruta = await guardar_imagen_grafo(perfil, es_voz=es_voz)
+        if not os.path.exists(ruta):
+            return {"status": "error", "mensaje": "No se pudo generar la imagen (ver logs)."}
+        return {"status": "ok", "ruta": ruta}
@@ -1,12 +1,36 @@
 from typing import AsyncGenerator
 from fastapi import HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, StreamingResponse
 import traceback
-import os
+from contextlib import aclosing
+from urllib.parse import quote
 from app.api.services import agents_service
+from app.agents.abilities.Audio import FORMATOS_AUDIO
+from app.agents.abilities.PoolVoz import VozSaturadaError
+from app.api.services.StreamService import stream_service
 from app.api.models import ConsultaResponse
 
 
+def _error_voz(e: Exception) -> HTTPException:
+    """503 con Retry-After si la cola de voz está llena, 504 si la inferencia venció su timeout."""
+    if isinstance(e, VozSaturadaError):
+        return HTTPException(
+            status_code=503,
+            detail="El servicio de voz está ocupado. Inténtalo de nuevo en unos segundos.",
+            headers={"Retry-After": str(e.reintentar_s)},
+        )
+    if isinstance(e, TimeoutError):
+        return HTTPException(
+            status_code=504,
+            detail="El procesamiento de la voz ha tardado demasiado. Inténtalo con un audio más corto.",
+        )
+    traceback.print_exc()
+    return HTTPException(
+        status_code=500,
+        detail="Lo siento, ha ocurrido un error al procesar la voz. Por favor, inténtalo de nuevo más tarde."
+    )
+
+
 class AgenteController:
 
     @staticmethod
@@ -35,35 +59,82 @@ class AgenteController:
         thread_id: str | None = None,
     ) -> AsyncGenerator[dict, None]:
         try:
-            async for evento in agents_service.stream_chat(pregunta, perfil=perfil, thread_id=thread_id):
-                yield evento
+            async with aclosing(agents_service.stream_chat(
+                pregunta, perfil=perfil, thread_id=thread_id,
+            )) as eventos:
+                async for evento in eventos:
+                    yield evento
         except Exception as e:
             traceback.print_exc()
             yield {"tipo": "error", "mensaje": "Error al generar la respuesta. Inténtalo de nuevo."}
 
     @staticmethod
-    async def handle_speak(audio_file: UploadFile, perfil: str = "profesores"):
-        try:
-            ruta_salida, ruta_entrada = await agents_service.procesar_voz(audio_file, perfil=perfil)
-            response = FileResponse(
-                path=ruta_salida,
-                media_type="audio/wav",
-                filename="respuesta_jandula.wav"
+    def abrir_stream(
+        pregunta: str,
+        perfil: str = "profesores",
+        thread_id: str | None = None,
+        ultimo_id: str | None = None,
+    ) -> tuple[str, int]:
+        """
+        (run_id, seq desde el que emitir). Reanuda si 'ultimo_id' (Last-Event-ID)
+        o un reintento idéntico apuntan a una ejecución viva; si no, lanza una nueva.
+        """
+        clave = f"{perfil}|{thread_id}|{pregunta}" if thread_id else None
+        reanudacion = stream_service.buscar(ultimo_id, clave)
+        if reanudacion is not None:
+            print(f"🔁 [STREAM] Reanudando {reanudacion[0]} desde el evento {reanudacion[1]}")
+            return reanudacion
+        if ultimo_id:
+            raise HTTPException(
+                status_code=410,
+                detail="La respuesta anterior ya no está disponible. Vuelve a enviar la pregunta."
             )
-            if os.path.exists(ruta_entrada):
-                os.remove(ruta_entrada)
-            return response
-        except Exception as e:
-            traceback.print_exc()
+        run_id = stream_service.lanzar(
+            AgenteController.handle_chat_stream(pregunta, perfil=perfil, thread_id=thread_id),
+            clave=clave,
+        )
+        return run_id, 0
+
+    @staticmethod
+    async def handle_speak(audio_file: UploadFile, perfil: str = "profesores", formato: str = "wav") -> Response:
+        if formato not in FORMATOS_AUDIO:
             raise HTTPException(
-                status_code=500,
-                detail="Lo siento, ha ocurrido un error al procesar la voz. Por favor, inténtalo de nuevo más tarde."
+                status_code=400,
+                detail=f"Formato de audio no soportado. Opciones: {', '.join(FORMATOS_AUDIO)}."
             )
+        try:
+            audio = await agents_service.procesar_voz(audio_file, perfil=perfil, formato=formato)
+            return Response(
+                content=audio,
+                media_type=FORMATOS_AUDIO[formato][-1],
+                headers={"Content-Disposition": f'attachment; filename="respuesta_jandula.{formato}"'},
+            )
+        except Exception as e:
+            raise _error_voz(e)
+
+    @staticmethod
+    async def handle_speak_stream(audio_file: UploadFile, perfil: str = "profesores") -> StreamingResponse:
+        try:
+            transcripcion, audio = await agents_service.procesar_voz_stream(audio_file, perfil=perfil)
+        except Exception as e:
+            raise _error_voz(e)
+        return StreamingResponse(
+            audio,
+            media_type="audio/wav",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+                # Las cabeceras HTTP son latin-1: la transcripción va codificada como URL
+                "X-Transcripcion": quote(transcripcion),
+            },
+        )
 
     @staticmethod
     async def handle_transcribe(audio_file: UploadFile, perfil: str = "profesores"):
         try:
             return await agents_service.procesar_hibrido(audio_file, perfil=perfil)
+        except (VozSaturadaError, TimeoutError) as e:
+            raise _error_voz(e)
         except Exception as e:
             traceback.print_exc()
             raise HTTPException(
@@ -6,7 +6,7 @@ router = APIRouter(prefix="/admin", tags=["Admin"])
 
 @router.get("/stats")
 async def obtener_estadisticas():
-    return AdminController.get_stats()
+    return await AdminController.get_stats()
 
 
 @router.get("/queries")
@@ -29,3 +29,15 @@ async def seed_status():
 async def seed_run():
     """Lanza el seed de legislación en segundo plano."""
     return await AdminController.run_seed()
+
+
+@router.post("/grafo/imagen")
+async def generar_imagen_grafo(perfil: str = "profesores", es_voz: bool = False):
+    """Genera grafo_ies_jandula.png con el grafo del perfil indicado."""
+    return await AdminController.generar_imagen_grafo(perfil=perfil, es_voz=es_voz)
+
+
+@router.post("/checkpoints/mantenimiento")
+async def mantenimiento_checkpoints():
+    """Poda los checkpoints antiguos, borra hilos caducados y compacta checkpoints.db."""
+    return await AdminController.mantenimiento_checkpoints()
@@ -1,8 +1,9 @@
-import json
-from fastapi import APIRouter, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Request, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
 from app.api.controllers import AgenteController
 from app.api.models import ConsultaRequest, ConsultaResponse
+from app.api.services.StreamService import stream_service
+from app.api.services.WarmupService import warmup_service
 
 router = APIRouter(tags=["Agente"])
 
@@ -17,29 +18,40 @@ async def consultar_agente(consulta: ConsultaRequest):
 
 
 @router.post("/chat/stream")
-async def stream_agente(consulta: ConsultaRequest):
-    """Endpoint SSE: devuelve la respuesta token a token."""
-    async def generator():
-        async for evento in AgenteController.handle_chat_stream(
-            consulta.pregunta,
-            perfil=consulta.perfil,
-            thread_id=consulta.thread_id,
-        ):
-            yield f"data: {json.dumps(evento, ensure_ascii=False)}\n\n"
-
+async def stream_agente(consulta: ConsultaRequest, request: Request):
+    """
+    Endpoint SSE: devuelve la respuesta en frames de tokens agrupados.
+    Con la cabecera Last-Event-ID se reanuda una respuesta en curso o recién terminada.
+    """
+    run_id, desde = AgenteController.abrir_stream(
+        consulta.pregunta,
+        perfil=consulta.perfil,
+        thread_id=consulta.thread_id,
+        ultimo_id=request.headers.get("last-event-id"),
+    )
     return StreamingResponse(
-        generator(),
+        stream_service.emitir(run_id, desde, desconectado=request.is_disconnected),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "X-Accel-Buffering": "no",  # Evita buffering en Nginx/Traefik
+            "X-Run-Id": run_id,
         },
     )
 
 
 @router.post("/speak")
-async def consultar_agente_voz(audio_file: UploadFile = File(...), perfil: str = "profesores"):
-    return await AgenteController.handle_speak(audio_file, perfil=perfil)
+async def consultar_agente_voz(
+    audio_file: UploadFile = File(...), perfil: str = "profesores", formato: str = "wav",
+):
+    """Respuesta hablada completa. formato: wav (por defecto), opus (audio/ogg) o mp3."""
+    return await AgenteController.handle_speak(audio_file, perfil=perfil, formato=formato)
+
+
+@router.post("/speak/stream")
+async def consultar_agente_voz_stream(audio_file: UploadFile = File(...), perfil: str = "profesores"):
+    """Como /speak, pero devuelve un WAV en streaming que empieza a sonar tras la primera frase."""
+    return await AgenteController.handle_speak_stream(audio_file, perfil=perfil)
 
 
 @router.post("/transcribe")
@@ -50,3 +62,10 @@ async def consultar_agente_hibrido(audio_file: UploadFile = File(...), perfil: s
 @router.get("/health")
 async def health_check():
     return {"status": "ok", "servicio": "Agente IES Jándula"}
+
+
+@router.get("/ready")
+async def readiness_check():
+    """Readiness: 200 cuando el pre-calentamiento terminó bien, 503 mientras tanto."""
+    estado = warmup_service.estado()
+    return JSONResponse(status_code=200 if estado["listo"] else 503, content=estado)
@@ -22,6 +22,7 @@ def _cargar_stats() -> dict:
     return {
         "total": {"profesores": 0, "alumnos": 0},
         "sin_resultado": {"profesores": 0, "alumnos": 0},
+        "canceladas": {"profesores": 0, "alumnos": 0},
         "queries": [],
     }
 
@@ -35,6 +36,7 @@ def _guardar_stats(stats: dict) -> None:
 class AdminService:
     def __init__(self):
         self._stats = _cargar_stats()
+        self._stats.setdefault("canceladas", {"profesores": 0, "alumnos": 0})
 
     def registrar_consulta(
         self,
@@ -70,6 +72,14 @@ class AdminService:
 
         _guardar_stats(self._stats)
 
+    def registrar_cancelada(self, perfil: str, tiempo_ms: int, tokens_generados: int) -> None:
+        """Turno de streaming abandonado por el cliente (no cuenta como consulta)."""
+        perfil_key = perfil if perfil in ("profesores", "alumnos") else "alumnos"
+        self._stats["canceladas"][perfil_key] = self._stats["canceladas"].get(perfil_key, 0) + 1
+        print(f"🛑 [STREAM] Turno cancelado por desconexión ({perfil_key}) tras "
+              f"{tiempo_ms} ms y {tokens_generados} tokens generados")
+        _guardar_stats(self._stats)
+
     def get_stats(self) -> dict:
         total_general = sum(self._stats["total"].values())
         sin_resultado_total = sum(self._stats["sin_resultado"].values())
@@ -78,6 +88,8 @@ class AdminService:
             "total_general": total_general,
             "sin_resultado": self._stats["sin_resultado"],
             "sin_resultado_total": sin_resultado_total,
+            "canceladas": self._stats["canceladas"],
+            "canceladas_total": sum(self._stats["canceladas"].values()),
             "tasa_sin_resultado": (
                 round(sin_resultado_total / total_general * 100, 1)
                 if total_general > 0 else 0
@@ -1,8 +1,6 @@
 import asyncio
-import os
-import shutil
-import tempfile
 import time
+from contextlib import aclosing
 from typing import AsyncGenerator
 
 from fastapi import UploadFile
@@ -11,25 +9,50 @@ from app.api.services.CacheService import cache_service
 from app.api.services.AdminService import admin_service
 
 
+PERFILES = ("profesores", "alumnos")
+MODOS = ("texto", "voz", "hibrido")
+
+
 class AgentsService:
     def __init__(self):
         self._agentes = {}
+        self._locks: dict[str, asyncio.Lock] = {}
 
     async def _get_or_create_agente(self, perfil: str, modo: str) -> AgenteJandula:
         clave = f"{perfil}_{modo}"
-        if clave not in self._agentes:
-            print(f"🚀 Inicializando agente: {perfil} en modo {modo}...")
-            agente = AgenteJandula(perfil=perfil, modo=modo)
-            await agente.encender()
-            self._agentes[clave] = agente
-            print(f"✅ Agente {clave} listo.")
+        if clave in self._agentes:
+            return self._agentes[clave]
+        async with self._locks.setdefault(clave, asyncio.Lock()):
+            if clave not in self._agentes:
+                print(f"🚀 Inicializando agente: {perfil} en modo {modo}...")
+                agente = AgenteJandula(perfil=perfil, modo=modo)
+                await agente.encender()
+                self._agentes[clave] = agente
+                print(f"✅ Agente {clave} listo.")
         return self._agentes[clave]
 
+    async def precalentar_agentes(self) -> str:
+        """Construye en paralelo todas las variantes perfil × modo (grafos compartidos)."""
+        t0 = time.time()
+        resultados = await asyncio.gather(
+            *[self._get_or_create_agente(p, m) for p in PERFILES for m in MODOS],
+            return_exceptions=True,
+        )
+        errores = [r for r in resultados if isinstance(r, Exception)]
+        for e in errores:
+            print(f"⚠️ [AGENTES] Error precalentando un agente: {e}")
+        resumen = f"{len(resultados) - len(errores)}/{len(resultados)} agentes listos"
+        print(f"🔥 [AGENTES] {resumen} en {time.time() - t0:.1f}s")
+        if errores:
+            raise RuntimeError(f"{resumen}; primer error: {errores[0]}")
+        return resumen
+
     async def procesar_chat(
         self,
         pregunta: str,
         perfil: str = "profesores",
         thread_id: str | None = None,
+        prioridad_llm: str = "chat",
     ) -> dict:
         """
         Maneja consultas de texto. Devuelve dict con 'respuesta' y 'fuentes'.
@@ -50,7 +73,7 @@ class AgentsService:
         # --- Invocar agente ---
         t0 = time.time()
         agente = await self._get_or_create_agente(perfil, "texto")
-        resultado = await agente.responder(pregunta, thread_id=tid)
+        resultado = await agente.responder(pregunta, thread_id=tid, prioridad_llm=prioridad_llm)
         tiempo_ms = int((time.time() - t0) * 1000)
 
         # resultado puede ser dict (modo texto) o str (warmup legacy)
@@ -74,41 +97,73 @@ class AgentsService:
         perfil: str = "profesores",
         thread_id: str | None = None,
     ) -> AsyncGenerator[dict, None]:
-        """Generador async de eventos SSE para streaming de respuesta."""
+        """
+        Generador async de eventos SSE para streaming de respuesta.
+
+        Si se cancela o se cierra antes del evento 'fin' (cliente desconectado,
+        ver StreamService) el turno se registra como cancelado.
+        """
         tid = thread_id or "default"
         agente = await self._get_or_create_agente(perfil, "texto")
-        async for evento in agente.responder_stream(pregunta, thread_id=tid):
-            yield evento
-            if evento.get("tipo") == "fin":
-                admin_service.registrar_consulta(
-                    pregunta, perfil, evento.get("fuentes", []), desde_cache=False
-                )
-
-    async def procesar_voz(self, audio_file: UploadFile, perfil: str = "profesores"):
-        agente = await self._get_or_create_agente(perfil, "voz")
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            shutil.copyfileobj(audio_file.file, tmp)
-            ruta_entrada = tmp.name
+        t0 = time.time()
+        tokens, fin_recibido = 0, False
         try:
-            ruta_salida = await agente.responder(ruta_entrada)
-            if not os.path.exists(ruta_salida):
-                raise FileNotFoundError("No se generó el audio de salida.")
-            return ruta_salida, ruta_entrada
-        except Exception as e:
-            if os.path.exists(ruta_entrada):
-                os.remove(ruta_entrada)
-            raise e
+            async with aclosing(agente.responder_stream(pregunta, thread_id=tid)) as eventos:
+                async for evento in eventos:
+                    if evento.get("tipo") == "token":
+                        tokens += 1
+                    elif evento.get("tipo") == "fin":
+                        fin_recibido = True
+                        admin_service.registrar_consulta(
+                            pregunta, perfil, evento.get("fuentes", []), desde_cache=False
+                        )
+                    yield evento
+        except (asyncio.CancelledError, GeneratorExit):
+            if not fin_recibido:
+                admin_service.registrar_cancelada(perfil, int((time.time() - t0) * 1000), tokens)
+            raise
+
+    async def procesar_voz(
+        self, audio_file: UploadFile, perfil: str = "profesores", formato: str = "wav"
+    ) -> bytes:
+        """
+        Audio subido → respuesta hablada, en memoria (sin ficheros temporales).
+        Con la respuesta en caché no se invoca el LLM, y con su audio en caché tampoco Kokoro.
+        """
+        agente = await self._get_or_create_agente(perfil, "voz")
+        pregunta = await agente.transcribir(await audio_file.read())
+        # El grafo de voz responde distinto que el de texto: espacio de caché propio
+        perfil_cache = f"{perfil}_voz"
+
+        resultado = cache_service.get(pregunta, perfil_cache)
+        if resultado:
+            admin_service.registrar_consulta(
+                pregunta, perfil, resultado.get("fuentes", []), desde_cache=True
+            )
+        else:
+            t0 = time.time()
+            resultado = await agente.responder(pregunta)
+            cache_service.set(pregunta, perfil_cache, resultado)
+            admin_service.registrar_consulta(
+                pregunta, perfil, resultado.get("fuentes", []),
+                desde_cache=False, tiempo_ms=int((time.time() - t0) * 1000),
+            )
+        return await agente.hablar(resultado["respuesta"], formato=formato)
+
+    async def procesar_voz_stream(
+        self, audio_file: UploadFile, perfil: str = "profesores"
+    ) -> tuple[str, AsyncGenerator[bytes, None]]:
+        """
+        Transcribe la pregunta y devuelve (transcripción, generador de bytes WAV)
+        que va sintetizando la respuesta frase a frase.
+        """
+        agente = await self._get_or_create_agente(perfil, "voz")
+        transcripcion = await agente.transcribir(await audio_file.read())
+        return transcripcion, agente.responder_voz_stream(transcripcion)
 
     async def procesar_hibrido(self, audio_file: UploadFile, perfil: str = "profesores"):
         agente = await self._get_or_create_agente(perfil, "hibrido")
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            shutil.copyfileobj(audio_file.file, tmp)
-            ruta_entrada = tmp.name
-        try:
-            return await agente.responder(ruta_entrada)
-        finally:
-            if os.path.exists(ruta_entrada):
-                os.remove(ruta_entrada)
+        return await agente.responder(await audio_file.read())
 
 
 agents_service = AgentsService()
@@ -7,6 +7,9 @@ Mejoras de normalización:
 - Strip de signos de puntuación iniciales/finales → "¿cómo?" == "como"
 - Colapsa espacios múltiples → "hola  mundo" == "hola mundo"
 - TTL y max_entradas configurables por variable de entorno
+
+Además ofrece espacios de nombres genéricos con TTL por entrada (get_ns /
+set_ns / invalidar_ns), que usa p.ej. la caché de resultados de tools.
 """
 import hashlib
 import os
@@ -35,6 +38,9 @@ class CacheService:
         _max = int(os.getenv("CACHE_MAX_ENTRADAS", max_entradas or 300))
         self._ttl = timedelta(minutes=_ttl)
         self._max = _max
+        # namespace → clave → {"datos", "expira"}
+        self._ns: dict[str, dict[str, dict]] = {}
+        self._max_ns = int(os.getenv("CACHE_MAX_ENTRADAS_NS", "500"))
 
     def _clave(self, pregunta: str, perfil: str) -> str:
         texto = f"{perfil}:{_normalizar(pregunta)}"
@@ -63,8 +69,39 @@ class CacheService:
 
     def invalidar_todo(self) -> None:
         self._cache.clear()
+        self._ns.clear()
         print("🗑️ [CACHE] Caché vaciado.")
 
+    # ── Espacios de nombres genéricos ─────────────────────────────────────────
+
+    def get_ns(self, namespace: str, clave: str):
+        entradas = self._ns.get(namespace)
+        if not entradas or clave not in entradas:
+            return None
+        entry = entradas[clave]
+        if datetime.now() < entry["expira"]:
+            return entry["datos"]
+        del entradas[clave]
+        return None
+
+    def set_ns(self, namespace: str, clave: str, datos, ttl_segundos: float) -> None:
+        entradas = self._ns.setdefault(namespace, {})
+        if clave not in entradas and len(entradas) >= self._max_ns:
+            # Eliminar la que antes expira
+            del entradas[min(entradas, key=lambda k: entradas[k]["expira"])]
+        entradas[clave] = {"datos": datos, "expira": datetime.now() + timedelta(seconds=ttl_segundos)}
+
+    def invalidar_ns(self, namespace: str, prefijo: str | None = None) -> int:
+        """Vacía un namespace entero o solo las claves que empiezan por 'prefijo'."""
+        entradas = self._ns.get(namespace, {})
+        claves = [k for k in entradas if prefijo is None or k.startswith(prefijo)]
+        for k in claves:
+            del entradas[k]
+        if claves:
+            print(f"🗑️ [CACHE] {len(claves)} entradas invalidadas en '{namespace}'"
+                  f"{f' ({prefijo})' if prefijo else ''}.")
+        return len(claves)
+
     def limpiar_expirados(self) -> int:
         """Elimina entradas con TTL vencido. Devuelve el número de entradas eliminadas."""
         ahora = datetime.now()
@@ -86,6 +123,7 @@ class CacheService:
             "entradas_activas": activas,
             "ttl_minutos": int(self._ttl.total_seconds() / 60),
             "max_entradas": self._max,
+            "namespaces": {ns: len(entradas) for ns, entradas in self._ns.items()},
         }
 
 
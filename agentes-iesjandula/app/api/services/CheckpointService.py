@@ -0,0 +1,195 @@
+"""
+CheckpointService.py — Retención y mantenimiento de checkpoints.db.
+
+AsyncSqliteSaver guarda TODOS los estados intermedios de cada hilo (varios
+por turno: entrada, clasificador, chatbot, tools...) y nunca borra nada, en
+el mismo volumen que chroma_db_v3. Este servicio, periódicamente:
+
+- Retención: conserva solo los últimos CHECKPOINT_RETENER checkpoints de
+  cada hilo (el último es el único necesario para continuar la conversación)
+  y elimina las 'writes' huérfanas.
+- Caducidad: borra los hilos sin actividad en CHECKPOINT_EXPIRAR_DIAS. La
+  fecha se obtiene del propio checkpoint_id (UUID v6, ordenado por tiempo).
+- Compactación: la base usa auto_vacuum=INCREMENTAL (ver _get_checkpointer),
+  así que las páginas libres se devuelven con PRAGMA incremental_vacuum en
+  tandas de CHECKPOINT_VACUUM_LOTE páginas, soltando el lock del saver entre
+  tandas, y después PRAGMA wal_checkpoint(TRUNCATE). Nunca VACUUM completo:
+  reescribe el fichero entero con la conexión bloqueada.
+
+Intervalo: CHECKPOINT_MANTENIMIENTO_HORAS (0 = desactivado; se puede lanzar
+a mano con POST /api/admin/checkpoints/mantenimiento).
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+_RETENER = int(os.getenv("CHECKPOINT_RETENER", "10"))
+_EXPIRAR_DIAS = float(os.getenv("CHECKPOINT_EXPIRAR_DIAS", "90"))
+_INTERVALO_H = float(os.getenv("CHECKPOINT_MANTENIMIENTO_HORAS", "6"))
+_VACUUM_LOTE = int(os.getenv("CHECKPOINT_VACUUM_LOTE", "512"))  # páginas por tanda (~2 MB)
+_RETRASO_INICIAL_S = 300  # no competir con el warmup del arranque
+
+# Época de los UUID v1/v6 (1582-10-15) en intervalos de 100 ns respecto a la época Unix
+_UUID_EPOCA = 0x01B21DD213814000
+
+
+def _fecha_checkpoint_id(checkpoint_id: str) -> float | None:
+    """Timestamp Unix codificado en un checkpoint_id UUID v6 (None si no lo es)."""
+    h = checkpoint_id.replace("-", "")
+    if len(h) != 32 or h[12] != "6":
+        return None
+    ticks = int(h[0:12] + h[13:16], 16)
+    return (ticks - _UUID_EPOCA) / 1e7
+
+
+def _tamano_db(ruta: str) -> int:
+    return sum(os.path.getsize(p) for p in (ruta, ruta + "-wal") if os.path.exists(p))
+
+
+class CheckpointService:
+    def __init__(self):
+        self._ultimo: dict | None = None
+        self._lock = asyncio.Lock()
+
+    async def _conexion(self):
+        """(conexión aiosqlite, lock del saver) o (None, None) si es MemorySaver."""
+        from app.agents import AgentConfig
+        saver = await AgentConfig._get_checkpointer()
+        conn = AgentConfig._checkpointer_conn
+        if conn is None:
+            return None, None
+        # Compartimos el lock del saver para no intercalar con sus lecturas/escrituras
+        return conn, getattr(saver, "lock", None) or self._lock
+
+    async def mantenimiento(self) -> dict:
+        """Aplica retención, caducidad y compactación. Devuelve un resumen."""
+        conn, lock = await self._conexion()
+        if conn is None:
+            return {"status": "omitido", "motivo": "checkpointer en memoria"}
+
+        from app.agents.AgentConfig import _ruta_checkpoints_db
+        ruta = _ruta_checkpoints_db()
+        t0 = time.perf_counter()
+        tamano_antes = _tamano_db(ruta)
+
+        async with lock:
+            # 1. Hilos caducados (último checkpoint anterior al corte)
+            limite = time.time() - _EXPIRAR_DIAS * 86400
+            async with conn.execute(
+                "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id"
+            ) as cur:
+                filas = await cur.fetchall()
+            caducados = [
+                (hilo,) for hilo, ultimo in filas
+                if (fecha := _fecha_checkpoint_id(ultimo)) is not None and fecha < limite
+            ]
+            if caducados:
+                await conn.executemany("DELETE FROM checkpoints WHERE thread_id = ?", caducados)
+                await conn.executemany("DELETE FROM writes WHERE thread_id = ?", caducados)
+
+            # 2. Retención de los N checkpoints más recientes por hilo/namespace
+            cur = await conn.execute(
+                """
+                DELETE FROM checkpoints WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                        ) AS n
+                        FROM checkpoints
+                    ) WHERE n > ?
+                )
+                """,
+                (max(_RETENER, 1),),
+            )
+            borrados = cur.rowcount
+            cur = await conn.execute(
+                """
+                DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id
+                      AND c.checkpoint_ns = writes.checkpoint_ns
+                      AND c.checkpoint_id = writes.checkpoint_id
+                )
+                """
+            )
+            writes_borradas = cur.rowcount
+            await conn.commit()
+
+        # 3. Compactación por tandas: cada una retiene el lock unos milisegundos
+        paginas_liberadas, libres_antes = 0, None
+        while True:
+            async with lock:
+                async with conn.execute("PRAGMA freelist_count") as cur:
+                    libres = (await cur.fetchone())[0]
+                if libres_antes is not None:
+                    paginas_liberadas += libres_antes - libres
+                # Sin progreso = base sin auto_vacuum incremental: no insistir
+                if not libres or libres == libres_antes:
+                    break
+                async with conn.execute(f"PRAGMA incremental_vacuum({max(_VACUUM_LOTE, 1)})") as cur:
+                    await cur.fetchall()  # la pragma avanza una página por paso
+                await conn.commit()
+            libres_antes = libres
+            await asyncio.sleep(0)  # dejar pasar a las lecturas/escrituras del saver
+        async with lock:
+            await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        resultado = {
+            "status": "ok",
+            "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "hilos_caducados": len(caducados),
+            "checkpoints_borrados": borrados,
+            "writes_borradas": writes_borradas,
+            "paginas_liberadas": paginas_liberadas,
+            "bytes_antes": tamano_antes,
+            "bytes_despues": _tamano_db(ruta),
+            "ms": round((time.perf_counter() - t0) * 1000),
+        }
+        self._ultimo = resultado
+        print(f"🧹 [CHECKPOINTS] {len(caducados)} hilos caducados, {borrados} checkpoints y "
+              f"{writes_borradas} writes borrados, {paginas_liberadas} páginas liberadas "
+              f"({tamano_antes // 1024} → {resultado['bytes_despues'] // 1024} KB)")
+        return resultado
+
+    async def stats(self) -> dict:
+        conn, lock = await self._conexion()
+        if conn is None:
+            return {"modo": "memoria"}
+
+        from app.agents.AgentConfig import _get_checkpointer, _ruta_checkpoints_db
+        saver = await _get_checkpointer()
+        async with lock:
+            async with conn.execute(
+                "SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints"
+            ) as cur:
+                hilos, checkpoints = await cur.fetchone()
+            async with conn.execute("SELECT COUNT(*) FROM writes") as cur:
+                writes = (await cur.fetchone())[0]
+        return {
+            "modo": "diferido" if hasattr(saver, "volcar") else "sqlite",
+            "diferido": saver.stats() if hasattr(saver, "volcar") else None,
+            "bytes": _tamano_db(_ruta_checkpoints_db()),
+            "hilos": hilos,
+            "checkpoints": checkpoints,
+            "writes": writes,
+            "retener_por_hilo": _RETENER,
+            "expirar_dias": _EXPIRAR_DIAS,
+            "ultimo_mantenimiento": self._ultimo,
+        }
+
+    async def bucle_periodico(self) -> None:
+        """Tarea de fondo del lifespan: mantenimiento cada CHECKPOINT_MANTENIMIENTO_HORAS."""
+        if _INTERVALO_H <= 0:
+            print("⏭️  Mantenimiento de checkpoints DESACTIVADO (CHECKPOINT_MANTENIMIENTO_HORAS=0).")
+            return
+        await asyncio.sleep(_RETRASO_INICIAL_S)
+        while True:
+            try:
+                await self.mantenimiento()
+            except Exception as e:
+                print(f"⚠️ [CHECKPOINTS] Error en mantenimiento: {e}")
+            await asyncio.sleep(_INTERVALO_H * 3600)
+
+
+checkpoint_service = CheckpointService()
@@ -4,6 +4,7 @@ import tempfile
 
 from fastapi import UploadFile
 from typing import List
+from app.agents.CacheTools import invalidar_tools_rag
 from data.data import (
     subir_nuevo_documento,
     listar_documentos_en_coleccion,
@@ -90,6 +91,8 @@ class RagService:
 
         exitosos = [r for r in resultados if r["status"] == "success"]
         fallidos = [r for r in resultados if r["status"] == "error"]
+        if exitosos:
+            invalidar_tools_rag(perfil)  # resultados cacheados de la tool ya no son válidos
 
         return {
             "perfil": perfil,
@@ -104,7 +107,9 @@ class RagService:
         return {"perfil": perfil, "documentos": docs, "total": len(docs)}
 
     def eliminar_doc(self, perfil: str, nombre_archivo: str) -> dict:
-        return eliminar_documento_de_coleccion(perfil, nombre_archivo)
+        resultado = eliminar_documento_de_coleccion(perfil, nombre_archivo)
+        invalidar_tools_rag(perfil)
+        return resultado
 
 
 # Instancia singleton
@@ -0,0 +1,300 @@
+"""
+StreamService.py — Codificación SSE y ejecuciones reanudables del agente.
+
+Antes cada chunk del modelo era un evento SSE propio (json.dumps + una
+escritura al socket por token). Con muchos streams concurrentes eso son
+miles de escrituras diminutas por segundo. Además, si la conexión de un
+móvil se cortaba a mitad, el reintento lanzaba otra ejecución del grafo.
+Ahora:
+
+- Cada turno en streaming es una EJECUCIÓN con run_id, desacoplada de la
+  conexión HTTP: sus frames se guardan en un log en memoria acotado
+  (SSE_LOG_MAX_FRAMES) y las conexiones son lectores de ese log.
+- Los tokens consecutivos se agrupan en un único frame 'token': tras el
+  primero se esperan SSE_VENTANA_MS y se vacía la cola (troceando en
+  SSE_MAX_CHARS). Cualquier otro evento (herramienta, error, fin) vacía
+  antes lo acumulado, así que el orden se conserva.
+- Los frames se codifican una vez a bytes con 'id: <run_id>:<seq>'. Un
+  cliente que reconecta con la cabecera Last-Event-ID continúa desde ahí
+  sin relanzar el grafo; un reintento idéntico (mismo hilo, perfil y
+  pregunta) mientras la ejecución sigue en curso se engancha a ella.
+- Una ejecución terminada se puede repetir durante SSE_REPLAY_S.
+- Si el último lector se desconecta, la ejecución se cancela tras
+  SSE_GRACIA_S sin reconexión (grafo, tools y LLM pendientes). Por defecto
+  5 s: cubre una reconexión del EventSource (los navegadores reintentan a
+  los ~3 s) o de un móvil que cambia de red, y aun así cancela casi todos
+  los turnos abandonados antes de que terminen. Subirlo tolera cortes más largos a costa de gastar cuota en
+  pestañas cerradas (la mayoría de turnos acaba en menos de 20 s).
+- Si no se envía nada en SSE_HEARTBEAT_S se manda un comentario
+  ': heartbeat' para que proxies y navegadores no cierren la conexión.
+
+El log vive en memoria del proceso (un único worker de uvicorn): tras un
+reinicio no hay nada que reanudar y el cliente recibe 410.
+
+El esquema de los eventos no cambia: un frame agrupado es un
+{"tipo": "token", "texto": "..."} con más texto.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import aclosing, suppress
+from typing import AsyncIterator, Awaitable, Callable
+
+_VENTANA_S = float(os.getenv("SSE_VENTANA_MS", "30")) / 1000
+_MAX_CHARS = int(os.getenv("SSE_MAX_CHARS", "512"))
+_HEARTBEAT_S = float(os.getenv("SSE_HEARTBEAT_S", "15"))
+_GRACIA_S = float(os.getenv("SSE_GRACIA_S", "5"))
+_REPLAY_S = float(os.getenv("SSE_REPLAY_S", "60"))
+_LOG_MAX_FRAMES = int(os.getenv("SSE_LOG_MAX_FRAMES", "1000"))
+_SONDEO_DESCONEXION_S = 0.5  # cada cuánto se pregunta si el cliente sigue conectado
+
+_HEARTBEAT = b": heartbeat\n\n"
+_FIN_PRODUCTOR = object()
+
+
+def codificar_frame(evento: dict, id_evento: str | int | None = None) -> bytes:
+    """Evento → frame SSE en bytes ('id:' opcional + 'data:')."""
+    datos = json.dumps(evento, ensure_ascii=False, separators=(",", ":"))
+    cabecera = f"id: {id_evento}\n" if id_evento is not None else ""
+    return f"{cabecera}data: {datos}\n\n".encode()
+
+
+class _Ejecucion:
+    """Log de frames de un turno y estado de sus lectores."""
+
+    def __init__(self, run_id: str, clave: str | None):
+        self.run_id = run_id
+        self.clave = clave
+        self.frames: deque[tuple[int, bytes]] = deque(maxlen=_LOG_MAX_FRAMES)
+        self.seq = 0
+        self.terminada = False
+        self.lectores = 0
+        self.productor: asyncio.Task | None = None
+        self.agrupador: asyncio.Task | None = None
+        self.cancelacion: asyncio.TimerHandle | None = None
+        self._aviso = asyncio.Event()
+
+    def anadir(self, evento: dict) -> bytes:
+        self.seq += 1
+        frame = codificar_frame(evento, f"{self.run_id}:{self.seq}")
+        self.frames.append((self.seq, frame))
+        return frame
+
+    def notificar(self) -> None:
+        self._aviso.set()
+        self._aviso = asyncio.Event()
+
+    async def esperar(self, timeout: float) -> None:
+        aviso = self._aviso
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(aviso.wait(), timeout=max(timeout, 0))
+
+    def pendientes(self, enviado: int) -> tuple[int, bytes]:
+        """(último seq, frames posteriores a 'enviado' concatenados en una sola escritura)."""
+        nuevos = [(s, f) for s, f in self.frames if s > enviado]
+        if not nuevos:
+            return enviado, b""
+        return nuevos[-1][0], b"".join(f for _, f in nuevos)
+
+    def conserva(self, seq: int) -> bool:
+        """True si el log aún tiene todo lo posterior a 'seq'."""
+        primero = self.frames[0][0] if self.frames else self.seq + 1
+        return primero <= seq + 1 <= self.seq + 1
+
+
+class StreamService:
+    def __init__(self, ventana_s: float = _VENTANA_S, max_chars: int = _MAX_CHARS,
+                 heartbeat_s: float = _HEARTBEAT_S, gracia_s: float = _GRACIA_S,
+                 replay_s: float = _REPLAY_S):
+        self.ventana_s = ventana_s
+        self.max_chars = max_chars
+        self.heartbeat_s = heartbeat_s
+        self.gracia_s = gracia_s
+        self.replay_s = replay_s
+        self._ejecuciones: dict[str, _Ejecucion] = {}
+        self._por_clave: dict[str, str] = {}
+        self._metricas = {
+            "ejecuciones": 0, "eventos": 0, "frames": 0, "bytes": 0, "heartbeats": 0,
+            "reanudaciones": 0, "reintentos_enganchados": 0, "canceladas_sin_lector": 0,
+        }
+
+    # ── Ejecuciones ───────────────────────────────────────────────────────────
+
+    def lanzar(self, eventos: AsyncIterator[dict], clave: str | None = None) -> str:
+        """Empieza a consumir 'eventos' en segundo plano. Devuelve el run_id."""
+        ej = _Ejecucion(uuid.uuid4().hex[:12], clave)
+        self._ejecuciones[ej.run_id] = ej
+        if clave:
+            self._por_clave[clave] = ej.run_id
+        self._metricas["ejecuciones"] += 1
+
+        cola: asyncio.Queue = asyncio.Queue()
+
+        async def _producir():
+            try:
+                async with aclosing(eventos) as fuente:
+                    async for evento in fuente:
+                        cola.put_nowait(evento)
+            except Exception as e:
+                print(f"❌ [STREAM {ej.run_id}] {e}")
+                cola.put_nowait({"tipo": "error", "mensaje": "Error al generar la respuesta. Inténtalo de nuevo."})
+            finally:
+                cola.put_nowait(_FIN_PRODUCTOR)
+
+        ej.productor = asyncio.create_task(_producir())
+        ej.agrupador = asyncio.create_task(self._agrupar(ej, cola))
+        # Si ninguna conexión llega a leerla, se cancela como si se hubiera desconectado
+        ej.cancelacion = asyncio.get_running_loop().call_later(
+            self.gracia_s, self._cancelar_sin_lector, ej.run_id
+        )
+        return ej.run_id
+
+    def buscar(self, ultimo_id: str | None, clave: str | None) -> tuple[str, int] | None:
+        """
+        (run_id, último seq recibido) para reanudar a partir de Last-Event-ID,
+        o de una ejecución en curso con la misma clave; None si no hay nada.
+        """
+        if ultimo_id:
+            run_id, _, seq = ultimo_id.partition(":")
+            ej = self._ejecuciones.get(run_id)
+            if ej is not None and seq.isdigit() and ej.conserva(int(seq)):
+                self._metricas["reanudaciones"] += 1
+                return run_id, int(seq)
+            return None
+        ej = self._ejecuciones.get(self._por_clave.get(clave or "", ""))
+        if ej is not None and not ej.terminada:
+            self._metricas["reintentos_enganchados"] += 1
+            return ej.run_id, 0
+        return None
+
+    async def _agrupar(self, ej: _Ejecucion, cola: asyncio.Queue) -> None:
+        """Cola de eventos → frames en el log, con los tokens de cada ventana agrupados."""
+        try:
+            while True:
+                evento = await cola.get()
+                if evento is not _FIN_PRODUCTOR and evento.get("tipo") == "token":
+                    await asyncio.sleep(self.ventana_s)  # dejar que se acumulen los de la ventana
+                lote = [evento]
+                while lote[-1] is not _FIN_PRODUCTOR and not cola.empty():
+                    lote.append(cola.get_nowait())
+                self._a_frames(ej, lote)
+                ej.notificar()
+                if lote[-1] is _FIN_PRODUCTOR:
+                    break
+        finally:
+            ej.terminada = True
+            ej.notificar()
+            if ej.productor is not None and not ej.productor.done():
+                ej.productor.cancel()
+            asyncio.get_running_loop().call_later(self.replay_s, self._olvidar, ej.run_id)
+
+    def _a_frames(self, ej: _Ejecucion, lote: list) -> None:
+        m = self._metricas
+        tokens, n_chars = [], 0
+
+        def _anadir(evento: dict) -> None:
+            m["frames"] += 1
+            m["bytes"] += len(ej.anadir(evento))
+
+        for evento in lote:
+            if evento is _FIN_PRODUCTOR:
+                break
+            m["eventos"] += 1
+            if evento.get("tipo") == "token":
+                tokens.append(evento.get("texto", ""))
+                n_chars += len(tokens[-1])
+                if n_chars >= self.max_chars:
+                    _anadir({"tipo": "token", "texto": "".join(tokens)})
+                    tokens, n_chars = [], 0
+                continue
+            if tokens:
+                _anadir({"tipo": "token", "texto": "".join(tokens)})
+                tokens, n_chars = [], 0
+            _anadir(evento)
+        if tokens:
+            _anadir({"tipo": "token", "texto": "".join(tokens)})
+
+    def _cancelar_sin_lector(self, run_id: str) -> None:
+        ej = self._ejecuciones.get(run_id)
+        if ej is None or ej.lectores or ej.terminada:
+            return
+        self._metricas["canceladas_sin_lector"] += 1
+        print(f"🛑 [STREAM {run_id}] Sin reconexión en {self.gracia_s:.0f}s → turno cancelado")
+        ej.productor.cancel()
+
+    def _olvidar(self, run_id: str) -> None:
+        ej = self._ejecuciones.pop(run_id, None)
+        if ej is not None and ej.clave and self._por_clave.get(ej.clave) == run_id:
+            del self._por_clave[ej.clave]
+
+    # ── Conexiones ────────────────────────────────────────────────────────────
+
+    async def emitir(
+        self,
+        run_id: str,
+        desde: int = 0,
+        desconectado: Callable[[], Awaitable[bool]] | None = None,
+    ) -> AsyncIterator[bytes]:
+        """Frames SSE de la ejecución a partir del seq 'desde' (exclusivo), en vivo."""
+        ej = self._ejecuciones.get(run_id)
+        if ej is None:
+            return
+        ej.lectores += 1
+        if ej.cancelacion is not None:
+            ej.cancelacion.cancel()
+            ej.cancelacion = None
+
+        enviado = desde
+        ultimo_envio = ultimo_sondeo = time.monotonic()
+        try:
+            while True:
+                enviado, datos = ej.pendientes(enviado)
+                if datos:
+                    ultimo_envio = time.monotonic()
+                    yield datos
+                    continue
+                if ej.terminada:
+                    break
+
+                ahora = time.monotonic()
+                espera = ultimo_envio + self.heartbeat_s - ahora
+                if desconectado is not None:
+                    espera = min(espera, ultimo_sondeo + _SONDEO_DESCONEXION_S - ahora)
+                await ej.esperar(espera)
+
+                ahora = time.monotonic()
+                if desconectado is not None and ahora - ultimo_sondeo >= _SONDEO_DESCONEXION_S:
+                    ultimo_sondeo = ahora
+                    if await desconectado():
+                        break
+                if ahora - ultimo_envio >= self.heartbeat_s and not ej.pendientes(enviado)[1]:
+                    self._metricas["heartbeats"] += 1
+                    ultimo_envio = ahora
+                    yield _HEARTBEAT
+        finally:
+            ej.lectores -= 1
+            if ej.lectores == 0 and not ej.terminada:
+                ej.cancelacion = asyncio.get_running_loop().call_later(
+                    self.gracia_s, self._cancelar_sin_lector, run_id
+                )
+
+    def stats(self) -> dict:
+        m = self._metricas
+        return {
+            **m,
+            "en_curso": sum(1 for e in self._ejecuciones.values() if not e.terminada),
+            "en_memoria": len(self._ejecuciones),
+            "lectores": sum(e.lectores for e in self._ejecuciones.values()),
+            "eventos_por_frame": round(m["eventos"] / m["frames"], 2) if m["frames"] else 0.0,
+            "ventana_ms": round(self.ventana_s * 1000),
+            "max_chars": self.max_chars,
+            "heartbeat_s": self.heartbeat_s,
+            "gracia_s": self.gracia_s,
+            "replay_s": self.replay_s,
+        }
+
+
+stream_service = StreamService()
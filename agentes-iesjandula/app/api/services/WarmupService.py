@@ -0,0 +1,125 @@
+"""
+WarmupService.py — Pre-calentamiento del sistema SIN gastar llamadas al LLM.
+
+Sustituye al antiguo warmup que enviaba "Hola" a Gemini en cada despliegue
+(consumía cuota del free tier y solo calentaba un perfil). Ahora se calienta
+cada componente por separado y se mide su tiempo:
+
+- grafos:        compila todos los agentes perfil × modo (grafos compartidos)
+- checkpointer:  abre la conexión SQLite de la memoria conversacional
+- chroma:        carga en memoria el índice HNSW de cada colección
+- embeddings:    construye el cliente de embeddings; la consulta real gasta cuota
+                 de la API en cada despliegue y solo se hace con WARMUP_EMBEDDINGS=true
+- voz:           Whisper + Kokoro en cada worker de voz (solo con WARMUP_VOZ=true; pesados en RAM)
+- navegador:     Chromium + contextos de extraer_contenido_web (solo con WARMUP_NAVEGADOR=true)
+
+El resultado se expone en GET /api/ready (503 hasta que termine bien).
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from app.api.services.AgenteService import agents_service
+
+
+def _activo(variable: str, defecto: str) -> bool:
+    return os.getenv(variable, defecto).strip().lower() in ("1", "true", "yes")
+
+
+def _tocar_colecciones() -> dict:
+    """Fuerza la carga del índice HNSW de cada colección con una query real."""
+    from data.data import _PERFIL_A_COLECCION, obtener_coleccion
+
+    detalle = {}
+    for perfil in _PERFIL_A_COLECCION:
+        t0 = time.perf_counter()
+        col = obtener_coleccion(perfil)
+        # Reutilizamos un vector ya almacenado: no hace falta llamar a la API de embeddings
+        muestra = col.get(limit=1, include=["embeddings"])
+        embeddings = muestra.get("embeddings")
+        if embeddings is not None and len(embeddings) > 0:
+            vector = [float(x) for x in embeddings[0]]
+            col.query(query_embeddings=[vector], n_results=1, include=["distances"])
+            detalle[perfil] = round((time.perf_counter() - t0) * 1000)
+        else:
+            detalle[perfil] = "vacía"
+    return detalle
+
+
+def _tocar_embeddings(consultar: bool) -> str:
+    from data.data import embedding_fn
+    if not consultar:
+        return f"cliente {type(embedding_fn).__name__} (sin consulta)"
+    vector = embedding_fn.embed_query("calentamiento")
+    return f"dim={len(vector)}"
+
+
+async def _abrir_checkpointer() -> str:
+    from app.agents.AgentConfig import _get_checkpointer
+    saver = await _get_checkpointer()
+    # Lectura trivial: abre/valida la conexión y las tablas
+    await saver.aget_tuple({"configurable": {"thread_id": "__warmup__", "checkpoint_ns": ""}})
+    return type(saver).__name__
+
+
+class WarmupService:
+    def __init__(self):
+        self._componentes: dict[str, dict] = {}
+        self._inicio: str | None = None
+        self._duracion_ms: int | None = None
+        self._terminado = False
+
+    async def _medir(self, nombre: str, funcion) -> None:
+        self._componentes[nombre] = {"estado": "en_curso"}
+        t0 = time.perf_counter()
+        try:
+            detalle = await funcion()
+            estado = {"estado": "ok", "detalle": detalle}
+        except Exception as e:
+            print(f"⚠️ [WARMUP] {nombre} falló: {e}")
+            estado = {"estado": "error", "detalle": str(e)}
+        estado["ms"] = round((time.perf_counter() - t0) * 1000)
+        self._componentes[nombre] = estado
+        print(f"🔥 [WARMUP] {nombre}: {estado['estado']} en {estado['ms']} ms")
+
+    async def ejecutar(self) -> dict:
+        """Calienta todos los componentes en paralelo. No invoca nunca al chat-LLM."""
+        self._inicio = datetime.now().isoformat(timespec="seconds")
+        self._terminado = False
+        t0 = time.perf_counter()
+
+        tareas = [
+            self._medir("checkpointer", _abrir_checkpointer),
+            self._medir("grafos", agents_service.precalentar_agentes),
+            self._medir("chroma", lambda: asyncio.to_thread(_tocar_colecciones)),
+            self._medir("embeddings", lambda: asyncio.to_thread(
+                _tocar_embeddings, _activo("WARMUP_EMBEDDINGS", "false"))),
+        ]
+        if _activo("WARMUP_VOZ", "false"):
+            from app.agents.abilities.PoolVoz import pool_voz
+            tareas.append(self._medir("voz", pool_voz.precargar))
+        if _activo("WARMUP_NAVEGADOR", "false"):
+            from app.tools.pool_navegador import pool_navegador
+            tareas.append(self._medir("navegador", pool_navegador.precalentar))
+
+        await asyncio.gather(*tareas)
+        self._duracion_ms = round((time.perf_counter() - t0) * 1000)
+        self._terminado = True
+        print(f"✅ [WARMUP] Completado en {self._duracion_ms} ms")
+        return self.estado()
+
+    def listo(self) -> bool:
+        return self._terminado and all(c["estado"] == "ok" for c in self._componentes.values())
+
+    def estado(self) -> dict:
+        return {
+            "listo": self.listo(),
+            "terminado": self._terminado,
+            "inicio": self._inicio,
+            "duracion_ms": self._duracion_ms,
+            "componentes": self._componentes,
+        }
+
+
+warmup_service = WarmupService()
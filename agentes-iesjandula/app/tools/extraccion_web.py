@@ -0,0 +1,239 @@
+"""
+extraccion_web.py — IES Jándula
+Extracción de texto de una URL: HTTP primero, navegador solo si hace falta.
+
+Casi todo lo que extrae el agente (BOE, BOJA, blog Averroes) es HTML servido
+ya renderizado, y pasar por Chromium costaba segundos por página. Ahora:
+
+- Primero un GET con un httpx.AsyncClient compartido (keep-alive, gzip/br,
+  redirecciones) y extracción del texto con BeautifulSoup (lxml si está
+  instalado). Los PDF se leen directamente con pypdf.
+- Peticiones condicionales: se guardan ETag/Last-Modified y el texto de las
+  últimas HTTP_CACHE_ENTRADAS URLs; si el servidor responde 304 se reutiliza
+  el texto sin descargar ni parsear nada.
+- Solo se escala a Chromium (pool_navegador) si la página parece depender de
+  JavaScript (poco texto, aviso de "activa JavaScript", raíz de SPA vacía),
+  si la respuesta es un error (403 antibots, 5xx...) o un tipo desconocido.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import io
+import os
+import re
+import time
+from collections import OrderedDict
+
+import httpx
+
+from .pool_navegador import pool_navegador
+
+MAX_CARACTERES = 10000  # texto devuelto al LLM (no saturar el contexto)
+
+_USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/124.0 Safari/537.36"
+)
+_TIPOS_HTML = ("text/html", "application/xhtml+xml")
+_TIPOS_TEXTO = ("text/plain",)
+_TIPOS_PDF = ("application/pdf",)
+_ETIQUETAS_RUIDO = ["script", "style", "nav", "footer", "header", "noscript"]
+
+# Señales de página que pinta el contenido con JavaScript
+_AVISO_JS = re.compile(
+    r"(enable|activa|habilita|requires?|necesita)\w*\s+(el\s+)?javascript", re.IGNORECASE
+)
+_RAIZ_SPA = re.compile(
+    r"<div[^>]+id=[\"'](root|app|__next|__nuxt)[\"'][^>]*>\s*</div>", re.IGNORECASE
+)
+
+# lxml es varias veces más rápido que el parser de la librería estándar
+_PARSER_HTML = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+
+class _Escalar(Exception):
+    """La vía HTTP no sirve para esta URL: hay que usar el navegador."""
+
+
+def html_a_texto(html: str | bytes, codificacion: str | None = None) -> str:
+    """Texto visible del HTML, sin scripts, estilos ni menús."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, _PARSER_HTML, from_encoding=codificacion if isinstance(html, bytes) else None)
+    for element in soup(_ETIQUETAS_RUIDO):
+        element.decompose()
+    return soup.get_text(separator=" ", strip=True)
+
+
+def pdf_a_texto(datos: bytes, max_caracteres: int = MAX_CARACTERES) -> str:
+    """Texto de un PDF, parando en cuanto hay suficiente para el LLM."""
+    from pypdf import PdfReader
+
+    partes, total = [], 0
+    for pagina in PdfReader(io.BytesIO(datos)).pages:
+        texto = (pagina.extract_text() or "").strip()
+        partes.append(texto)
+        total += len(texto)
+        if total >= max_caracteres:
+            break
+    return re.sub(r"\s+", " ", " ".join(partes)).strip()
+
+
+class ExtractorWeb:
+    def __init__(self):
+        self._timeout_s = float(os.getenv("HTTP_TIMEOUT_S", "5"))
+        self._max_bytes = int(float(os.getenv("HTTP_MAX_MB", "15")) * 1024 * 1024)
+        self._min_caracteres = int(os.getenv("HTTP_MIN_CARACTERES", "400"))
+        self._max_cache = int(os.getenv("HTTP_CACHE_ENTRADAS", "200"))
+        self._cliente: httpx.AsyncClient | None = None
+        # url → {"etag", "last_modified", "texto"} (LRU)
+        self._validadores: OrderedDict[str, dict] = OrderedDict()
+        self._metricas = {
+            "http": 0, "http_304": 0, "pdf": 0, "navegador": 0, "errores": 0,
+            "http_ms": 0.0, "navegador_ms": 0.0,
+        }
+        self._motivos_escalado: dict[str, int] = {}
+
+    def _obtener_cliente(self) -> httpx.AsyncClient:
+        if self._cliente is None or self._cliente.is_closed:
+            self._cliente = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=httpx.Timeout(self._timeout_s, connect=min(5.0, self._timeout_s)),
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+                headers={
+                    "User-Agent": _USER_AGENT,
+                    "Accept": "text/html,application/xhtml+xml,application/pdf;q=0.9,*/*;q=0.8",
+                    "Accept-Language": "es-ES,es;q=0.9",
+                },
+            )
+        return self._cliente
+
+    # ── Vía HTTP ──────────────────────────────────────────────────────────────
+
+    def _recordar(self, url: str, respuesta: httpx.Response, texto: str) -> None:
+        etag, modificado = respuesta.headers.get("etag"), respuesta.headers.get("last-modified")
+        if self._max_cache <= 0 or not (etag or modificado):
+            return
+        self._validadores[url] = {"etag": etag, "last_modified": modificado, "texto": texto}
+        self._validadores.move_to_end(url)
+        while len(self._validadores) > self._max_cache:
+            self._validadores.popitem(last=False)
+
+    async def _por_http(self, url: str) -> tuple[str, str]:
+        """(texto, vía) descargando con httpx; lanza _Escalar si no vale."""
+        previo = self._validadores.get(url)
+        cabeceras = {}
+        if previo:
+            if previo["etag"]:
+                cabeceras["If-None-Match"] = previo["etag"]
+            if previo["last_modified"]:
+                cabeceras["If-Modified-Since"] = previo["last_modified"]
+
+        try:
+            async with self._obtener_cliente().stream("GET", url, headers=cabeceras) as respuesta:
+                if respuesta.status_code == 304 and previo:
+                    self._validadores.move_to_end(url)
+                    return previo["texto"], "http-304"
+                if respuesta.status_code >= 400:
+                    raise _Escalar(f"HTTP {respuesta.status_code}")
+                tipo = respuesta.headers.get("content-type", "").split(";")[0].strip().lower()
+                if tipo and not tipo.startswith(_TIPOS_HTML + _TIPOS_TEXTO + _TIPOS_PDF):
+                    raise _Escalar(f"tipo {tipo}")
+
+                trozos, total = [], 0
+                async for trozo in respuesta.aiter_bytes():
+                    total += len(trozo)
+                    if total > self._max_bytes:
+                        raise _Escalar("demasiado grande")
+                    trozos.append(trozo)
+                cuerpo = b"".join(trozos)
+        except httpx.HTTPError as e:
+            raise _Escalar(type(e).__name__) from e
+
+        if tipo.startswith(_TIPOS_PDF) or cuerpo[:5] == b"%PDF-":
+            texto = await asyncio.to_thread(pdf_a_texto, cuerpo)
+            via = "pdf"
+        elif tipo.startswith(_TIPOS_TEXTO):
+            texto = cuerpo.decode(respuesta.encoding or "utf-8", errors="replace").strip()
+            via = "http"
+        else:
+            texto = await asyncio.to_thread(html_a_texto, cuerpo, respuesta.charset_encoding)
+            motivo = self._parece_dinamica(cuerpo, texto)
+            if motivo:
+                raise _Escalar(motivo)
+            via = "http"
+
+        if not texto:
+            raise _Escalar("sin texto")
+        self._recordar(url, respuesta, texto)
+        return texto, via
+
+    def _parece_dinamica(self, cuerpo: bytes, texto: str) -> str | None:
+        """Motivo para pasar la página por el navegador, o None si el HTML basta."""
+        if len(texto) < self._min_caracteres:
+            return "poco texto"
+        # Con mucho texto ya servido, los avisos de JS suelen ser de banners o analytics
+        if len(texto) < self._min_caracteres * 5:
+            html = cuerpo[:200_000].decode("utf-8", errors="ignore")
+            if _RAIZ_SPA.search(html):
+                return "SPA"
+            if _AVISO_JS.search(html):
+                return "requiere JavaScript"
+        return None
+
+    # ── API pública ───────────────────────────────────────────────────────────
+
+    async def extraer_texto(self, url: str) -> tuple[str, str]:
+        """
+        (texto, vía) de 'url'. La vía es 'http', 'http-304', 'pdf' o 'navegador'.
+        El texto se devuelve completo; el corte a MAX_CARACTERES lo hace la tool.
+        """
+        t0 = time.perf_counter()
+        try:
+            texto, via = await self._por_http(url)
+            self._metricas["http_ms"] += (time.perf_counter() - t0) * 1000
+            self._metricas["http_304" if via == "http-304" else via] += 1
+            return texto, via
+        except _Escalar as e:
+            motivo = str(e)
+            self._motivos_escalado[motivo] = self._motivos_escalado.get(motivo, 0) + 1
+            print(f"   🔁 [SCRAPER] HTTP no basta ({motivo}) → navegador")
+
+        t0 = time.perf_counter()
+        try:
+            html = await pool_navegador.obtener_html(url)
+            texto = await asyncio.to_thread(html_a_texto, html)
+        except Exception:
+            self._metricas["errores"] += 1
+            raise
+        self._metricas["navegador"] += 1
+        self._metricas["navegador_ms"] += (time.perf_counter() - t0) * 1000
+        return texto, "navegador"
+
+    async def cerrar(self) -> None:
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+
+    def stats(self) -> dict:
+        m = self._metricas
+        por_http = m["http"] + m["http_304"] + m["pdf"]
+        total = por_http + m["navegador"]
+        return {
+            "parser_html": _PARSER_HTML,
+            "http": m["http"],
+            "http_304": m["http_304"],
+            "pdf": m["pdf"],
+            "navegador": m["navegador"],
+            "errores": m["errores"],
+            "tasa_http": round(por_http / total, 3) if total else 0,
+            "http_media_ms": round(m["http_ms"] / por_http, 1) if por_http else 0,
+            "navegador_media_ms": round(m["navegador_ms"] / m["navegador"], 1) if m["navegador"] else 0,
+            "motivos_escalado": dict(self._motivos_escalado),
+            "urls_con_validadores": len(self._validadores),
+        }
+
+
+extractor_web = ExtractorWeb()
@@ -27,7 +27,16 @@ def guia_profesorado(search: str) -> str:
         str: Información relevante de la guía del profesorado.
     """
     print(f"\n📋 [TOOL: guia_profesorado] Query: {search}")
+    contexto, _ = buscar_guia_profesorado(search)
+    return contexto
 
+
+def buscar_guia_profesorado(search: str) -> tuple[str, float | None]:
+    """
+    Búsqueda en la guía del profesorado.
+    Devuelve (contexto formateado, distancia del mejor fragmento o None si no hay).
+    La usa también la ruta rápida RAG del chatbot de profesorado.
+    """
     resultados = query_coleccion(
         obtener_coleccion("profesores"),
         query=search,
@@ -45,7 +54,7 @@ def guia_profesorado(search: str) -> str:
         print(f"   [DEBUG] Fragmento {i+1} (dist: {dist:.4f}): {snippet}...")
 
     if not docs:
-        return "No se encontró información en la guía del profesorado para esa consulta."
+        return "No se encontró información en la guía del profesorado para esa consulta.", None
 
     # Filtra resultados con distancia muy alta (semánticamente irrelevantes)
     # En ChromaDB con L2/Cosine, distancias > 1.2 suelen ser ruido
@@ -56,11 +65,11 @@ def guia_profesorado(search: str) -> str:
             pares.append((d, m, dist))
 
     if not pares:
-        return "No se encontró información suficientemente relevante en la guía del profesorado."
+        return "No se encontró información suficientemente relevante en la guía del profesorado.", None
 
     contexto = "Información recuperada de la Guía del Profesorado:\n"
     for i, (texto, meta, dist) in enumerate(pares):
         fuente = meta.get("source", "Guía desconocida")
         contexto += f"\n--- Fragmento {i+1} [Fuente: {fuente}] (Relevancia: {max(0, 1 - dist):.2f}) ---\n{texto}\n"
 
-    return contexto
\ No newline at end of file
+    return contexto, min(dist for _, _, dist in pares)
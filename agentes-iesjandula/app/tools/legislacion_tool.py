@@ -13,8 +13,9 @@ _api_key = os.getenv("TAVILY_API_KEY")
 _client = None
 
 if _api_key:
-    from tavily import TavilyClient
-    _client = TavilyClient(api_key=_api_key)
+    # Asíncrono: cancelar la tarea corta la petición (hedging de LatenciaTools)
+    from tavily import AsyncTavilyClient
+    _client = AsyncTavilyClient(api_key=_api_key)
 else:
     print("⚠️ TAVILY_API_KEY no configurada — busqueda_legislacion_educativa desactivada.")
 
@@ -31,7 +32,7 @@ _DOMINIOS_LEGISLACION = [
 
 
 @tool
-def busqueda_legislacion_educativa(query: str) -> str:
+async def busqueda_legislacion_educativa(query: str) -> str:
     """Busca legislación y normativa educativa en fuentes oficiales españolas.
 
     USA ESTA HERRAMIENTA para:
@@ -61,7 +62,7 @@ def busqueda_legislacion_educativa(query: str) -> str:
     try:
         # 1. Búsqueda en dominios legislativos oficiales
         print("   🔍 Buscando en fuentes legislativas oficiales...")
-        response = _client.search(
+        response = await _client.search(
             query=query + " educación España",
             search_depth="advanced",
             max_results=8,
@@ -71,7 +72,7 @@ def busqueda_legislacion_educativa(query: str) -> str:
         # Si hay pocos resultados, ampliar con búsqueda general legislativa
         if not response.get("results") or len(response["results"]) < 2:
             print("   ⚠️ Pocos resultados en dominios oficiales. Ampliando búsqueda...")
-            response = _client.search(
+            response = await _client.search(
                 query=query + " normativa educativa España 2025",
                 search_depth="advanced",
                 max_results=8,
@@ -93,5 +94,6 @@ def busqueda_legislacion_educativa(query: str) -> str:
         return "\n---\n".join(contexto)
 
     except Exception as e:
+        # Se propaga: un fallo rápido no debe ganar el hedging ni entrar en CacheTools
         print(f"   ❌ [LEGISLACIÓN] Error: {e}")
-        return f"Error al buscar legislación: {e}"
+        raise
@@ -1,7 +1,7 @@
 from playwright.async_api import async_playwright
 from langchain_community.agent_toolkits import PlayWrightBrowserToolkit
 from langchain_core.tools import tool
-from bs4 import BeautifulSoup
+from .extraccion_web import MAX_CARACTERES, extractor_web
 
 
 async def get_playwright_tools():
@@ -44,33 +44,19 @@ async def extraer_contenido_web(url: str) -> str:
     print(f"\n🕷️  [SCRAPER] Navegando a: {url}...")
     
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            
-            # Navegar con timeout y esperar a que la red esté inactiva
-            await page.goto(url, timeout=30000, wait_until="networkidle")
-            
-            # Obtener el HTML y limpiar con BeautifulSoup
-            content = await page.content()
-            soup = BeautifulSoup(content, 'html.parser')
-            
-            # Eliminar scripts, estilos y menús de navegación comunes para limpiar el texto
-            for element in soup(['script', 'style', 'nav', 'footer', 'header']):
-                element.decompose()
-            
-            texto = soup.get_text(separator=' ', strip=True)
-            
-            await browser.close()
-            
-            # Limitar a los primeros 10,000 caracteres para no saturar el contexto
-            resultado = texto[:10000]
-            print(f"   ✅ [SCRAPER] Contenido extraído ({len(resultado)} caracteres).")
-            return resultado
+        # HTTP directo (o 304 sin descargar); Chromium solo si la web depende de JS
+        texto, via = await extractor_web.extraer_texto(url)
+        
+        # Limitar a los primeros 10,000 caracteres para no saturar el contexto
+        resultado = texto[:MAX_CARACTERES]
+        print(f"   ✅ [SCRAPER] Contenido extraído vía {via} ({len(resultado)} caracteres).")
+        return resultado
             
     except Exception as e:
+        # Se propaga: ejecutar_tools lo devuelve como "Error en herramienta ..."
+        # y CacheTools no guarda un fallo transitorio para todos los hilos
         print(f"   ❌ [SCRAPER] Error navegando a {url}: {e}")
-        return f"No se pudo extraer el contenido de la web: {e}"
+        raise
 
 # Función para obtener las herramientas de este módulo
 def obtener_herramientas_scraping():
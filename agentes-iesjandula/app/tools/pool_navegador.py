@@ -0,0 +1,195 @@
+"""
+pool_navegador.py — IES Jándula
+Chromium de larga vida con contextos calientes para extraer_contenido_web.
+
+Antes cada llamada a la tool lanzaba un Chromium nuevo (segundos de
+arranque y cientos de MB) y esperaba siempre a 'networkidle'. Ahora:
+
+- Un único navegador por proceso, lanzado al primer uso (o en el warmup con
+  WARMUP_NAVEGADOR=true) y relanzado automáticamente si se cae.
+- Hasta NAVEGADOR_CONTEXTOS contextos reutilizables; son también el límite
+  de páginas simultáneas (el resto espera turno). Cada contexto se recicla
+  tras NAVEGADOR_PAGINAS_POR_CONTEXTO páginas para no acumular memoria,
+  cookies ni caché.
+- Se bloquean las peticiones de NAVEGADOR_BLOQUEAR (por defecto imágenes,
+  fuentes y multimedia): para extraer texto no hacen falta.
+- NAVEGADOR_WAIT_UNTIL (domcontentloaded por defecto) en vez de networkidle,
+  más una espera corta y acotada (NAVEGADOR_IDLE_MS) a que la red se calme
+  para las páginas que pintan el contenido con JavaScript.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+_ESTRATEGIAS_ESPERA = ("commit", "domcontentloaded", "load", "networkidle")
+
+
+class PoolNavegador:
+    def __init__(self):
+        self._max_contextos = max(1, int(os.getenv("NAVEGADOR_CONTEXTOS", "3")))
+        self._paginas_por_contexto = int(os.getenv("NAVEGADOR_PAGINAS_POR_CONTEXTO", "50"))
+        self._timeout_ms = int(os.getenv("NAVEGADOR_TIMEOUT_MS", "20000"))
+        self._idle_ms = int(os.getenv("NAVEGADOR_IDLE_MS", "1500"))
+        self._bloquear = {
+            t.strip() for t in os.getenv("NAVEGADOR_BLOQUEAR", "image,font,media").split(",") if t.strip()
+        }
+        espera = os.getenv("NAVEGADOR_WAIT_UNTIL", "domcontentloaded").strip().lower()
+        self._wait_until = espera if espera in _ESTRATEGIAS_ESPERA else "domcontentloaded"
+
+        self._playwright = None
+        self._navegador = None
+        self._cerrojo_lanzar = asyncio.Lock()
+        self._semaforo = asyncio.Semaphore(self._max_contextos)
+        self._libres: list = []  # contextos calientes (LIFO: el último usado primero)
+        self._usos: dict[int, int] = {}  # id(contexto) → páginas servidas
+
+        self._metricas = {
+            "paginas": 0, "errores": 0, "lanzamientos": 0, "contextos_reciclados": 0,
+            "peticiones_bloqueadas": 0, "espera_total_ms": 0.0, "espera_max_ms": 0.0,
+        }
+
+    # ── Navegador y contextos ─────────────────────────────────────────────────
+
+    async def _obtener_navegador(self):
+        if self._navegador is not None and self._navegador.is_connected():
+            return self._navegador
+        async with self._cerrojo_lanzar:
+            if self._navegador is not None and self._navegador.is_connected():
+                return self._navegador
+            if self._navegador is not None:
+                print("⚠️ [NAVEGADOR] Chromium se ha caído → relanzando")
+                self._libres.clear()
+                self._usos.clear()
+            if self._playwright is None:
+                from playwright.async_api import async_playwright
+                self._playwright = await async_playwright().start()
+            t0 = time.perf_counter()
+            self._navegador = await self._playwright.chromium.launch(
+                headless=True,
+                # /dev/shm es mínimo en Docker: sin esto Chromium se cuelga en páginas grandes
+                args=["--disable-dev-shm-usage"],
+            )
+            self._metricas["lanzamientos"] += 1
+            print(f"🌐 [NAVEGADOR] Chromium lanzado en {(time.perf_counter() - t0) * 1000:.0f} ms")
+            return self._navegador
+
+    async def _filtrar_peticion(self, route) -> None:
+        if route.request.resource_type in self._bloquear:
+            self._metricas["peticiones_bloqueadas"] += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _nuevo_contexto(self, navegador):
+        contexto = await navegador.new_context(service_workers="block")
+        if self._bloquear:
+            await contexto.route("**/*", self._filtrar_peticion)
+        self._usos[id(contexto)] = 0
+        return contexto
+
+    async def _cerrar_contexto(self, contexto) -> None:
+        self._usos.pop(id(contexto), None)
+        try:
+            await contexto.close()
+        except Exception:
+            pass  # navegador caído: el contexto ya no existe
+
+    async def _tomar(self):
+        t0 = time.perf_counter()
+        await self._semaforo.acquire()
+        try:
+            navegador = await self._obtener_navegador()
+            while self._libres:
+                contexto = self._libres.pop()
+                if contexto.browser is navegador:
+                    break
+                await self._cerrar_contexto(contexto)  # de un Chromium anterior
+            else:
+                contexto = await self._nuevo_contexto(navegador)
+        except BaseException:
+            self._semaforo.release()
+            raise
+        espera_ms = (time.perf_counter() - t0) * 1000
+        self._metricas["espera_total_ms"] += espera_ms
+        self._metricas["espera_max_ms"] = max(self._metricas["espera_max_ms"], espera_ms)
+        return contexto
+
+    def _devolver(self, contexto) -> None:
+        usos = self._usos.get(id(contexto), 0) + 1
+        self._usos[id(contexto)] = usos
+        if usos >= self._paginas_por_contexto or not contexto.browser.is_connected():
+            self._metricas["contextos_reciclados"] += 1
+            asyncio.ensure_future(self._cerrar_contexto(contexto))
+        else:
+            self._libres.append(contexto)
+        self._semaforo.release()
+
+    # ── API pública ───────────────────────────────────────────────────────────
+
+    async def obtener_html(self, url: str) -> str:
+        """HTML renderizado de 'url' usando un contexto caliente del pool."""
+        contexto = await self._tomar()
+        try:
+            pagina = await contexto.new_page()
+            try:
+                await pagina.goto(url, timeout=self._timeout_ms, wait_until=self._wait_until)
+                if self._idle_ms > 0 and self._wait_until != "networkidle":
+                    try:
+                        await pagina.wait_for_load_state("networkidle", timeout=self._idle_ms)
+                    except Exception:
+                        pass  # web con peticiones continuas (analytics, sockets): seguimos
+                html = await pagina.content()
+            finally:
+                await pagina.close()
+            self._metricas["paginas"] += 1
+            return html
+        except Exception:
+            self._metricas["errores"] += 1
+            raise
+        finally:
+            self._devolver(contexto)
+
+    async def precalentar(self) -> str:
+        """Lanza Chromium y deja todos los contextos creados y listos."""
+        navegador = await self._obtener_navegador()
+        while len(self._usos) < self._max_contextos:
+            self._libres.append(await self._nuevo_contexto(navegador))
+        return f"chromium + {len(self._libres)} contextos"
+
+    async def cerrar(self) -> None:
+        for contexto in self._libres:
+            await self._cerrar_contexto(contexto)
+        self._libres.clear()
+        if self._navegador is not None:
+            try:
+                await self._navegador.close()
+            except Exception:
+                pass
+            self._navegador = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def stats(self) -> dict:
+        m = self._metricas
+        atendidas = m["paginas"] + m["errores"]
+        return {
+            "activo": self._navegador is not None and self._navegador.is_connected(),
+            "wait_until": self._wait_until,
+            "contextos_max": self._max_contextos,
+            "contextos_abiertos": len(self._usos),
+            "contextos_libres": len(self._libres),
+            "paginas": m["paginas"],
+            "errores": m["errores"],
+            "lanzamientos": m["lanzamientos"],
+            "contextos_reciclados": m["contextos_reciclados"],
+            "peticiones_bloqueadas": m["peticiones_bloqueadas"],
+            "espera_media_ms": round(m["espera_total_ms"] / atendidas, 1) if atendidas else 0,
+            "espera_max_ms": round(m["espera_max_ms"], 1),
+        }
+
+
+pool_navegador = PoolNavegador()
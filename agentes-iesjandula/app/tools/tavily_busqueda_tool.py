@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from tavily import TavilyClient
+from tavily import AsyncTavilyClient
 
 load_dotenv()
 
@@ -10,7 +10,9 @@ client = None
 if api_key is None:
     print("⚠️ No se encontró TAVILY_API_KEY en el archivo .env")
 else:
-    client = TavilyClient(api_key=api_key)
+    # Cliente asíncrono (httpx): al cancelar la tarea (p.ej. la petición de
+    # respaldo que pierde el hedging de LatenciaTools) se corta la petición HTTP
+    client = AsyncTavilyClient(api_key=api_key)
 
 from langchain_core.tools import tool
 
@@ -23,7 +25,7 @@ DOMINIOS_IES = [
 ]
 
 @tool
-def busqueda_web_ies_jandula(search: str) -> str:
+async def busqueda_web_ies_jandula(search: str) -> str:
     """Busca información EXHAUSTIVA en la web oficial del IES Jándula y sitios relacionados.
     USA ESTA HERRAMIENTA para: noticias, actividades, FP, secretaría, plazos y cualquier 
     dato público del centro.
@@ -37,7 +39,7 @@ def busqueda_web_ies_jandula(search: str) -> str:
     try:
         # 1. Intento inicial restringido a dominios del centro
         print(f"   🔍 Buscando en dominios del centro...")
-        response = client.search(
+        response = await client.search(
             query=search,
             search_depth="advanced",
             max_results=8,
@@ -48,7 +50,7 @@ def busqueda_web_ies_jandula(search: str) -> str:
         if not response.get("results") or len(response["results"]) < 2:
             print(f"   ⚠️ Pocos resultados en dominios oficiales. Ampliando búsqueda...")
             query_ampliada = f"{search} IES Jándula Andújar"
-            response = client.search(
+            response = await client.search(
                 query=query_ampliada,
                 search_depth="advanced",
                 max_results=10
@@ -66,11 +68,12 @@ def busqueda_web_ies_jandula(search: str) -> str:
         return "\n---\n".join(contexto)
 
     except Exception as e:
+        # Se propaga: un fallo rápido no debe ganar el hedging ni entrar en CacheTools
         print(f"   ❌ Error en búsqueda exhaustiva: {e}")
-        return f"Error al realizar la búsqueda: {e}"
+        raise
 
 @tool
-def busqueda_web_general(search: str) -> str:
+async def busqueda_web_general(search: str) -> str:
     """Busca información GENERAL en todo internet con profundidad avanzada.
     USA ESTA HERRAMIENTA para: normativa educativa (LOMLOE, Junta de Andalucía), 
     legislación, Séneca, iPasen y temas educativos globales."""
@@ -81,7 +84,7 @@ def busqueda_web_general(search: str) -> str:
     print(f"\n🌍 [TOOL: busqueda_web_general] Búsqueda profunda: {search}")
     
     try:
-        response = client.search(
+        response = await client.search(
             query=search,
             search_depth="advanced",
             max_results=8
@@ -93,7 +96,8 @@ def busqueda_web_general(search: str) -> str:
             
         return "\n---\n".join(contexto)
     except Exception as e:
-        return f"Error en búsqueda general: {e}"
+        print(f"   ❌ Error en búsqueda general: {e}")
+        raise
 
 # Exportamos las funciones
 tool_busqueda_web_centro = busqueda_web_ies_jandula
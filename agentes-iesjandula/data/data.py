@@ -1,6 +1,10 @@
 import gc
+import math
 import os
+import re
+import threading
 import time
+import unicodedata
 import uuid
 
 from dotenv import load_dotenv
@@ -10,6 +14,7 @@ import chromadb
 from chromadb.api.types import EmbeddingFunction
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from pypdf import PdfReader
+from rapidfuzz import fuzz
 from docling.document_converter import DocumentConverter, PdfFormatOption
 from docling.datamodel.base_models import InputFormat
 from docling.datamodel.pipeline_options import PdfPipelineOptions
@@ -338,8 +343,15 @@ def query_coleccion(coleccion, query: str, n_results: int = 8, include=None):
     if include is None:
         include = ["documents", "metadatas", "distances"]
 
+    # ¿Lo adelantó el prefetch especulativo del clasificador? Si no, puede que
+    # ya haya calculado el embedding de la consulta al compararla.
+    prefetch, vector = _servir_prefetch(coleccion, query, n_results, include)
+    if prefetch is not None:
+        return prefetch
+
     # Calcular embedding manualmente → List[float]
-    vector: list[float] = embedding_fn.embed_query(query)
+    if vector is None:
+        vector = embedding_fn.embed_query(query)
 
     # ChromaDB espera query_embeddings: List[List[float]]
     return coleccion.query(
@@ -349,6 +361,170 @@ def query_coleccion(coleccion, query: str, n_results: int = 8, include=None):
     )
 
 
+# ---------------------------------------------------------------------------
+# Prefetch especulativo (PREFETCH_ESPECULATIVO=true)
+# ---------------------------------------------------------------------------
+# Mientras el clasificador llama al LLM, se calcula UNA vez el embedding de la
+# pregunta y se consultan las colecciones probables. Si después el chatbot
+# llama a una tool RAG de esa colección, query_coleccion sirve el resultado
+# adelantado (esperando si aún está en curso) en vez de repetirlo cuando:
+# - la consulta es textualmente casi igual a la pregunta (PREFETCH_SIMILITUD,
+#   0-100): se ahorra embedding + consulta; o
+# - el LLM la reformuló pero su embedding es casi el mismo (coseno ≥
+#   PREFETCH_SIMILITUD_EMBEDDING): se ahorra la consulta. Si no lo es, ese
+#   embedding se reutiliza para la consulta real, así que comparar no cuesta nada.
+PREFETCH_TTL_S = float(os.getenv("PREFETCH_TTL_SEGUNDOS", "60"))
+PREFETCH_SIMILITUD = float(os.getenv("PREFETCH_SIMILITUD", "90"))
+PREFETCH_SIMILITUD_EMBEDDING = float(os.getenv("PREFETCH_SIMILITUD_EMBEDDING", "0.9"))
+PREFETCH_N_RESULTADOS = 8
+_PREFETCH_ESPERA_MAX_S = 10.0
+_PREFETCH_INCLUDE = ["documents", "metadatas", "distances"]
+
+# {coleccion, query, n, evento, vector, resultado, coste_ms, coste_consulta_ms, creado, usado}
+_prefetch: list[dict] = []
+_prefetch_lock = threading.Lock()
+_prefetch_metricas = {"turnos": 0, "lanzados": 0, "aciertos": 0, "aciertos_embedding": 0,
+                      "fallos": 0, "sin_usar": 0, "ahorro_total_ms": 0.0, "espera_total_ms": 0.0}
+
+
+def _coseno(a: list[float], b: list[float]) -> float:
+    normas = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return sum(x * y for x, y in zip(a, b)) / normas if normas else 0.0
+
+
+def _normalizar_consulta(texto: str) -> str:
+    t = unicodedata.normalize("NFD", texto.lower())
+    t = "".join(c for c in t if unicodedata.category(c) != "Mn")
+    return " ".join(re.sub(r"[^\w ]+", " ", t).split())
+
+
+def _purgar_prefetch(ahora: float) -> None:
+    vivos = []
+    for e in _prefetch:
+        if ahora - e["creado"] < PREFETCH_TTL_S:
+            vivos.append(e)
+        elif not e["usado"]:
+            _prefetch_metricas["sin_usar"] += 1
+    _prefetch[:] = vivos
+
+
+def prefetch_colecciones(query: str, perfiles: list[str]) -> None:
+    """
+    Embebe 'query' una vez y consulta las colecciones de 'perfiles' (bloqueante:
+    lanzar con asyncio.to_thread). Los resultados quedan disponibles para
+    query_coleccion durante PREFETCH_TTL_SEGUNDOS.
+    """
+    t0 = time.perf_counter()
+    ahora = time.time()
+    consulta = _normalizar_consulta(query)
+    entradas = []
+    with _prefetch_lock:
+        _purgar_prefetch(ahora)
+        for perfil in perfiles:
+            entrada = {
+                "coleccion": _PERFIL_A_COLECCION[perfil], "query": consulta,
+                "n": PREFETCH_N_RESULTADOS, "evento": threading.Event(), "vector": None,
+                "resultado": None, "coste_ms": 0.0, "coste_consulta_ms": 0.0,
+                "creado": ahora, "usado": False,
+            }
+            _prefetch.append(entrada)
+            entradas.append((perfil, entrada))
+        _prefetch_metricas["turnos"] += 1
+        _prefetch_metricas["lanzados"] += len(entradas)
+
+    try:
+        vector = embedding_fn.embed_query(query)
+        coste_embedding = (time.perf_counter() - t0) * 1000
+        for perfil, entrada in entradas:
+            entrada["vector"] = vector
+            t1 = time.perf_counter()
+            try:
+                col = obtener_coleccion(perfil)
+                entrada["resultado"] = col.query(
+                    query_embeddings=[vector], n_results=entrada["n"], include=_PREFETCH_INCLUDE,
+                )
+                # Lo que habría costado la consulta de la tool: embedding + query
+                entrada["coste_consulta_ms"] = (time.perf_counter() - t1) * 1000
+                entrada["coste_ms"] = coste_embedding + entrada["coste_consulta_ms"]
+            except Exception as e:
+                print(f"   ⚠️ [PREFETCH] {perfil}: {e}")
+            finally:
+                entrada["evento"].set()
+    finally:
+        for _, entrada in entradas:
+            entrada["evento"].set()  # nunca dejar esperando a una tool
+
+
+def _servir_prefetch(coleccion, query: str, n_results: int, include: list):
+    """
+    (resultado adelantado equivalente a la consulta o None, embedding de la
+    consulta si hubo que calcularlo para compararla o None).
+    """
+    if not _prefetch or n_results > PREFETCH_N_RESULTADOS or not set(include) <= set(_PREFETCH_INCLUDE):
+        return None, None
+    consulta = _normalizar_consulta(query)
+    nombre = getattr(coleccion, "name", None)
+    with _prefetch_lock:
+        _purgar_prefetch(time.time())
+        candidatas = [e for e in _prefetch if e["coleccion"] == nombre]
+    if not candidatas:
+        return None, None
+
+    # 1. Misma pregunta (casi) literal: ni siquiera hace falta embeber
+    textuales = [e for e in candidatas if fuzz.token_set_ratio(e["query"], consulta) >= PREFETCH_SIMILITUD]
+    entrada = (textuales or candidatas)[-1]
+    t0 = time.perf_counter()
+    entrada["evento"].wait(_PREFETCH_ESPERA_MAX_S)
+    espera_ms = (time.perf_counter() - t0) * 1000
+    if entrada["resultado"] is None:
+        return None, None
+
+    vector = None
+    if textuales:
+        ahorro_ms = entrada["coste_ms"] - espera_ms
+    else:
+        # 2. Consulta reformulada: comparar embeddings (el nuestro se necesita igualmente)
+        vector = embedding_fn.embed_query(query)
+        similitud = _coseno(vector, entrada["vector"] or [])
+        if similitud < PREFETCH_SIMILITUD_EMBEDDING:
+            _prefetch_metricas["fallos"] += 1
+            return None, vector
+        _prefetch_metricas["aciertos_embedding"] += 1
+        ahorro_ms = entrada["coste_consulta_ms"] - espera_ms
+
+    entrada["usado"] = True
+    ahorro_ms = max(0.0, ahorro_ms)
+    _prefetch_metricas["aciertos"] += 1
+    _prefetch_metricas["ahorro_total_ms"] += ahorro_ms
+    _prefetch_metricas["espera_total_ms"] += espera_ms
+    print(f"   ⚡ [PREFETCH] '{nombre}' servido desde prefetch "
+          f"({'texto' if textuales else 'embedding'}, ahorro ~{ahorro_ms:.0f} ms)")
+    return {
+        clave: [valores[0][:n_results]] if valores else valores
+        for clave, valores in entrada["resultado"].items()
+        if clave in include or clave == "ids"
+    }, vector
+
+
+def stats_prefetch() -> dict:
+    m = _prefetch_metricas
+    return {
+        "activo": os.getenv("PREFETCH_ESPECULATIVO", "false").strip().lower() in ("1", "true", "yes"),
+        "turnos": m["turnos"],
+        "lanzados": m["lanzados"],
+        "aciertos": m["aciertos"],
+        "aciertos_embedding": m["aciertos_embedding"],
+        "fallos": m["fallos"],
+        "sin_usar": m["sin_usar"],
+        # aciertos sobre las consultas RAG que encontraron un prefetch de su colección
+        "tasa_acierto": round(m["aciertos"] / (m["aciertos"] + m["fallos"]), 3)
+        if m["aciertos"] + m["fallos"] else 0,
+        "ahorro_total_ms": round(m["ahorro_total_ms"]),
+        "ahorro_medio_por_turno_ms": round(m["ahorro_total_ms"] / m["turnos"]) if m["turnos"] else 0,
+        "espera_media_ms": round(m["espera_total_ms"] / m["aciertos"]) if m["aciertos"] else 0,
+    }
+
+
 def _get_fresh_collection(nombre_coleccion: str):
     """
     Siempre obtiene una referencia FRESCA de ChromaDB.
@@ -0,0 +1,69 @@
+"""
+generar_grafo.py — CLI para renderizar el grafo LangGraph a PNG.
+
+La imagen ya no se genera en cada compilación del grafo (coste de arranque);
+se hace bajo demanda con este script o con POST /api/admin/grafo/imagen.
+
+Uso:
+    python generar_grafo.py
+    python generar_grafo.py --perfil alumnos --voz --salida grafo_alumnos_voz.png
+"""
+
+import sys
+import os
+import argparse
+import asyncio
+
+# Fix sqlite3 en Linux (mismo que main.py)
+if sys.platform.startswith("linux"):
+    __import__("pysqlite3")
+    sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
+
+# Asegurar que el directorio raíz esté en el path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+if _HERE not in sys.path:
+    sys.path.insert(0, _HERE)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app.agents.AgentConfig import cerrar_checkpointer, guardar_imagen_grafo
+
+
+async def _generar(perfil: str, es_voz: bool, ruta: str) -> None:
+    try:
+        await guardar_imagen_grafo(perfil, es_voz=es_voz, ruta=ruta)
+    finally:
+        # La conexión aiosqlite vive en un hilo no daemon: sin cerrarla el script no termina
+        await cerrar_checkpointer()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Genera la imagen PNG del grafo del agente IES Jándula.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument(
+        "--perfil",
+        default="profesores",
+        choices=["profesores", "alumnos"],
+        help="Perfil cuyo grafo se renderiza (por defecto: profesores).",
+    )
+    parser.add_argument(
+        "--voz",
+        action="store_true",
+        help="Renderizar la variante de voz del grafo.",
+    )
+    parser.add_argument(
+        "--salida",
+        default="grafo_ies_jandula.png",
+        help="Ruta del PNG de salida (por defecto: grafo_ies_jandula.png).",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(_generar(args.perfil, args.voz, args.salida))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,7 @@ from dotenv import load_dotenv
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# GZip selectivo: NUNCA comprimir respuestas SSE (text/event-stream).
+# GZip selectivo: NUNCA comprimir respuestas en streaming (SSE y audio).
 # Comprimir un stream rompe el chunked-encoding sobre HTTP/2 y provoca
 # ERR_HTTP2_PROTOCOL_ERROR en el navegador (el stream nunca llega).
 # ─────────────────────────────────────────────────────────────────────────────
@@ -41,7 +41,9 @@ class SelectiveGZipMiddleware:
 from app.api.routes.AgentRoutes import router as agent_router
 from app.api.routes.RagRoutes import router as rag_router
 from app.api.routes.AdminRoutes import router as admin_router
-from app.api.services.AgenteService import agents_service
+from app.api.services.WarmupService import warmup_service
+from app.api.services.CheckpointService import checkpoint_service
+from app.agents.CacheTools import invalidar_tools_rag
 from data.data import inicializar_bases_datos, seed_legislacion_folder, seed_centro_folder
 
 load_dotenv()
@@ -50,6 +52,7 @@ async def _seed_task():
     """Tarea en background: indexa documentos de data/legislacion/ al arrancar."""
     try:
         await asyncio.to_thread(seed_legislacion_folder)
+        invalidar_tools_rag("legislacion")
     except Exception as e:
         print(f"⚠️ [SEED] Error en tarea de seed de legislación: {e}")
 
@@ -58,6 +61,7 @@ async def _seed_centro_task():
     """Tarea en background: indexa documentos curados de data/centro/ al arrancar."""
     try:
         await asyncio.to_thread(seed_centro_folder)
+        invalidar_tools_rag("centro")
     except Exception as e:
         print(f"⚠️ [SEED] Error en tarea de seed del centro: {e}")
 
@@ -89,14 +93,36 @@ async def lifespan(app: FastAPI):
         else:
             print("⏭️  Seed del centro DESACTIVADO (SEED_CENTRO!=true).")
 
-        print("🚀 Inicializando Cerebro del Agente (Modo Texto/Profesores)...")
-        await agents_service.procesar_chat("Hola", perfil="profesores")
-        print("✅ Sistema listo para recibir consultas.")
+        # Pre-calentamiento SIN llamar al LLM (no gasta cuota de Gemini).
+        # Corre en segundo plano: el progreso se consulta en GET /api/ready.
+        print("🚀 Pre-calentando grafos, memoria, ChromaDB y embeddings en segundo plano...")
+        app.state.tarea_warmup = asyncio.create_task(warmup_service.ejecutar())
+
+        # Retención/compactación periódica de checkpoints.db (memoria conversacional)
+        app.state.tarea_checkpoints = asyncio.create_task(checkpoint_service.bucle_periodico())
     except Exception as e:
         print(f"⚠️ Nota: El pre-calentamiento falló, pero la app arrancará: {e}")
 
     yield
     print("\nFinalizando aplicación...")
+    tarea = getattr(app.state, "tarea_checkpoints", None)
+    if tarea is not None:
+        tarea.cancel()
+    from app.agents.abilities.PoolVoz import pool_voz
+    pool_voz.cerrar()
+    try:
+        from app.tools.pool_navegador import pool_navegador
+        await pool_navegador.cerrar()
+        from app.tools.extraccion_web import extractor_web
+        await extractor_web.cerrar()
+    except Exception as e:
+        print(f"⚠️ Error cerrando el navegador: {e}")
+    # Con CHECKPOINT_MODO=diferido vuelca a disco la memoria conversacional pendiente
+    try:
+        from app.agents.AgentConfig import cerrar_checkpointer
+        await cerrar_checkpointer()
+    except Exception as e:
+        print(f"⚠️ Error cerrando el checkpointer: {e}")
 
 # Crear aplicación FastAPI
 app = FastAPI(
@@ -111,7 +137,7 @@ app = FastAPI(
 app.add_middleware(
     SelectiveGZipMiddleware,
     minimum_size=500,
-    exclude_paths=("/api/chat/stream",),
+    exclude_paths=("/api/chat/stream", "/api/speak/stream"),
 )
 
 # Configurar CORS
@@ -133,6 +159,7 @@ app.add_middleware(
     allow_credentials=_allow_credentials,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Transcripcion", "X-Run-Id"],
 )
 
 from fastapi.responses import FileResponse
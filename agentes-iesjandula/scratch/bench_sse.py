@@ -0,0 +1,91 @@
+"""
+Benchmark del pipeline SSE: un frame por token (antes) vs tokens agrupados
+(StreamService). Simula N streams concurrentes que emiten tokens al ritmo
+de un LLM, escribe cada frame en un socket y mide frames, eventos/s y CPU
+por stream.
+
+    python scratch/bench_sse.py --streams 200 --tokens 400 --intervalo-ms 5
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import time
+
+# Se carga el módulo por ruta para no importar app.api.services (Chroma, LLMs...)
+_RUTA = os.path.join(os.path.dirname(__file__), "..", "app", "api", "services", "StreamService.py")
+_spec = importlib.util.spec_from_file_location("StreamService", _RUTA)
+StreamService = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(StreamService)
+
+
+async def fuente(n_tokens: int, intervalo_s: float):
+    yield {"tipo": "herramienta", "nombre": "guia_profesorado"}
+    for i in range(n_tokens):
+        await asyncio.sleep(intervalo_s)
+        yield {"tipo": "token", "texto": f"palabra{i} "}
+    yield {"tipo": "fin", "fuentes": ["guia.pdf"]}
+
+
+async def antes(n_tokens: int, intervalo_s: float):
+    """Pipeline original: json.dumps y un chunk por evento."""
+    async for evento in fuente(n_tokens, intervalo_s):
+        yield f"data: {json.dumps(evento, ensure_ascii=False)}\n\n"
+
+
+async def consumir(gen) -> tuple[int, int]:
+    """Escribe cada frame en un socket (una escritura por frame, como el servidor ASGI)."""
+    loop = asyncio.get_running_loop()
+    emisor, receptor = socket.socketpair()
+    emisor.setblocking(False)
+    receptor.setblocking(False)
+
+    async def _drenar():
+        while await loop.sock_recv(receptor, 65536):
+            pass
+
+    lector = asyncio.create_task(_drenar())
+    frames = n_bytes = 0
+    async for frame in gen:
+        datos = frame if isinstance(frame, bytes) else frame.encode()
+        await loop.sock_sendall(emisor, datos)
+        frames += 1
+        n_bytes += len(datos)
+    emisor.close()
+    await lector
+    receptor.close()
+    return frames, n_bytes
+
+
+async def medir(nombre: str, fabrica, streams: int) -> None:
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    resultados = await asyncio.gather(*[consumir(fabrica()) for _ in range(streams)])
+    cpu, pared = time.process_time() - cpu0, time.perf_counter() - t0
+    frames = sum(r[0] for r in resultados)
+    print(f"{nombre:<22} frames={frames:>8}  frames/s={frames / pared:>9.0f}  "
+          f"CPU/stream={cpu / streams * 1000:>7.2f} ms  pared={pared:.2f}s")
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--streams", type=int, default=200)
+    ap.add_argument("--tokens", type=int, default=400)
+    ap.add_argument("--intervalo-ms", type=float, default=5)
+    ap.add_argument("--ventana-ms", type=float, default=30)
+    args = ap.parse_args()
+    intervalo = args.intervalo_ms / 1000
+    eventos = args.streams * (args.tokens + 2)
+    print(f"{args.streams} streams × {args.tokens} tokens cada {args.intervalo_ms} ms "
+          f"({eventos} eventos)\n")
+
+    await medir("un frame por token", lambda: antes(args.tokens, intervalo), args.streams)
+    servicio = StreamService.StreamService(ventana_s=args.ventana_ms / 1000)
+    await medir(f"agrupado {args.ventana_ms:.0f} ms",
+                lambda: servicio.emitir(servicio.lanzar(fuente(args.tokens, intervalo))), args.streams)
+    print(f"\neventos por frame (agrupado): {servicio.stats()['eventos_por_frame']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
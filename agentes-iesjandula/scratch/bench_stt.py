@@ -0,0 +1,130 @@
+"""
+Benchmark de los backends de STT (BackendsSTT): velocidad y calidad sobre un
+conjunto fijo de clips en español.
+
+Cada clip es un audio (wav, webm, ogg, mp3...) con su transcripción de
+referencia al lado, con el mismo nombre y extensión .txt:
+
+    scratch/muestras_stt/horario_secretaria.webm
+    scratch/muestras_stt/horario_secretaria.txt
+
+Métricas por backend:
+- carga:  tiempo de carga del modelo
+- RTF:    tiempo de transcripción / duración del audio (menor = mejor; <1 = más rápido que tiempo real)
+- WER:    word error rate frente a la referencia (sin mayúsculas ni puntuación)
+- RTF lote: lo mismo transcribiendo los clips en lotes de --lote (micro-batching)
+
+    python scratch/bench_stt.py --muestras scratch/muestras_stt
+    python scratch/bench_stt.py --backends faster-whisper --modelo small --compute-type int8 --sin-vad
+"""
+import argparse
+import importlib.util
+import os
+import re
+import time
+import unicodedata
+from pathlib import Path
+
+# Se carga el módulo por ruta para no importar app.agents (grafo, LLMs...)
+_RUTA = os.path.join(os.path.dirname(__file__), "..", "app", "agents", "abilities", "BackendsSTT.py")
+_spec = importlib.util.spec_from_file_location("BackendsSTT", _RUTA)
+BackendsSTT = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(BackendsSTT)
+
+_EXTENSIONES_AUDIO = {".wav", ".webm", ".ogg", ".mp3", ".m4a", ".flac"}
+
+
+def normalizar(texto: str) -> list[str]:
+    texto = unicodedata.normalize("NFC", texto.lower())
+    return re.sub(r"[^\w\s]", " ", texto).split()
+
+
+def wer(referencia: str, hipotesis: str) -> tuple[int, int]:
+    """(errores, palabras de la referencia) por distancia de edición entre palabras."""
+    ref, hip = normalizar(referencia), normalizar(hipotesis)
+    fila = list(range(len(hip) + 1))
+    for i, r in enumerate(ref, 1):
+        anterior, fila[0] = fila[0], i
+        for j, h in enumerate(hip, 1):
+            anterior, fila[j] = fila[j], min(fila[j] + 1, fila[j - 1] + 1, anterior + (r != h))
+    return fila[-1], len(ref)
+
+
+def cargar_muestras(directorio: Path) -> list[tuple[Path, str, float]]:
+    muestras = []
+    for audio in sorted(directorio.iterdir()):
+        referencia = audio.with_suffix(".txt")
+        if audio.suffix.lower() not in _EXTENSIONES_AUDIO or not referencia.exists():
+            continue
+        duracion = len(BackendsSTT.cargar_audio(str(audio))) / BackendsSTT.SAMPLE_RATE_STT
+        muestras.append((audio, referencia.read_text(encoding="utf-8").strip(), duracion))
+    return muestras
+
+
+def medir(nombre: str, args, muestras) -> dict:
+    t0 = time.perf_counter()
+    if nombre == "faster-whisper":
+        backend = BackendsSTT.STTFasterWhisper(args.modelo, compute_type=args.compute_type)
+    else:
+        backend = BackendsSTT.STTTransformers(args.modelo)
+    carga_s = time.perf_counter() - t0
+
+    backend.transcribir(str(muestras[0][0]))  # calentamiento (no cuenta)
+
+    tiempo = duracion = errores = palabras = 0
+    for audio, referencia, segundos in muestras:
+        t0 = time.perf_counter()
+        texto = backend.transcribir(str(audio))
+        transcurrido = time.perf_counter() - t0
+        e, n = wer(referencia, texto)
+        print(f"   {audio.name:<32} {segundos:5.1f}s  RTF {transcurrido / segundos:5.2f}  "
+              f"WER {e / max(n, 1):6.1%}  → {texto[:60]}")
+        tiempo += transcurrido
+        duracion += segundos
+        errores += e
+        palabras += n
+
+    t0 = time.perf_counter()
+    errores_lote = 0
+    for i in range(0, len(muestras), args.lote):
+        grupo = muestras[i:i + args.lote]
+        textos = backend.transcribir_lote([str(audio) for audio, _, _ in grupo])
+        errores_lote += sum(wer(referencia, texto)[0] for (_, referencia, _), texto in zip(grupo, textos))
+    rtf_lote = (time.perf_counter() - t0) / duracion
+    return {
+        "carga_s": carga_s, "rtf": tiempo / duracion, "wer": errores / max(palabras, 1),
+        "rtf_lote": rtf_lote, "wer_lote": errores_lote / max(palabras, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--muestras", default=os.path.join(os.path.dirname(__file__), "muestras_stt"))
+    parser.add_argument("--backends", default="transformers,faster-whisper")
+    parser.add_argument("--modelo", default=BackendsSTT.STT_MODELO)
+    parser.add_argument("--compute-type", default=BackendsSTT.STT_COMPUTE_TYPE)
+    parser.add_argument("--sin-vad", action="store_true")
+    parser.add_argument("--lote", type=int, default=8)
+    args = parser.parse_args()
+
+    BackendsSTT.STT_VAD = not args.sin_vad
+    muestras = cargar_muestras(Path(args.muestras))
+    if not muestras:
+        raise SystemExit(f"No hay clips con su .txt de referencia en {args.muestras}")
+    total_s = sum(m[2] for m in muestras)
+    print(f"{len(muestras)} clips, {total_s:.0f}s de audio | modelo={args.modelo} "
+          f"VAD={'no' if args.sin_vad else 'sí'}\n")
+
+    resultados = {}
+    for nombre in args.backends.split(","):
+        print(f"── {nombre} ──")
+        resultados[nombre] = medir(nombre.strip(), args, muestras)
+
+    print(f"\n{'backend':<16}{'carga':>9}{'RTF':>8}{'WER':>9}{'RTF lote':>10}{'WER lote':>10}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<16}{r['carga_s']:>8.1f}s{r['rtf']:>8.2f}{r['wer']:>9.1%}"
+              f"{r['rtf_lote']:>10.2f}{r['wer_lote']:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+servidor_llm_local.py — Servidor LLM de pega, compatible con la API de OpenAI.
+
+Sirve para probar el router multi-proveedor (LLM_ROUTER) sin red ni cuota:
+responde a /v1/chat/completions (normal y stream) con un texto fijo y puede
+simular fallos 429/5xx y latencia.
+
+Uso:
+    python scratch/servidor_llm_local.py --puerto 8080 --fallo-429 0.3 --fallo-500 0.1 --latencia 0.5
+
+y en el .env:
+    LLM_ROUTER=gemini:gemini-2.5-flash,openai:local@http://localhost:8080/v1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="LLM local de pruebas")
+_CONFIG = {"fallo_429": 0.0, "fallo_500": 0.0, "latencia": 0.0, "modelo": "local"}
+
+
+def _ultimo_texto_usuario(mensajes: list) -> str:
+    for m in reversed(mensajes):
+        if m.get("role") == "user":
+            contenido = m.get("content", "")
+            if isinstance(contenido, list):
+                contenido = " ".join(p.get("text", "") for p in contenido if isinstance(p, dict))
+            return str(contenido)
+    return ""
+
+
+def _fallo_simulado() -> JSONResponse | None:
+    r = random.random()
+    if r < _CONFIG["fallo_429"]:
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "429 RESOURCE_EXHAUSTED (simulado)", "type": "rate_limit"}},
+        )
+    if r < _CONFIG["fallo_429"] + _CONFIG["fallo_500"]:
+        return JSONResponse(
+            status_code=503,
+            content={"error": {"message": "503 UNAVAILABLE (simulado)", "type": "server_error"}},
+        )
+    return None
+
+
+@app.get("/v1/models")
+async def modelos():
+    return {"object": "list", "data": [{"id": _CONFIG["modelo"], "object": "model"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat(request: Request):
+    cuerpo = await request.json()
+    await asyncio.sleep(_CONFIG["latencia"])
+
+    fallo = _fallo_simulado()
+    if fallo is not None:
+        return fallo
+
+    pregunta = _ultimo_texto_usuario(cuerpo.get("messages", []))
+    texto = f"Respuesta local de prueba a: {pregunta[:200]}"
+    id_ = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    creado = int(time.time())
+    modelo = cuerpo.get("model", _CONFIG["modelo"])
+
+    if not cuerpo.get("stream"):
+        return {
+            "id": id_, "object": "chat.completion", "created": creado, "model": modelo,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": texto}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(texto.split()), "total_tokens": 0},
+        }
+
+    async def eventos():
+        for palabra in texto.split(" "):
+            chunk = {
+                "id": id_, "object": "chat.completion.chunk", "created": creado, "model": modelo,
+                "choices": [{"index": 0, "delta": {"content": palabra + " "}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(0.02)
+        fin = {
+            "id": id_, "object": "chat.completion.chunk", "created": creado, "model": modelo,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(fin)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(eventos(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor LLM local compatible con OpenAI")
+    parser.add_argument("--puerto", type=int, default=8080)
+    parser.add_argument("--modelo", default="local")
+    parser.add_argument("--fallo-429", type=float, default=0.0, help="probabilidad de responder 429")
+    parser.add_argument("--fallo-500", type=float, default=0.0, help="probabilidad de responder 503")
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos de latencia simulada")
+    args = parser.parse_args()
+
+    _CONFIG.update(
+        fallo_429=args.fallo_429, fallo_500=args.fallo_500,
+        latencia=args.latencia, modelo=args.modelo,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.puerto)